@@ -5,22 +5,31 @@ import datetime
 import sys
 import os
 
+import pmake.where
+
 __ALL__=['CommonLog', 'LogHelper', 'open_log_file', 'verbose_set','fatal','debug_print','log_verbose_set', 'Where' ]
 
-class Where():
-    def __init__( self, filename, lineno ):
-        self.filename = os.path.abspath( filename )
-        self.lineno = lineno
-        self.column = None
+# Cache of os.path.abspath() results, one entry per unique filename.
+_abspath_cache = {}
+
+def _abspath( filename ):
+    result = _abspath_cache.get( filename )
+    if result is None:
+        result = os.path.abspath( filename )
+        _abspath_cache[ filename ] = result
+    return result
+
+class Where( pmake.where.Where ):
+    '''
+    A pmake.where.Where, with the filename made absolute.
+    '''
+    __slots__ = ()
+    def __new__( cls, filename, lineno, column = None ):
+        return pmake.where.Where.__new__( cls, _abspath( filename ), lineno, column )
     def __str__(self):
         if self.column is None:
-            txt = "%s:%d" % (self.filename,self.lineno)
-        else:
-            txt = "%s:%d: Column: %d" % (self.fileanme, self.lineno, self.column)
-    def clone( self ):
-        the_clone = Where( self.filename, self.lineno )
-        the_clone.column = self.column
-        return the_clone
+            return "%s:%d" % (self.filename,self.lineno)
+        return "%s:%d: Column: %d" % (self.filename, self.lineno, self.column)
     
 
 class CommonLog( ):
@@ -17,3 +17,6 @@ Thus it is very/quit recursive.
 '''
 from .nested_dict import NestedDict
 from .nested_dict import NestedDict_KeyError
+from .nested_dict import CompiledPath
+from .overlay import NestedDictOverlay, OverlayLevel
+from .snapshot import dump_snapshot, load_snapshot, save_snapshot, read_snapshot, SnapshotError
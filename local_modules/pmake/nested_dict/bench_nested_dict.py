@@ -0,0 +1,298 @@
+'''
+Micro benchmark for NestedDict get() and set() of dotted paths.
+
+This is not a unit test, it is run by hand:
+
+    python -m pmake.nested_dict.bench_nested_dict
+    python -m pmake.nested_dict.bench_nested_dict --keys 50000 --depth 5
+
+A config of N leaf keys, each "depth" levels deep, is built and then
+every key is read (and written) several times, as a generator would.
+The same is done with the previous recursive implementation, kept
+below for comparison only.
+
+It also makes one clone per "target" of a config and changes a few
+keys in each clone, comparing the old deep copy clone() with the
+copy on write clone().
+
+And it reads the same few paths from many small "target" NestedDicts,
+with get(), a CompiledPath and get_many().
+
+Then the config is read while other trees are changed between the
+reads (a clone of a target changed, a level replaced), as a generator
+does, and new levels are added to the config itself. The path index
+is per tree, so it survives these changes, the index size is shown.
+
+Last, a config of WhereStr values is saved and loaded with pickle and
+with a snapshot (see snapshot.py), against rebuilding it with set().
+'''
+import argparse
+import pickle
+import time
+import tracemalloc
+
+from pmake.nested_dict import NestedDict, dump_snapshot, load_snapshot
+from pmake.where import Where
+from pmake.where_str import WhereStr
+
+
+class LegacyNestedDict():
+    '''
+    The previous get()/set(), split on every call and recurse with pop(0)
+    '''
+    def __init__( self ):
+        self._dict = dict()
+
+    def set( self, path, value ):
+        self._internal_set( path.split('.'), value )
+
+    def _internal_set( self, parts, value ):
+        if len(parts) > 1:
+            name = parts.pop(0)
+            if name in self._dict:
+                nextlevel = self._dict.get(name)
+            else:
+                nextlevel = LegacyNestedDict()
+                self._dict[name] = nextlevel
+            nextlevel._internal_set( parts, value )
+            return
+        self._dict[ parts[0] ] = value
+
+    def get( self, *args ):
+        # The same argument checks as before.
+        if len(args) == 0:
+            raise TypeError( "missing path parameter")
+        path = args[0]
+        if not isinstance(path, str ):
+            raise ValueError("path parameter is not a string")
+        parts = path.split('.')
+        if len(args) > 2:
+            raise TypeError("Too many parameters")
+        return self._internal_get( [], parts )
+
+    def _internal_get( self, current_path, path ):
+        while len(path) > 1:
+            name = path.pop(0)
+            current_path.append(name)
+            value = self._dict[name]
+            return value._internal_get( current_path, path )
+        return self._dict[ path[0] ]
+
+
+def make_paths( nkeys : int, depth : int, fanout : int = 10 ) -> list:
+    '''
+    Return "nkeys" dotted paths, "depth" parts long.
+    '''
+    paths = []
+    for x in range( 0, nkeys ):
+        parts = []
+        n = x
+        for level in range( 0, depth - 1 ):
+            parts.append( "level%d_%d" % (level, n % fanout) )
+            n = n // fanout
+        parts.append( "key_%d" % x )
+        paths.append( '.'.join( parts ) )
+    return paths
+
+def run( cls, paths : list, passes : int ) -> dict:
+    nd = cls()
+    start = time.perf_counter()
+    for path in paths:
+        nd.set( path, path )
+    build = time.perf_counter() - start
+    get = nd.get
+    start = time.perf_counter()
+    for x in range( 0, passes ):
+        for path in paths:
+            get( path )
+    read = time.perf_counter() - start
+    start = time.perf_counter()
+    for x in range( 0, passes ):
+        for path in paths:
+            nd.set( path, x )
+    write = time.perf_counter() - start
+    total = len(paths) * passes
+    return {
+        'build_sec' : build,
+        'gets_per_sec' : total / read,
+        'sets_per_sec' : total / write
+    }
+
+def _deep_clone( nd ):
+    # The previous clone()
+    return NestedDict.from_dict( nd.as_dict() )
+
+def run_clones( paths : list, targets : int, changes : int ) -> dict:
+    '''
+    Clone a config "targets" times, set "changes" keys in each clone.
+    '''
+    base = NestedDict()
+    for path in paths:
+        base.set( path, path )
+    result = {}
+    for name, clone in ( ('deep', _deep_clone), ('cow', NestedDict.clone) ):
+        tracemalloc.start()
+        start = time.perf_counter()
+        clones = []
+        for x in range( 0, targets ):
+            c = clone( base )
+            for y in range( 0, changes ):
+                c.set( paths[ (x * changes + y) % len(paths) ], x )
+            clones.append( c )
+        elapsed = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        result[ name ] = ( elapsed, size / targets )
+    return result
+
+TARGET_PATHS = ( 'target.cflags', 'target.ldflags', 'target.sources', 'target.name', 'tools.cc' )
+
+def run_targets( ntargets : int ) -> dict:
+    '''
+    Read TARGET_PATHS from ntargets NestedDicts, each read once.
+    '''
+    targets = []
+    for x in range( 0, ntargets ):
+        t = NestedDict()
+        for path in TARGET_PATHS:
+            t.set( path, x )
+        targets.append( t )
+    total = ntargets * len(TARGET_PATHS)
+    result = {}
+    start = time.perf_counter()
+    for t in targets:
+        for path in TARGET_PATHS:
+            t.get( path )
+    result['get'] = total / ( time.perf_counter() - start )
+    compiled = [ NestedDict.compile_path( path ) for path in TARGET_PATHS ]
+    start = time.perf_counter()
+    for t in targets:
+        for c in compiled:
+            c.get( t )
+    result['compile_path'] = total / ( time.perf_counter() - start )
+    start = time.perf_counter()
+    for t in targets:
+        t.get_many( TARGET_PATHS )
+    result['get_many'] = total / ( time.perf_counter() - start )
+    values = dict( (path, 1) for path in TARGET_PATHS )
+    start = time.perf_counter()
+    for t in targets:
+        for path, value in values.items():
+            t.set( path, value )
+    result['set'] = total / ( time.perf_counter() - start )
+    start = time.perf_counter()
+    for t in targets:
+        t.set_many( values )
+    result['set_many'] = total / ( time.perf_counter() - start )
+    return result
+
+def run_interleaved( paths : list, passes : int ) -> dict:
+    '''
+    Read every path, with a change to another tree (and a new level in
+    this one) between each chunk of reads.
+    Return: name -> ( gets/sec, index size at the end )
+    '''
+    chunk = 100
+    result = {}
+    saved = NestedDict.use_index
+    for name, use_index in ( ('no index', False), ('path index', True) ):
+        NestedDict.use_index = use_index
+        nd = NestedDict()
+        for path in paths:
+            nd.set( path, path )
+        target = NestedDict()
+        for path in TARGET_PATHS:
+            target.set( path, 0 )
+        get = nd.get
+        start = time.perf_counter()
+        for x in range( 0, passes ):
+            for n in range( 0, len(paths), chunk ):
+                # Another tree: a clone changed, a level replaced.
+                c = target.clone()
+                c.set( 'target.name', n )
+                target.set( 'tools', { 'cc' : n } )
+                # This tree: a new level, not in the index.
+                nd.set( 'new_%d_%d.value' % (x, n), n )
+                for path in paths[ n : n + chunk ]:
+                    get( path )
+        elapsed = time.perf_counter() - start
+        size = len( nd._index ) if nd._index is not None else 0
+        result[ name ] = ( len(paths) * passes / elapsed, size )
+    NestedDict.use_index = saved
+    return result
+
+def run_snapshot( paths : list ) -> dict:
+    '''
+    Time: rebuild with set() (not counting any parsing), pickle load, snapshot load (lazy and not),
+    and a lazy load followed by reading one key.
+    '''
+    files = [ "config/part%d.yml" % x for x in range( 0, 20 ) ]
+    result = {}
+    start = time.perf_counter()
+    # The values are made here, as a parser would.
+    values = [ WhereStr.fast( "-O%d" % (x % 4), Where( files[ x % len(files) ], x + 1, 5 ) ) for x in range( 0, len(paths) ) ]
+    nd = NestedDict()
+    for path, value in zip( paths, values ):
+        nd.set( path, value )
+    result['rebuild'] = ( time.perf_counter() - start, 0 )
+    data = pickle.dumps( nd, protocol=pickle.HIGHEST_PROTOCOL )
+    start = time.perf_counter()
+    pickle.loads( data )
+    result['pickle'] = ( time.perf_counter() - start, len(data) )
+    data = dump_snapshot( nd )
+    start = time.perf_counter()
+    load_snapshot( data, lazy=False )
+    result['snapshot'] = ( time.perf_counter() - start, len(data) )
+    start = time.perf_counter()
+    load_snapshot( data ).get( paths[0] )
+    result['snapshot, lazy, 1 get'] = ( time.perf_counter() - start, len(data) )
+    return result
+
+def main():
+    ap = argparse.ArgumentParser( description="NestedDict micro benchmark" )
+    ap.add_argument( "--keys", type=int, default=20000, help="number of leaf keys" )
+    ap.add_argument( "--depth", type=int, default=4, help="parts per dotted path" )
+    ap.add_argument( "--passes", type=int, default=5, help="times each key is read and written" )
+    ap.add_argument( "--targets", type=int, default=100, help="clones made by the clone test" )
+    ap.add_argument( "--changes", type=int, default=5, help="keys set in each clone" )
+    args = ap.parse_args()
+    paths = make_paths( args.keys, args.depth )
+    print("%-28s %10s %12s %12s" % ('implementation', 'build-sec', 'gets/sec', 'sets/sec'))
+    cases = (
+        ( 'legacy (split + recurse)', LegacyNestedDict, None ),
+        ( 'NestedDict, no index',     NestedDict, False ),
+        ( 'NestedDict, path index',   NestedDict, True )
+    )
+    saved = NestedDict.use_index
+    for name, cls, use_index in cases:
+        if use_index is not None:
+            NestedDict.use_index = use_index
+        r = run( cls, paths, args.passes )
+        print("%-28s %10.3f %12.0f %12.0f" % (name, r['build_sec'], r['gets_per_sec'], r['sets_per_sec']))
+    NestedDict.use_index = saved
+    r = run_targets( args.keys )
+    print("")
+    print("%d targets, %d paths each, read once" % (args.keys, len(TARGET_PATHS)))
+    for name, rate in r.items():
+        print("%-28s %10.0f /sec" % (name, rate))
+    r = run_interleaved( paths, args.passes )
+    print("")
+    print("%d paths read, other trees changed every 100 reads" % len(paths))
+    print("%-28s %10s %12s" % ('implementation', 'gets/sec', 'index size'))
+    for name, (rate, size) in r.items():
+        print("%-28s %10.0f %12d" % (name, rate, size))
+    r = run_snapshot( paths )
+    print("")
+    print("%d WhereStr values, load time" % len(paths))
+    print("%-28s %10s %12s" % ('load', 'sec', 'bytes'))
+    for name, (sec, size) in r.items():
+        print("%-28s %10.4f %12d" % (name, sec, size))
+    r = run_clones( paths, args.targets, args.changes )
+    print("")
+    print("%d clones, %d changes each" % (args.targets, args.changes))
+    print("%-28s %10s %12s" % ('clone', 'sec', 'bytes/clone'))
+    for name in ( 'deep', 'cow' ):
+        print("%-28s %10.3f %12.0f" % (name, r[name][0], r[name][1]))
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,88 @@
 
 
+import itertools
+import typing
+
+# Split paths are remembered, the same paths are used over and over.
+_split_cache : typing.Dict[str, tuple] = {}
+# Limit the size of the cache, when full it is cleared.
+_SPLIT_CACHE_MAX = 100000
+
+def _split_path( path : str ) -> tuple:
+    '''
+    Return the path split on ".", ie: "pet.dog.name" -> ('pet','dog','name')
+    '''
+    parts = _split_cache.get( path )
+    if parts is None:
+        if len(_split_cache) >= _SPLIT_CACHE_MAX:
+            _split_cache.clear()
+        parts = tuple( path.split('.') )
+        _split_cache[ path ] = parts
+    return parts
+
+# tuple of paths -> ( trie, overlaps ), see _path_trie()
+_trie_cache : typing.Dict[tuple, tuple] = {}
+
+def _path_trie( paths : tuple ) -> tuple:
+    '''
+    For get_many() and set_many(), return the paths as a tree:
+        name -> ( children, [ index of each path that ends here ], a path through here )
+    and "overlaps", True if a path is also a prefix of another one.
+    The same list of paths is used over and over, so the result is cached.
+    '''
+    result = _trie_cache.get( paths )
+    if result is not None:
+        return result
+    trie = dict()
+    overlaps = False
+    for idx, path in enumerate( paths ):
+        if not isinstance( path, str ):
+            raise ValueError("path must be a string, not: %s" % path.__class__.__name__ )
+        parts = _split_path( path )
+        t = trie
+        for name in parts[:-1]:
+            entry = t.setdefault( name, ( {}, [], path ) )
+            if entry[1]:
+                overlaps = True
+            t = entry[0]
+        entry = t.setdefault( parts[-1], ( {}, [], path ) )
+        if entry[0]:
+            overlaps = True
+        entry[1].append( idx )
+    if len(_trie_cache) >= _SPLIT_CACHE_MAX:
+        _trie_cache.clear()
+    result = ( trie, overlaps )
+    _trie_cache[ paths ] = result
+    return result
+
+# Ticks on every change to any NestedDict, see NestedDict.version
+# This is a module global, not a class attribute: changing a class
+# attribute on every set() throws away Python's attribute lookup caches.
+_clock = 0
+
+# Used to detect a missing key without an exception.
+_MISSING = object()
+
+# Generations of the tree shapes, every value is unique, see _Shape
+_shape_ticks = itertools.count( 1 )
+
+class _Shape():
+    '''
+    The shape generation of one tree of NestedDicts, see "Path index".
+    Every level of a tree refers to the same _Shape. When a level of one
+    tree is stored in another the two are merged: the old one points at
+    the one it was merged into, and levels follow that on next use.
+    '''
+    __slots__ = ( 'generation', 'merged' )
+
+    def __init__( self ):
+        self.generation = next( _shape_ticks )
+        self.merged : typing.Optional["_Shape"] = None
+
+
 class NestedDict_KeyError( KeyError ):
     def __init__( self, keyname ):
-        KeyError.__init__("bad key: %s" % keyname )
+        KeyError.__init__( self, "bad key: %s" % keyname )
 
 class NestedDict( ):
     '''
@@ -15,14 +95,87 @@ class NestedDict( ):
     is the same as:
         nd.set('pet.dog.name',"Walter")
     The same applies for "get()" operations.
+
+    Path index:
+        A dotted path that was found once is remembered in a flat index,
+        path -> (the NestedDict holding the leaf, leaf name, writable), the next
+        get() or set() of that path needs no split and no walk.
+        
+        The index is only valid while the shape of the tree is the same.
+        Each tree has a generation (see _Shape), shared by all of its levels.
+        Replacing or removing a level, copying a shared level (copy on
+        write) or clone() bumps the generation of that tree only, and the
+        indexes of that tree are rebuilt as used. Adding a new level, or
+        replacing a plain value, does not. Changes to other trees never do.
+        Set NestedDict.use_index = False to disable it.
+
+    Copy on write:
+        clone() does not copy anything, the clone and the original share
+        the same levels, both are marked "_cow" (copy on write). A set()
+        copies only the levels along its path, the first time each one is
+        changed. A level returned by get() from a shared tree is made
+        private first, so it is safe to change it.
+
+        NOTE: A level fetched *before* clone() is shared by both trees,
+        fetch it again after clone() before changing it.
+
+    Change tracking:
+        Every change ticks a global clock, NestedDict.clock(). Each level
+        has a "version", the clock of the last change made through it:
+        a set() of "a.b.c" updates the version of the root, "a" and "a.b".
+        A consumer remembers the version of the subtree it used, via
+        version_of(), and redoes its work only if that has moved on.
+
+        checkpoint() also starts a change log, changes_since() then
+        returns the dotted paths set since a checkpoint.
+
+        NOTE: Only changes made through a level are seen by it, a change
+        made directly to a lower level (ie: from get('a.b').set('c',1))
+        updates the versions of 'a.b' and below, not of the root or 'a'.
     '''
+    # Global on/off switch for the path index.
+    use_index = True
+
     def __init__( self ):
         self._dict = dict()
+        # dotted path -> ( NestedDict, leaf name, writable, levels on the path or None )
+        # created on first use.
+        self._index = None
+        self._index_generation = -1
+        # The tree we are in, see _tree(). None until needed: a tree of one.
+        self._shape : typing.Optional[_Shape] = None
+        # True if self._dict is shared with a clone, see _unshare()
+        self._cow = False
+        # The clock of the last change, made through this level.
+        self._version = _clock
+        # The change log: dotted path -> clock, see checkpoint()
+        self._changes : typing.Optional[dict] = None
 
     def __str__( self ):
-        # Make str() work
-        d = self.as_dict()
-        return str(d)
+        # Make str() work, the same text as str( self.as_dict() )
+        # but written directly, with a stack not recursion.
+        out = [ '{' ]
+        stack = [ iter( self._dict.items() ) ]
+        first = True
+        while stack:
+            for k,v in stack[-1]:
+                if not first:
+                    out.append( ', ' )
+                first = False
+                out.append( repr(k) )
+                out.append( ': ' )
+                if isinstance( v, NestedDict ):
+                    # Go down a level, come back here when it is done.
+                    out.append( '{' )
+                    stack.append( iter( v._dict.items() ) )
+                    first = True
+                    break
+                out.append( repr(v) )
+            else:
+                stack.pop()
+                out.append( '}' )
+                first = False
+        return ''.join( out )
     
     def __getitem__(self,name):
         return self.get(name)
@@ -32,12 +185,204 @@ class NestedDict( ):
         Convert the nested dict into a regular dict.
         '''
         result = dict()
+        # ( level, the dict to fill in ), a stack not recursion.
+        stack = [ ( self, result ) ]
+        while stack:
+            node, out = stack.pop()
+            for k,v in node._dict.items():
+                if isinstance( v, NestedDict ):
+                    # Filled in later, but in order now.
+                    out[k] = dict()
+                    stack.append( ( v, out[k] ) )
+                else:
+                    out[k] = v
+        return result
+
+    def walk( self, prefix : str = '', max_depth : typing.Optional[int] = None, leaves_only : bool = False ) -> typing.Iterator[tuple]:
+        '''
+        Yield ( dotted path, value ) for every entry, levels and leaves,
+        a level is yielded before the entries in it.
+            prefix    - only the entries below this path (ie: "target.flags")
+            max_depth - how many levels to go down, 1 = only the first level.
+                        Levels deeper than this are yielded, not entered.
+            leaves_only - do not yield the levels that are entered.
+        The tree is walked with a stack, not recursion. Only levels shared
+        with a clone are copied (see "Copy on write"), a level yielded can be
+        changed after the walk without changing the clone.
+        NOTE: Do not change the tree, or a level yielded, while walking.
+        '''
+        node = self
+        base = ''
+        if prefix:
+            node = self._internal_get( prefix, True, _MISSING )
+            if node is _MISSING:
+                return
+            if not isinstance( node, NestedDict ):
+                # The prefix is a leaf.
+                yield ( prefix, node )
+                return
+            base = prefix + '.'
+        if node._cow:
+            # The levels we hand out (or enter) must not be shared with a clone.
+            node._unshare()
+        # ( path prefix, items iterator, depth )
+        stack = [ ( base, iter( node._dict.items() ), 1 ) ]
+        while stack:
+            base, items, depth = stack[-1]
+            for k,v in items:
+                path = base + k
+                if isinstance( v, NestedDict ) and ((max_depth is None) or (depth < max_depth)):
+                    if v._cow:
+                        v._unshare()
+                    if not leaves_only:
+                        yield ( path, v )
+                    stack.append( ( path + '.', iter( v._dict.items() ), depth + 1 ) )
+                    break
+                yield ( path, v )
+            else:
+                stack.pop()
+
+    def iter_leaves( self, prefix : str = '', max_depth : typing.Optional[int] = None ) -> typing.Iterator[tuple]:
+        '''
+        Yield ( dotted path, value ) for every leaf, see walk()
+        '''
+        return self.walk( prefix, max_depth, leaves_only=True )
+
+    def _tree( self ) -> _Shape:
+        '''
+        Return the _Shape of the tree we are in.
+        '''
+        shape = self._shape
+        if shape is None:
+            shape = _Shape()
+            self._shape = shape
+            return shape
+        if shape.merged is not None:
+            while shape.merged is not None:
+                shape = shape.merged
+            self._shape = shape
+        return shape
+
+    def _reshape( self ):
+        '''
+        The shape of our tree changed, the path indexes of the tree are stale.
+        '''
+        self._tree().generation = next( _shape_ticks )
+
+    def _adopt( self, level : "NestedDict" ):
+        '''
+        level is now part of our tree.
+        '''
+        tree = self._tree()
+        if level._shape is not None:
+            other = level._tree()
+            if other is not tree:
+                # It (may) still be part of the other tree too, share one generation.
+                other.merged = tree
+        level._shape = tree
+
+    def _path_index( self ) -> dict:
+        '''
+        Return the path index, empty if the tree shape has changed.
+        '''
+        shape = self._shape
+        if (shape is None) or (shape.merged is not None):
+            shape = self._tree()
+        if self._index_generation != shape.generation:
+            self._index = {}
+            self._index_generation = shape.generation
+        return self._index
+
+    def _share( self ) -> "NestedDict":
+        '''
+        Return a new NestedDict that shares our dict, both become copy on write.
+        '''
+        result = NestedDict()
+        result._dict = self._dict
+        result._cow = True
+        result._version = self._version
+        self._cow = True
+        return result
+
+    def _unshare( self ):
+        '''
+        Before a change: take a private copy of our (shared) dict.
+        Only this level is copied, the levels below are shared again,
+        via _share(), and are copied when (if) they are changed.
+        '''
+        if not self._cow:
+            return
+        tree = self._tree()
+        private = dict()
         for k,v in self._dict.items():
-            # If we have a recursive entry, convert it also.
             if isinstance( v, NestedDict ):
-                v = v.as_dict()
-            result[k] = v
-        return result
+                v = v._share()
+                v._shape = tree
+            private[k] = v
+        self._dict = private
+        self._cow = False
+        # The levels below are new objects, indexes that point to them are stale.
+        tree.generation = next( _shape_ticks )
+
+    def _own_path( self, parts : tuple ) -> "NestedDict":
+        '''
+        Walk parts (which exist) making every level private, return the last one.
+        '''
+        node = self
+        for name in parts:
+            if node._cow:
+                node._unshare()
+            node = node._dict[ name ]
+        if node._cow:
+            node._unshare()
+        return node
+
+    def _store( self, name : str, value ):
+        '''
+        Set one key in this level, note any change to the tree shape.
+        '''
+        if self._cow:
+            self._unshare()
+        global _clock
+        clock = _clock + 1
+        _clock = clock
+        self._version = clock
+        old = self._dict.get( name, _MISSING )
+        if isinstance( value, NestedDict ):
+            self._adopt( value )
+            # It is new here, anything that used the old level must redo it.
+            value._version = clock
+        if isinstance( old, NestedDict ) and (old is not value):
+            # Index entries may point into (or through) the old level.
+            # A new level, or a plain value replaced by a level, is not in any index.
+            self._reshape()
+        self._dict[ name ] = value
+
+    def _touch( self, path : str, levels ):
+        '''
+        After a set() of path via us: update the version of the levels
+        on the path and log the change.
+        '''
+        clock = _clock
+        for node in levels:
+            node._version = clock
+        if self._changes is not None:
+            self._changes[ path ] = clock
+
+    def _level( self, name : str, path : str ) -> "NestedDict":
+        '''
+        For set(), return the level "name" below us, private and created if needed.
+        '''
+        if self._cow:
+            self._unshare()
+        nextlevel = self._dict.get( name, _MISSING )
+        if nextlevel is _MISSING:
+            # it does not exist, then create the level.
+            nextlevel = NestedDict()
+            self._store( name, nextlevel )
+        elif not isinstance( nextlevel, NestedDict ):
+            raise ValueError("cannot set: %s, %s is not a NestedDict" % (path, name))
+        return nextlevel
 
     def set( self, path, value ):
         '''
@@ -45,43 +390,66 @@ class NestedDict( ):
         '''
         if not isinstance( path, str ):
             raise ValueError("path must be a string, not: %s" % path.__class__.__name__ )
-        # We can split the string :-)
-        parts = path.split('.')
         # If needed, convert dicts to NestedDicts
         if isinstance( value, dict ):
             value = NestedDict.from_dict( value )
-        # Recursively set
-        self._internal_set( parts, value )
+        if '.' not in path:
+            self._store( path, value )
+            if self._changes is not None:
+                self._changes[ path ] = _clock
+            return
+        if NestedDict.use_index:
+            entry = self._path_index().get( path )
+            if (entry is not None) and (entry[3] is not None):
+                entry[0]._store( entry[1], value )
+                # self._touch(), inline: this is the hot path.
+                clock = _clock
+                for node in entry[3]:
+                    node._version = clock
+                if self._changes is not None:
+                    self._changes[ path ] = clock
+                return
+        # Walk down the path creating levels as needed.
+        parts = _split_path( path )
+        node = self
+        levels = [ self ]
+        for name in parts[:-1]:
+            node = node._level( name, path )
+            levels.append( node )
+        node._store( parts[-1], value )
+        self._touch( path, levels )
+        if NestedDict.use_index:
+            # Indexed after the store, which may have changed the generation.
+            # Every level on the path is now private, so set() may use it.
+            self._path_index()[ path ] = ( node, parts[-1], True, tuple( levels ) )
 
-    def _internal_set( self, parts, value ):
+    def set_key( self, name : str, value ):
         '''
-        This is recursive, we loop through layers here
-
-        Originally, we may have had: pet.dog.name = "Walter"
-        This became: parts=['pet','dog','name'], value="Walter"
-        This should create a dict in the form: { 'pet' : { 'dog' : { 'name': "Walter" }}}
-        Here we deal with 'pet.dog' recursively stopping at parts=['name'], and value='Walter'
+        Set one key of this level, name is not split on "."
+        ie: a YAML key like "main.c" or "1.0"
         '''
-        # Make sure our parts are modifiable and itterable
-        assert( isinstance(parts,list) )
+        if isinstance( value, dict ):
+            value = NestedDict.from_dict( value )
+        self._store( name, value )
+        if self._changes is not None:
+            self._changes[ name ] = _clock
 
-        # STEP 1: recursively loop over the prefix of our path.
-        if len(parts) > 1:
-            # Take the first name
-            name = parts.pop(0)
-            if name in self._dict:
-                nextlevel = self._dict.get(name)
-            else:
-                # it does not exist, then create the level.
-                nextlevel = NestedDict()
-                self._dict[name] = nextlevel
-            # Then recurse into the next level
-            nextlevel._internal_set( parts, value )    
-            return
-        else:
-            # We now only have 'path=name' and 'value=Walter'
-            # so set the value
-            self._dict[ parts[0] ]  = value
+    def get_key( self, name : str, *default ):
+        '''
+        Get one key of this level, name is not split on "."
+        '''
+        value = self._dict.get( name, _MISSING )
+        if value is _MISSING:
+            if len(default) > 1:
+                raise TypeError("Too many parameters")
+            if default:
+                return default[0]
+            raise KeyError( "no such key: %s" % name )
+        if self._cow and isinstance( value, NestedDict ):
+            # Do not hand out a level we share with a clone.
+            self._unshare()
+            value = self._dict[ name ]
+        return value
 
     def get( self, *args ):
         '''
@@ -99,8 +467,6 @@ class NestedDict( ):
         # And verify path is a string
         if not isinstance(path, str ):
             raise ValueError("path parameter is not a string, it is: %s" % path.__class__.__name__)
-        # Break up the path into parts, ie: "pet.dog.name" becomes ['pet','dog','name']
-        parts = path.split('.')
         # Do we have a default value?
         # Do we have too many parameters?
         if len( args ) == 1:
@@ -113,8 +479,135 @@ class NestedDict( ):
         else:
             # Too many parameters
             raise TypeError("Too many parameters")
-        # go recursive.
-        return self._internal_get( [], parts, have_default, default_value )
+        return self._internal_get( path, have_default, default_value )
+
+    @staticmethod
+    def compile_path( path : str ) -> "CompiledPath":
+        '''
+        Return a CompiledPath for path, to get or set it in many NestedDicts.
+        '''
+        compiled = _compiled_paths.get( path )
+        if compiled is None:
+            compiled = CompiledPath( path )
+            if len(_compiled_paths) >= _SPLIT_CACHE_MAX:
+                _compiled_paths.clear()
+            _compiled_paths[ path ] = compiled
+        return compiled
+
+    def get_many( self, paths : typing.Iterable[str], *default ) -> list:
+        '''
+        Return a list of the values of paths, in order.
+        Paths with a common prefix share the walk down to it.
+        Like get(), if a path is missing either return the default or raise KeyError.
+        '''
+        if len(default) > 1:
+            raise TypeError("Too many parameters")
+        paths = tuple( paths )
+        result = [ _MISSING ] * len(paths)
+        stack = [ ( self, _path_trie( paths )[0] ) ]
+        while stack:
+            node, t = stack.pop()
+            for name, (children, ends, path) in t.items():
+                value = node._dict.get( name, _MISSING )
+                for idx in ends:
+                    result[idx] = value
+                if children and isinstance( value, NestedDict ):
+                    stack.append( ( value, children ) )
+        for idx, value in enumerate( result ):
+            if value is _MISSING:
+                if not default:
+                    self._missing( _split_path( paths[idx] ), False, None )
+                result[idx] = default[0]
+            elif isinstance( value, NestedDict ):
+                # A level, get() takes care of copy on write.
+                result[idx] = self.get( paths[idx] )
+        return result
+
+    def set_many( self, mapping : dict ):
+        '''
+        Set every path -> value in mapping.
+        Paths with a common prefix share the walk down to it.
+        '''
+        paths = tuple( mapping )
+        trie, overlaps = _path_trie( paths )
+        if overlaps:
+            # ie: "a" and "a.b", the order matters, do them one at a time.
+            for path, value in mapping.items():
+                self.set( path, value )
+            return
+        values = []
+        for value in mapping.values():
+            if isinstance( value, dict ):
+                value = NestedDict.from_dict( value )
+            values.append( value )
+        # ( level, trie, levels on the path )
+        stack = [ ( self, trie, ( self, ) ) ]
+        while stack:
+            node, t, levels = stack.pop()
+            for name, (children, ends, path) in t.items():
+                if ends:
+                    node._store( name, values[ ends[0] ] )
+                    self._touch( path, levels )
+                else:
+                    nextlevel = node._level( name, path )
+                    stack.append( ( nextlevel, children, levels + ( nextlevel, ) ) )
+
+    @staticmethod
+    def clock() -> int:
+        '''
+        Return the global change clock, it only goes up.
+        '''
+        return _clock
+
+    @property
+    def version( self ) -> int:
+        '''
+        The clock of the last change made through this level, see "Change tracking"
+        '''
+        return self._version
+
+    def version_of( self, path : str ) -> int:
+        '''
+        Return the version of a level, for a leaf the version of the level holding it.
+        Raises KeyError if the path does not exist.
+        '''
+        value = self._internal_get( path, False, None )
+        if isinstance( value, NestedDict ):
+            return value._version
+        if '.' not in path:
+            return self._version
+        return self.version_of( path.rsplit( '.', 1 )[0] )
+
+    def checkpoint( self ) -> int:
+        '''
+        Start (or keep) logging the paths set via us, return the clock now.
+        Pass the result to changes_since() later.
+        '''
+        if self._changes is None:
+            self._changes = dict()
+        return _clock
+
+    def stop_tracking( self ):
+        '''
+        Stop logging changes and forget the log.
+        '''
+        self._changes = None
+
+    def changes_since( self, stamp : int, prefix : str = '' ) -> typing.List[str]:
+        '''
+        Return the dotted paths set after stamp (from checkpoint()) in the
+        order they were last set. With a prefix, only the changes that
+        affect it: the prefix, paths below it, or a level above it that was replaced.
+        '''
+        if self._changes is None:
+            raise ValueError("changes are not tracked, call checkpoint() first")
+        result = [ (clock, path) for path, clock in self._changes.items() if clock > stamp ]
+        if prefix:
+            below = prefix + '.'
+            result = [ (clock, path) for clock, path in result
+                       if (path == prefix) or path.startswith( below ) or below.startswith( path + '.' ) ]
+        result.sort()
+        return [ path for clock, path in result ]
 
     @staticmethod
     def from_dict( from_dict ):
@@ -125,40 +618,146 @@ class NestedDict( ):
     
     def clone( self ):
         '''
-        Return a copy of our self
+        Return a copy of our self, this is O(1), see "Copy on write" above.
         '''
-        d = self.as_dict()
-        return NestedDict.from_dict( d )
+        result = self._share()
+        # Our index entries now point at shared levels, set() must not use them.
+        # The clone is a new tree, with its own (empty) index.
+        self._reshape()
+        return result
 
     def items(self):
         '''
         Try to support the standard dict items() call.
         '''
+        if self._cow:
+            # The caller may change the levels we return.
+            self._unshare()
         return self._dict.items()
 
-    def _internal_get( self, current_path, path, have_default, default_value ):
-        '''
-        this is the recursive workhorse for NestedDict.get() and __getattr__()
-        '''
-        while len(path) > 1:
-            # Take the first name
-            name = path.pop(0)
-            current_path.append(name)
-            try:
-                value = self._dict[name]
-            except KeyError:
-                if have_default:
-                    return default_value
-                raise KeyError( "no such key: %s in path: %s" % (name, '.'.join(current_path) ))
-            # We have the value and it should be a NestedDict()
-            return value._internal_get( current_path, path, have_default, default_value )
-        # Ok, we are at the terminal leaf node in our dict.
-        # ie: We had:  "pet.dog.name" we are at "name"
+    def _missing( self, parts : tuple, have_default : bool, default_value ):
+        '''
+        The path was not found, return the default or raise KeyError
+        '''
         if have_default:
-            value = self._dict.get( name, default_value )
-            return value
-        if path[0] in self._dict:
-            value = self._dict.get( path[0] )
-        else:
-            raise KeyError( "no such key: %s in path: %s" % (path[0], '.'.join(current_path) ))
+            return default_value
+        # Walk again to find the part that is missing, for the message.
+        node = self
+        for idx, name in enumerate( parts ):
+            if (not isinstance( node, NestedDict )) or (name not in node._dict):
+                break
+            node = node._dict[ name ]
+        raise KeyError( "no such key: %s in path: %s" % (name, '.'.join(parts[:idx+1]) ))
+
+    def _internal_get( self, path, have_default, default_value ):
+        '''
+        this is the workhorse for NestedDict.get() and __getattr__()
+        The path is walked with a loop, not recursion.
+        '''
+        if '.' not in path:
+            # Just one level, no index is needed.
+            value = self._dict.get( path, _MISSING )
+            if value is not _MISSING:
+                if self._cow and isinstance( value, NestedDict ):
+                    # Do not hand out a level we share with a clone.
+                    self._unshare()
+                    value = self._dict[ path ]
+                return value
+            if have_default:
+                return default_value
+            raise KeyError( "no such key: %s in path: %s" % (path, path) )
+        use_index = NestedDict.use_index
+        if use_index:
+            entry = self._path_index().get( path )
+            if entry is not None:
+                value = entry[0]._dict.get( entry[1], _MISSING )
+                if (value is not _MISSING) and (entry[2] or not isinstance( value, NestedDict )):
+                    return value
+        parts = _split_path( path )
+        node = self
+        shared = self._cow
+        for name in parts[:-1]:
+            node = node._dict.get( name, _MISSING )
+            if not isinstance( node, NestedDict ):
+                # Missing, or "a.b.c" where "a.b" is a plain value.
+                return self._missing( parts, have_default, default_value )
+            if node._cow:
+                shared = True
+        value = node._dict.get( parts[-1], _MISSING )
+        if value is _MISSING:
+            return self._missing( parts, have_default, default_value )
+        if shared and isinstance( value, NestedDict ):
+            # Do not hand out a level we share with a clone.
+            node = self._own_path( parts[:-1] )
+            value = node._dict[ parts[-1] ]
+            shared = False
+        if use_index:
+            # A shared path is fine for reading, but set() must walk it.
+            self._path_index()[ path ] = ( node, parts[-1], not shared, None )
         return value
+
+
+# path -> CompiledPath, see NestedDict.compile_path()
+_compiled_paths : typing.Dict[str, "CompiledPath"] = {}
+
+class CompiledPath():
+    '''
+    A dotted path, split once, that can be used with any NestedDict
+    ie: in a generator, for each target:
+        cflags = NestedDict.compile_path( 'target.cflags' )
+        for t in targets:
+            flags = cflags.get( t, '' )
+    '''
+    __slots__ = ( 'path', 'parts', '_parents', '_leaf' )
+
+    def __init__( self, path : str ):
+        if not isinstance( path, str ):
+            raise ValueError("path must be a string, not: %s" % path.__class__.__name__ )
+        self.path = path
+        self.parts = _split_path( path )
+        self._parents = self.parts[:-1]
+        self._leaf = self.parts[-1]
+
+    def __repr__( self ):
+        return "CompiledPath(%r)" % self.path
+
+    def get( self, nd : NestedDict, *default ):
+        '''
+        Like nd.get( path [, default] )
+        '''
+        node = nd
+        shared = nd._cow
+        for name in self._parents:
+            node = node._dict.get( name, _MISSING )
+            if not isinstance( node, NestedDict ):
+                return self._missing( nd, default )
+            if node._cow:
+                shared = True
+        value = node._dict.get( self._leaf, _MISSING )
+        if value is _MISSING:
+            return self._missing( nd, default )
+        if shared and isinstance( value, NestedDict ):
+            # Do not hand out a level we share with a clone.
+            value = nd._own_path( self._parents )._dict[ self._leaf ]
+        return value
+
+    __call__ = get
+
+    def _missing( self, nd : NestedDict, default : tuple ):
+        if len(default) > 1:
+            raise TypeError("Too many parameters")
+        return nd._missing( self.parts, len(default) == 1, default[0] if default else None )
+
+    def set( self, nd : NestedDict, value ):
+        '''
+        Like nd.set( path, value )
+        '''
+        if isinstance( value, dict ):
+            value = NestedDict.from_dict( value )
+        node = nd
+        levels = [ nd ]
+        for name in self._parents:
+            node = node._level( name, self.path )
+            levels.append( node )
+        node._store( self._leaf, value )
+        nd._touch( self.path, levels )
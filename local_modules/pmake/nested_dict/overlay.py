@@ -0,0 +1,262 @@
+'''
+A NestedDictOverlay is a stack of NestedDicts, like collections.ChainMap
+but for dotted paths.
+
+Our config is: command line overrides, on top of the project pmake.yml,
+on top of platform files, on top of the defaults. Rather than copy and
+merge those, stack them:
+
+    config = NestedDictOverlay( cmdline, project, platform, defaults )
+    config.get( 'compiler.flags.debug' )
+
+maps[0] is the top, a get() looks in each layer, top down. The rules:
+    A plain value hides everything below it, at that path and deeper.
+    A level (NestedDict) is merged with the levels at the same path in
+    the layers below it, until a layer with a plain value there.
+    So get() of a level returns an OverlayLevel, a merged view.
+
+set() always writes to the top layer (maps[0]).
+
+For hot readers, flatten() returns a cached dict of every leaf:
+    dotted path -> value
+The cache is rebuilt when the version of any layer changes (see
+NestedDict "Change tracking"), so a set() on a layer is seen. Only a
+change made to a level inside a layer, not through the layer itself,
+needs an invalidate().
+'''
+import typing
+
+from pmake.nested_dict.nested_dict import NestedDict, _split_path, _MISSING
+
+__ALL__ = ['NestedDictOverlay', 'OverlayLevel']
+
+
+def _resolve( layers : list, name : str ) -> tuple:
+    '''
+    Look up one key in a list of layers (top first)
+    Returns (value, levels)
+        value  - the plain value, or _MISSING
+        levels - the NestedDicts to merge, empty if not a level.
+    '''
+    levels = []
+    for layer in layers:
+        value = layer._dict.get( name, _MISSING )
+        if value is _MISSING:
+            continue
+        if not isinstance( value, NestedDict ):
+            if levels:
+                # Hidden by the levels above it.
+                break
+            return ( value, levels )
+        levels.append( value )
+    return ( _MISSING, levels )
+
+def _merged_keys( layers : list ) -> list:
+    '''
+    All the keys of the layers, in order (top layer first)
+    '''
+    seen = dict()
+    for layer in layers:
+        for k in layer._dict:
+            seen[k] = True
+    return list( seen )
+
+def _get_args( args : tuple ) -> tuple:
+    '''
+    Check get() parameters, the same as NestedDict.get()
+    Returns (path, have_default, default_value)
+    '''
+    if len(args) == 0:
+        raise TypeError( "missing path parameter")
+    path = args[0]
+    if not isinstance(path, str ):
+        raise ValueError("path parameter is not a string, it is: %s" % path.__class__.__name__)
+    if len(args) == 1:
+        return ( path, False, None )
+    if len(args) == 2:
+        return ( path, True, args[1] )
+    raise TypeError("Too many parameters")
+
+
+class NestedDictOverlay():
+    '''
+    See above, a ChainMap of NestedDicts.
+    '''
+    def __init__( self, *maps ):
+        self.maps : typing.List[NestedDict] = list( maps ) or [ NestedDict() ]
+        # The flatten() cache, and the layer versions it was made from.
+        self._flat : typing.Optional[dict] = None
+        self._flat_versions : tuple = ()
+
+    def __str__( self ):
+        return str( self.as_dict() )
+
+    def new_child( self, m : typing.Optional[NestedDict] = None ) -> "NestedDictOverlay":
+        '''
+        Like ChainMap.new_child(), a new overlay with m (or an empty NestedDict) on top.
+        '''
+        if m is None:
+            m = NestedDict()
+        return NestedDictOverlay( m, *self.maps )
+
+    @property
+    def parents( self ) -> "NestedDictOverlay":
+        '''
+        Like ChainMap.parents, all but the top layer.
+        '''
+        return NestedDictOverlay( *self.maps[1:] )
+
+    def invalidate( self ):
+        '''
+        Drop the flatten() cache, call this if a level inside a layer is changed directly.
+        '''
+        self._flat = None
+
+    def _levels( self, parts : tuple ) -> typing.Optional[list]:
+        '''
+        Return the NestedDicts (top first) at the path parts, None if
+        the path does not exist or is hidden by a plain value.
+        '''
+        layers = self.maps
+        for name in parts:
+            value, layers = _resolve( layers, name )
+            if not layers:
+                return None
+        return layers
+
+    def _lookup( self, path : str, have_default : bool, default_value ):
+        parts = _split_path( path )
+        layers = self._levels( parts[:-1] )
+        if layers is not None:
+            value, levels = _resolve( layers, parts[-1] )
+            if levels:
+                return OverlayLevel( self, path )
+            if value is not _MISSING:
+                return value
+        if have_default:
+            return default_value
+        raise KeyError( "no such key: %s" % path )
+
+    def get( self, *args ):
+        '''
+        Like NestedDict.get(), looks in each layer top down.
+        '''
+        path, have_default, default_value = _get_args( args )
+        return self._lookup( path, have_default, default_value )
+
+    def __getitem__( self, path ):
+        return self.get( path )
+
+    def __contains__( self, path ):
+        return self._lookup( path, True, _MISSING ) is not _MISSING
+
+    def set( self, path : str, value ):
+        '''
+        Set a value in the top layer.
+        '''
+        self.maps[0].set( path, value )
+        self._flat = None
+
+    def keys( self ) -> list:
+        return _merged_keys( self.maps )
+
+    def items( self ) -> list:
+        return [ (k, self._lookup( k, False, None )) for k in self.keys() ]
+
+    def _as_dict( self, layers : list ) -> dict:
+        '''
+        The merged layers as plain nested dicts, walked with a stack.
+        '''
+        result = dict()
+        stack = [ ( layers, result ) ]
+        while stack:
+            layers, out = stack.pop()
+            for k in _merged_keys( layers ):
+                value, levels = _resolve( layers, k )
+                if levels:
+                    out[k] = dict()
+                    stack.append( ( levels, out[k] ) )
+                elif value is not _MISSING:
+                    out[k] = value
+        return result
+
+    def as_dict( self ) -> dict:
+        '''
+        Return the merged config as a regular dict.
+        '''
+        return self._as_dict( self.maps )
+
+    def flatten( self ) -> dict:
+        '''
+        Return (and cache) every leaf of the merged config: dotted path -> value
+        The result is shared, do not change it.
+        '''
+        versions = tuple( m._version for m in self.maps )
+        if (self._flat is None) or (versions != self._flat_versions):
+            self._flat_versions = versions
+            flat = dict()
+            stack = [ ( '', self.maps ) ]
+            while stack:
+                prefix, layers = stack.pop()
+                for k in _merged_keys( layers ):
+                    value, levels = _resolve( layers, k )
+                    if levels:
+                        stack.append( ( prefix + k + '.', levels ) )
+                    elif value is not _MISSING:
+                        flat[ prefix + k ] = value
+            self._flat = flat
+        return self._flat
+
+    def flat_get( self, *args ):
+        '''
+        Like get() but via the flatten() cache, levels are looked up with get()
+        '''
+        path, have_default, default_value = _get_args( args )
+        value = self.flatten().get( path, _MISSING )
+        if value is not _MISSING:
+            return value
+        return self._lookup( path, have_default, default_value )
+
+
+class OverlayLevel():
+    '''
+    A merged view of one level of a NestedDictOverlay, at "prefix".
+    Nothing is copied, every get() and set() goes through the overlay.
+    '''
+    __slots__ = ( 'overlay', 'prefix' )
+
+    def __init__( self, overlay : NestedDictOverlay, prefix : str ):
+        self.overlay = overlay
+        self.prefix = prefix
+
+    def __str__( self ):
+        return str( self.as_dict() )
+
+    def _layers( self ) -> list:
+        layers = self.overlay._levels( _split_path( self.prefix ) )
+        return layers or []
+
+    def get( self, *args ):
+        path, have_default, default_value = _get_args( args )
+        return self.overlay._lookup( self.prefix + '.' + path, have_default, default_value )
+
+    def __getitem__( self, path ):
+        return self.get( path )
+
+    def __contains__( self, path ):
+        return (self.prefix + '.' + path) in self.overlay
+
+    def set( self, path : str, value ):
+        '''
+        Set a value, in the top layer of the overlay.
+        '''
+        self.overlay.set( self.prefix + '.' + path, value )
+
+    def keys( self ) -> list:
+        return _merged_keys( self._layers() )
+
+    def items( self ) -> list:
+        return [ (k, self.get( k )) for k in self.keys() ]
+
+    def as_dict( self ) -> dict:
+        return self.overlay._as_dict( self._layers() )
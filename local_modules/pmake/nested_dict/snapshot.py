@@ -0,0 +1,268 @@
+'''
+A compact binary snapshot of a NestedDict tree.
+
+Building the config from the parsed source on every run is slow, and
+as_dict() (or pickle of a plain dict) loses the where of each WhereStr.
+A snapshot keeps the values, the nesting, and every Where / WhereStr
+position, so errors still point at the right file:line.
+
+The format is a short header and then one marshal blob:
+    MAGIC
+    marshal( ( files, strings, root level ) )
+        files   - the filenames, a Where stores an index into this.
+        strings - every str (keys and values) once, the levels refer to
+                  them by index, so repeated values (ie: "-O2") are
+                  stored once and, after loading, are the same object.
+        level   - ( key indexes, kinds, values ), kinds is a str with one
+                  letter per value, see _KIND_* below.
+
+Loading is one read and one marshal.loads(), which decodes the tuples in
+C. The NestedDict (and WhereStr) objects of a level are only made when
+that level is first used, until then it is a _LazyNestedDict holding its
+tuple. File ids are process local (see pmake.where), the names are
+interned again on load.
+
+Example:
+    save_snapshot( config, "build/config.snap" )
+    config = read_snapshot( "build/config.snap" )
+'''
+import marshal
+import os
+import typing
+
+from pmake.where import Where, WhereRange, file_table
+from pmake.where_str import WhereStr
+from pmake.nested_dict.nested_dict import NestedDict, _Shape
+
+__ALL__ = ['dump_snapshot', 'load_snapshot', 'save_snapshot', 'read_snapshot', 'SnapshotError']
+
+# Bump the last byte if the layout changes.
+MAGIC = b'PMND\x01'
+
+# The value kinds, one letter each.
+_KIND_VALUE = 'v'       # None, bool, int, float, bytes, as is.
+_KIND_STR = 's'         # string index
+_KIND_WHERE_STR = 'w'   # ( string index, where )
+_KIND_WHERE = 'W'       # ( file index, lineno, column [, end_lineno] )
+_KIND_LEVEL = 'n'       # a NestedDict level
+_KIND_DICT = 'd'        # a plain dict, stored like a level
+_KIND_LIST = 'l'        # ( kinds, values )
+_KIND_TUPLE = 't'       # ( kinds, values )
+
+_PLAIN_TYPES = ( type(None), bool, int, float, bytes )
+
+_tuple_new = tuple.__new__
+
+
+class SnapshotError( ValueError ):
+    '''
+    The data is not a snapshot, or not one we can read.
+    '''
+    pass
+
+
+class _Encoder():
+    '''
+    Builds the file and string tables while encoding the tree.
+    '''
+    def __init__( self ):
+        self.files : typing.List[str] = []
+        self._file_index : dict = {}
+        self.strings : typing.List[str] = []
+        self._string_index : dict = {}
+
+    def string( self, text : str ) -> int:
+        # Only the text, a WhereStr (or other str subclass) is stored as a str
+        text = str.__str__( text )
+        idx = self._string_index.get( text )
+        if idx is None:
+            idx = len(self.strings)
+            self.strings.append( text )
+            self._string_index[ text ] = idx
+        return idx
+
+    def where( self, where : Where ) -> tuple:
+        # Keyed by the (process local) file id, the table holds the names.
+        fid = where.file_id
+        idx = self._file_index.get( fid )
+        if idx is None:
+            idx = len(self.files)
+            self.files.append( where.filename )
+            self._file_index[ fid ] = idx
+        if isinstance( where, WhereRange ):
+            return ( idx, where[1], None, where[3] )
+        return ( idx, where[1], where[2] )
+
+    def value( self, value ) -> tuple:
+        '''
+        Return ( kind, encoded value )
+        '''
+        # The order matters: WhereStr is a str, Where is a tuple.
+        if isinstance( value, NestedDict ):
+            return ( _KIND_LEVEL, self.level( value._dict ) )
+        if type(value) in _PLAIN_TYPES:
+            return ( _KIND_VALUE, value )
+        if isinstance( value, WhereStr ):
+            return ( _KIND_WHERE_STR, ( self.string( value ), self.where( value.where ) ) )
+        if isinstance( value, str ):
+            return ( _KIND_STR, self.string( value ) )
+        if isinstance( value, Where ):
+            return ( _KIND_WHERE, self.where( value ) )
+        if isinstance( value, dict ):
+            return ( _KIND_DICT, self.level( value ) )
+        if isinstance( value, list ):
+            return ( _KIND_LIST, self.sequence( value ) )
+        if isinstance( value, tuple ):
+            return ( _KIND_TUPLE, self.sequence( value ) )
+        raise TypeError("cannot snapshot a: %s" % value.__class__.__name__ )
+
+    def sequence( self, values ) -> tuple:
+        kinds = []
+        encoded = []
+        for v in values:
+            kind, v = self.value( v )
+            kinds.append( kind )
+            encoded.append( v )
+        return ( ''.join( kinds ), tuple( encoded ) )
+
+    def level( self, d : dict ) -> tuple:
+        keys = []
+        for k in d.keys():
+            if not isinstance( k, str ):
+                raise TypeError("snapshot keys must be strings, not: %s" % k.__class__.__name__ )
+            keys.append( self.string( k ) )
+        kinds, values = self.sequence( d.values() )
+        return ( tuple( keys ), kinds, values )
+
+
+class _Tables():
+    '''
+    The tables of a loaded snapshot, shared by all of its lazy levels.
+    '''
+    __slots__ = ( 'strings', 'fids', 'lazy', 'shape' )
+
+    def __init__( self, files : tuple, strings : tuple, lazy : bool ):
+        intern = file_table().intern
+        self.fids = [ intern( name ) for name in files ]
+        self.strings = strings
+        self.lazy = lazy
+        # Every level of the loaded tree is in one tree (path index generation)
+        self.shape = _Shape()
+
+    def where( self, record : tuple ) -> Where:
+        if len(record) == 4:
+            return WhereRange.from_id( self.fids[ record[0] ], record[1], record[3] )
+        return Where.from_id( self.fids[ record[0] ], record[1], record[2] )
+
+    def value( self, kind : str, v ):
+        # The most common kinds first.
+        if kind == _KIND_WHERE_STR:
+            where = v[1]
+            if len(where) == 3:
+                # Where.from_id(), inline: there is one per value.
+                where = _tuple_new( Where, ( self.fids[ where[0] ], where[1], where[2] ) )
+            else:
+                where = self.where( where )
+            return WhereStr.fast( self.strings[ v[0] ], where )
+        if kind == _KIND_VALUE:
+            return v
+        if kind == _KIND_STR:
+            return self.strings[ v ]
+        if kind == _KIND_LEVEL:
+            if self.lazy:
+                return _LazyNestedDict( self, v )
+            result = NestedDict()
+            result._shape = self.shape
+            result._dict = self.level( v )
+            return result
+        if kind == _KIND_WHERE:
+            return self.where( v )
+        if kind == _KIND_DICT:
+            return self.level( v )
+        if kind == _KIND_LIST:
+            return self.sequence( v )
+        if kind == _KIND_TUPLE:
+            return tuple( self.sequence( v ) )
+        raise SnapshotError("unknown value kind: %r" % kind )
+
+    def sequence( self, record : tuple ) -> list:
+        value = self.value
+        return [ value( kind, v ) for kind, v in zip( record[0], record[1] ) ]
+
+    def level( self, record : tuple ) -> dict:
+        strings = self.strings
+        value = self.value
+        keys, kinds, values = record
+        return { strings[k] : value( kind, v ) for k, kind, v in zip( keys, kinds, values ) }
+
+
+class _LazyNestedDict( NestedDict ):
+    '''
+    A NestedDict level from a snapshot, its _dict is made on first use.
+    '''
+    def __init__( self, tables : _Tables, record : tuple ):
+        NestedDict.__init__( self )
+        # No _dict yet, __getattr__() makes it.
+        del self._dict
+        self._tables = tables
+        self._record = record
+        self._shape = tables.shape
+
+    def __getattr__( self, name : str ):
+        # Only called when the attribute does not exist.
+        if name != '_dict':
+            raise AttributeError( name )
+        d = self._tables.level( self._record )
+        # From now on _dict is a normal attribute, this is not called again.
+        self._dict = d
+        self._tables = None
+        self._record = None
+        return d
+
+    @property
+    def materialized( self ) -> bool:
+        return '_dict' in self.__dict__
+
+
+def dump_snapshot( nd : NestedDict ) -> bytes:
+    '''
+    Return the snapshot of nd as bytes.
+    '''
+    encoder = _Encoder()
+    root = encoder.level( nd._dict )
+    return MAGIC + marshal.dumps( ( tuple( encoder.files ), tuple( encoder.strings ), root ) )
+
+def load_snapshot( data : bytes, lazy : bool = True ) -> NestedDict:
+    '''
+    Return the NestedDict in a snapshot from dump_snapshot()
+    With lazy=False every level is made now.
+    '''
+    if bytes( data[ :len(MAGIC) ] ) != MAGIC:
+        raise SnapshotError("not a NestedDict snapshot (or a different version)")
+    try:
+        files, strings, root = marshal.loads( memoryview( data )[ len(MAGIC): ] )
+    except ( EOFError, ValueError, TypeError ) as E:
+        raise SnapshotError("corrupt snapshot: %s" % str(E) )
+    tables = _Tables( files, strings, lazy )
+    result = NestedDict()
+    result._shape = tables.shape
+    result._dict = tables.level( root )
+    return result
+
+def save_snapshot( nd : NestedDict, filename : str ):
+    '''
+    Write a snapshot file, this is done via a temp file so that
+    a partial snapshot is never seen by another run.
+    '''
+    tmpname = "%s.%d.tmp" % (filename, os.getpid())
+    with open( tmpname, "wb" ) as f:
+        f.write( dump_snapshot( nd ) )
+    os.replace( tmpname, filename )
+
+def read_snapshot( filename : str, lazy : bool = True ) -> NestedDict:
+    '''
+    Read a snapshot file, with one read.
+    '''
+    with open( filename, "rb" ) as f:
+        data = f.read()
+    return load_snapshot( data, lazy )
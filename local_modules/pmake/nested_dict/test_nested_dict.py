@@ -1,8 +1,13 @@
 import sys
 import unittest
 import os
+import tempfile
 
 from pmake.nested_dict  import NestedDict
+from pmake.nested_dict  import NestedDictOverlay, OverlayLevel
+from pmake.nested_dict  import dump_snapshot, load_snapshot, save_snapshot, read_snapshot, SnapshotError
+from pmake.where import Where, WhereRange
+from pmake.where_str import WhereStr
 
 class NestedDict_Test( unittest.TestCase ):
 
@@ -87,6 +92,414 @@ class NestedDict_Test( unittest.TestCase ):
         value = self.DUT['pet']['dog']['walter']['age']
         self.assertEqual( value, 12 )
 
+    def test_get_default( self ):
+        self.assertEqual( self.DUT.get( 'cat', 'none' ), 'none' )
+        self.DUT.set( 'pet.dog', 'walter' )
+        self.assertEqual( self.DUT.get( 'pet.cat', 'none' ), 'none' )
+        self.assertEqual( self.DUT.get( 'pets.cat.name', None ), None )
+
+    def test_plain_value_in_path( self ):
+        self.DUT.set( 'pet.dog', 'walter' )
+        # "pet.dog" is a string, not a level.
+        with self.assertRaises( KeyError ):
+            self.DUT.get( 'pet.dog.name' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name', 'x' ), 'x' )
+        with self.assertRaises( ValueError ):
+            self.DUT.set( 'pet.dog.name', 'walter' )
+
+    def test_path_index( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name' ), 'walter' )
+        self.assertIn( 'pet.dog.name', self.DUT._path_index() )
+        # Set through the index, then get through the index.
+        self.DUT.set( 'pet.dog.name', 'shatzi' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name' ), 'shatzi' )
+        self.assertEqual( self.DUT['pet']['dog']['name'], 'shatzi' )
+
+    def test_path_index_invalidate( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name' ), 'walter' )
+        old_dog = self.DUT['pet']['dog']
+        # Replace an intermediate level, the index must not find the old one.
+        self.DUT.set( 'pet.dog', { 'name' : 'dolly' } )
+        self.assertEqual( self.DUT.get( 'pet.dog.name' ), 'dolly' )
+        self.DUT.set( 'pet.dog.name', 'shatzi' )
+        self.assertEqual( self.DUT['pet']['dog']['name'], 'shatzi' )
+        self.assertEqual( old_dog.get( 'name' ), 'walter' )
+        # Replace the level with a plain value.
+        self.DUT['pet'].set( 'dog', 'none' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name', 'gone' ), 'gone' )
+
+    def test_path_index_per_tree( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name' ), 'walter' )
+        index = self.DUT._path_index()
+        # Changes to another tree do not touch our index.
+        other = NestedDict()
+        other.set( 'car.make', 'ford' )
+        other.set( 'car', { 'make' : 'fiat' } )
+        other.clone().set( 'car.make', 'audi' )
+        self.assertIs( self.DUT._path_index(), index )
+        self.assertIn( 'pet.dog.name', index )
+        # Neither does a new level in our tree.
+        self.DUT.set( 'pet.cat.name', 'tom' )
+        self.assertIs( self.DUT._path_index(), index )
+        # A level stored in two trees: a change in one is seen by both.
+        shared = NestedDict()
+        shared.set( 'name', 'rex' )
+        other.set( 'dog', shared )
+        self.DUT.set( 'pet.pup', shared )
+        self.assertEqual( self.DUT.get( 'pet.pup.name' ), 'rex' )
+        self.assertEqual( other.get( 'dog.name' ), 'rex' )
+        other.set( 'dog', { 'name' : 'spot' } )
+        other.get( 'dog' ).set( 'name', 'lassie' )
+        self.assertEqual( self.DUT.get( 'pet.pup.name' ), 'rex' )
+        shared.set( 'name', { 'first' : 'rex' } )
+        self.assertEqual( self.DUT.get( 'pet.pup.name.first' ), 'rex' )
+
+    def test_clone( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        self.DUT.set( 'pet.cat.name', 'tom' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name' ), 'walter' )
+        copy = self.DUT.clone()
+        # Nothing is copied yet.
+        self.assertIs( copy._dict, self.DUT._dict )
+        copy.set( 'pet.dog.name', 'dolly' )
+        self.assertEqual( copy.get( 'pet.dog.name' ), 'dolly' )
+        self.assertEqual( self.DUT.get( 'pet.dog.name' ), 'walter' )
+        # Only the path of the set() was copied.
+        self.assertIs( copy._dict['pet']._dict['cat']._dict, self.DUT._dict['pet']._dict['cat']._dict )
+        # And the other way.
+        self.DUT.set( 'pet.cat.name', 'felix' )
+        self.assertEqual( copy.get( 'pet.cat.name' ), 'tom' )
+        self.assertEqual( self.DUT.get( 'pet.cat.name' ), 'felix' )
+        self.assertEqual( copy.as_dict(), { 'pet' : { 'dog' : {'name':'dolly'}, 'cat' : {'name':'tom'} } } )
+
+    def test_clone_get_level( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        copy = self.DUT.clone()
+        # A level fetched after the clone can be changed.
+        dog = copy.get( 'pet.dog' )
+        dog.set( 'name', 'dolly' )
+        copy['pet'].set( 'cat', 'tom' )
+        self.assertEqual( copy.get( 'pet.dog.name' ), 'dolly' )
+        self.assertEqual( copy.get( 'pet.cat' ), 'tom' )
+        self.assertEqual( self.DUT.as_dict(), { 'pet' : { 'dog' : {'name':'walter'} } } )
+        # Clone of a clone.
+        third = copy.clone()
+        third.set( 'pet.dog.age', 3 )
+        self.assertEqual( copy.get( 'pet.dog.age', None ), None )
+        self.assertEqual( third.get( 'pet.dog.name' ), 'dolly' )
+
+    def test_compile_path( self ):
+        self.DUT.set( 'target.cflags', '-O2' )
+        cflags = NestedDict.compile_path( 'target.cflags' )
+        self.assertIs( NestedDict.compile_path( 'target.cflags' ), cflags )
+        self.assertEqual( cflags.get( self.DUT ), '-O2' )
+        self.assertEqual( cflags( self.DUT ), '-O2' )
+        other = NestedDict()
+        self.assertEqual( cflags.get( other, '' ), '' )
+        with self.assertRaises( KeyError ):
+            cflags.get( other )
+        cflags.set( other, '-Os' )
+        self.assertEqual( other.get( 'target.cflags' ), '-Os' )
+        # Copy on write
+        copy = other.clone()
+        cflags.set( copy, '-O0' )
+        self.assertEqual( cflags.get( other ), '-Os' )
+        self.assertEqual( cflags.get( copy ), '-O0' )
+
+    def test_get_many( self ):
+        self.DUT.set( 'target.cflags', '-O2' )
+        self.DUT.set( 'target.sources', ['a.c'] )
+        self.DUT.set( 'name', 'demo' )
+        result = self.DUT.get_many( ['target.cflags', 'name', 'target.sources', 'target.cflags'] )
+        self.assertEqual( result, ['-O2', 'demo', ['a.c'], '-O2'] )
+        result = self.DUT.get_many( ['target.ldflags', 'name.x', 'name'], None )
+        self.assertEqual( result, [None, None, 'demo'] )
+        with self.assertRaises( KeyError ):
+            self.DUT.get_many( ['target.cflags', 'target.ldflags'] )
+        level = self.DUT.get_many( ['target'] )[0]
+        self.assertIsInstance( level, NestedDict )
+        self.assertEqual( level.get( 'cflags' ), '-O2' )
+
+    def test_set_many( self ):
+        self.DUT.set( 'target.cflags', '-O2' )
+        copy = self.DUT.clone()
+        copy.set_many( { 'target.cflags' : '-Os', 'target.ldflags' : '-s', 'name' : 'demo', 'a.b.c' : 1 } )
+        self.assertEqual( copy.as_dict(), {
+            'target' : { 'cflags' : '-Os', 'ldflags' : '-s' },
+            'name' : 'demo',
+            'a' : { 'b' : { 'c' : 1 } } } )
+        self.assertEqual( self.DUT.as_dict(), { 'target' : { 'cflags' : '-O2' } } )
+        # A path and a prefix of it, done in order.
+        self.DUT.set_many( { 'x.y' : 1, 'x' : 2 } )
+        self.assertEqual( self.DUT.get( 'x' ), 2 )
+        with self.assertRaises( ValueError ):
+            self.DUT.set_many( { 'target.cflags.debug' : '-g' } )
+
+    def test_str( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        self.DUT.set( 'pet.dog.age', 12 )
+        self.DUT.set( 'pet.cat', NestedDict() )
+        self.DUT.set( 'count', 2 )
+        self.assertEqual( str(self.DUT), str(self.DUT.as_dict()) )
+        self.assertEqual( str(NestedDict()), '{}' )
+
+    def test_deep( self ):
+        # Deeper than the recursion limit.
+        path = '.'.join( ['x'] * (sys.getrecursionlimit() + 100) )
+        self.DUT.set( path, 1 )
+        self.assertEqual( list( self.DUT.iter_leaves() ), [ (path, 1) ] )
+        self.assertTrue( str(self.DUT).startswith( "{'x': {'x': " ) )
+        self.assertIsInstance( self.DUT.as_dict(), dict )
+
+    def test_walk( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        self.DUT.set( 'pet.dog.age', 12 )
+        self.DUT.set( 'pet.cat', 'tom' )
+        self.DUT.set( 'count', 2 )
+        self.assertEqual( list( self.DUT.iter_leaves() ), [
+            ('pet.dog.name', 'walter'), ('pet.dog.age', 12), ('pet.cat', 'tom'), ('count', 2) ] )
+        self.assertEqual( [ p for p, v in self.DUT.walk() ], [
+            'pet', 'pet.dog', 'pet.dog.name', 'pet.dog.age', 'pet.cat', 'count' ] )
+        self.assertEqual( list( self.DUT.iter_leaves( 'pet.dog' ) ), [
+            ('pet.dog.name', 'walter'), ('pet.dog.age', 12) ] )
+        self.assertEqual( list( self.DUT.iter_leaves( 'pet.cat' ) ), [ ('pet.cat', 'tom') ] )
+        self.assertEqual( list( self.DUT.iter_leaves( 'pet.bird' ) ), [] )
+        result = list( self.DUT.iter_leaves( max_depth=2 ) )
+        self.assertEqual( [ p for p, v in result ], [ 'pet.dog', 'pet.cat', 'count' ] )
+        self.assertIsInstance( result[0][1], NestedDict )
+
+    def test_clone_walk( self ):
+        # Levels from walk() / iter_leaves() of a clone are not shared with the original.
+        self.DUT.set( 'a.b', 1 )
+        self.DUT.set( 'x.y.z', 1 )
+        copy = self.DUT.clone()
+        level = [ v for p, v in copy.walk() if isinstance( v, NestedDict ) ][0]
+        level.set( 'b', 2 )
+        self.assertEqual( self.DUT.get( 'a.b' ), 1 )
+        self.assertEqual( copy.get( 'a.b' ), 2 )
+        copy = self.DUT.clone()
+        for p, v in copy.iter_leaves( max_depth=2 ):
+            if p == 'x.y':
+                v.set( 'z', 2 )
+        self.assertEqual( self.DUT.get( 'x.y.z' ), 1 )
+        self.assertEqual( copy.get( 'x.y.z' ), 2 )
+        copy = self.DUT.clone()
+        dict( copy.walk( 'x' ) )[ 'x.y' ].set( 'z', 3 )
+        self.assertEqual( self.DUT.get( 'x.y.z' ), 1 )
+        self.assertEqual( copy.get( 'x.y.z' ), 3 )
+
+    def test_versions( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        self.DUT.set( 'pet.cat.name', 'tom' )
+        dog = self.DUT.version_of( 'pet.dog' )
+        cat = self.DUT.version_of( 'pet.cat' )
+        root = self.DUT.version
+        self.DUT.set( 'pet.dog.name', 'dolly' )
+        self.assertGreater( self.DUT.version_of( 'pet.dog' ), dog )
+        self.assertEqual( self.DUT.version_of( 'pet.dog.name' ), self.DUT.version_of( 'pet.dog' ) )
+        self.assertEqual( self.DUT.version_of( 'pet.cat' ), cat )
+        self.assertGreater( self.DUT.version, root )
+        self.assertEqual( self.DUT.version, NestedDict.clock() )
+        # A replaced level is newer than anything seen before.
+        dog = self.DUT.version_of( 'pet.dog' )
+        self.DUT.set( 'pet.dog', {} )
+        self.assertGreater( self.DUT.version_of( 'pet.dog' ), dog )
+        with self.assertRaises( KeyError ):
+            self.DUT.version_of( 'pet.bird' )
+
+    def test_changes_since( self ):
+        self.DUT.set( 'pet.dog.name', 'walter' )
+        with self.assertRaises( ValueError ):
+            self.DUT.changes_since( 0 )
+        stamp = self.DUT.checkpoint()
+        self.assertEqual( self.DUT.changes_since( stamp ), [] )
+        self.DUT.set( 'pet.cat.name', 'tom' )
+        self.DUT.set( 'count', 1 )
+        self.DUT.set_many( { 'pet.dog.age' : 12 } )
+        NestedDict.compile_path( 'pet.dog.name' ).set( self.DUT, 'dolly' )
+        self.DUT.set( 'pet.cat.name', 'felix' )
+        self.assertEqual( self.DUT.changes_since( stamp ), [
+            'count', 'pet.dog.age', 'pet.dog.name', 'pet.cat.name' ] )
+        self.assertEqual( self.DUT.changes_since( stamp, 'pet.dog' ), [ 'pet.dog.age', 'pet.dog.name' ] )
+        second = self.DUT.checkpoint()
+        self.DUT.set( 'pet', { 'bird' : 'tweety' } )
+        # Replacing "pet" affects everything below it.
+        self.assertEqual( self.DUT.changes_since( second, 'pet.dog' ), [ 'pet' ] )
+        self.assertEqual( self.DUT.changes_since( second, 'count' ), [] )
+        self.DUT.stop_tracking()
+        with self.assertRaises( ValueError ):
+            self.DUT.changes_since( second )
+
+    def test_set_key( self ):
+        # The name is not split on "."
+        self.DUT.set_key( 'main.c', 'source' )
+        self.assertEqual( self.DUT.get_key( 'main.c' ), 'source' )
+        self.assertEqual( self.DUT.get( 'main', None ), None )
+        self.assertEqual( self.DUT.get_key( 'other.c', None ), None )
+        with self.assertRaises( KeyError ):
+            self.DUT.get_key( 'other.c' )
+        self.DUT.set_key( 'level', { 'a.b' : 1 } )
+        self.assertEqual( self.DUT.get( 'level.a.b' ), 1 )
+
+    def test_no_index( self ):
+        saved = NestedDict.use_index
+        NestedDict.use_index = False
+        try:
+            self.test_set_get_path()
+            self.test_path_index_invalidate()
+            self.DUT = NestedDict()
+            self.test_clone()
+            self.DUT = NestedDict()
+            self.test_changes_since()
+        finally:
+            NestedDict.use_index = saved
+
+
+class NestedDictOverlay_Test( unittest.TestCase ):
+
+    def setUp( self ):
+        self.defaults = NestedDict.from_dict( {
+            'compiler' : { 'name' : 'gcc', 'flags' : { 'debug' : '-g', 'opt' : '-O2' } },
+            'output' : 'build' } )
+        self.project = NestedDict.from_dict( {
+            'compiler' : { 'flags' : { 'opt' : '-Os' } },
+            'name' : 'demo' } )
+        self.cmdline = NestedDict()
+        self.DUT = NestedDictOverlay( self.cmdline, self.project, self.defaults )
+
+    def test_get( self ):
+        self.assertEqual( self.DUT.get( 'compiler.flags.opt' ), '-Os' )
+        self.assertEqual( self.DUT.get( 'compiler.flags.debug' ), '-g' )
+        self.assertEqual( self.DUT.get( 'compiler.name' ), 'gcc' )
+        self.assertEqual( self.DUT['name'], 'demo' )
+        self.assertEqual( self.DUT.get( 'compiler.cpu', 'none' ), 'none' )
+        with self.assertRaises( KeyError ):
+            self.DUT.get( 'compiler.cpu' )
+        self.assertIn( 'output', self.DUT )
+        self.assertNotIn( 'input', self.DUT )
+
+    def test_level( self ):
+        flags = self.DUT.get( 'compiler.flags' )
+        self.assertIsInstance( flags, OverlayLevel )
+        self.assertEqual( flags['opt'], '-Os' )
+        self.assertEqual( sorted( flags.keys() ), ['debug', 'opt'] )
+        self.assertEqual( flags.as_dict(), { 'opt' : '-Os', 'debug' : '-g' } )
+        flags.set( 'debug', '-g3' )
+        self.assertEqual( self.cmdline.get( 'compiler.flags.debug' ), '-g3' )
+        self.assertEqual( self.defaults.get( 'compiler.flags.debug' ), '-g' )
+
+    def test_plain_value_hides( self ):
+        self.cmdline.set( 'compiler', 'clang' )
+        self.DUT.invalidate()
+        self.assertEqual( self.DUT.get( 'compiler' ), 'clang' )
+        self.assertEqual( self.DUT.get( 'compiler.name', None ), None )
+        self.assertNotIn( 'compiler.flags.opt', self.DUT.flatten() )
+
+    def test_set_write_through( self ):
+        self.DUT.set( 'compiler.flags.opt', '-O0' )
+        self.assertEqual( self.DUT.get( 'compiler.flags.opt' ), '-O0' )
+        self.assertEqual( self.cmdline.as_dict(), { 'compiler' : { 'flags' : { 'opt' : '-O0' } } } )
+        self.assertEqual( self.project.get( 'compiler.flags.opt' ), '-Os' )
+        self.assertEqual( self.DUT.parents.get( 'compiler.flags.opt' ), '-Os' )
+
+    def test_flatten( self ):
+        flat = self.DUT.flatten()
+        self.assertEqual( flat, {
+            'compiler.name' : 'gcc',
+            'compiler.flags.debug' : '-g',
+            'compiler.flags.opt' : '-Os',
+            'output' : 'build',
+            'name' : 'demo' } )
+        # Cached
+        self.assertIs( self.DUT.flatten(), flat )
+        self.assertEqual( self.DUT.flat_get( 'output' ), 'build' )
+        self.assertIsInstance( self.DUT.flat_get( 'compiler' ), OverlayLevel )
+        self.DUT.set( 'output', 'out' )
+        self.assertEqual( self.DUT.flat_get( 'output' ), 'out' )
+        # A set() on a layer is seen.
+        self.defaults.set( 'extra', 1 )
+        self.assertIn( 'extra', self.DUT.flatten() )
+        # A change inside a level of a layer needs invalidate()
+        self.defaults.get( 'compiler' ).set( 'cpu', 'arm' )
+        self.assertEqual( self.DUT.flat_get( 'compiler.cpu', None ), 'arm' )
+        self.assertNotIn( 'compiler.cpu', self.DUT.flatten() )
+        self.DUT.invalidate()
+        self.assertIn( 'compiler.cpu', self.DUT.flatten() )
+
+    def test_as_dict( self ):
+        child = self.DUT.new_child()
+        child.set( 'name', 'child' )
+        self.assertEqual( child.as_dict(), {
+            'name' : 'child',
+            'compiler' : { 'name' : 'gcc', 'flags' : { 'debug' : '-g', 'opt' : '-Os' } },
+            'output' : 'build' } )
+        self.assertEqual( self.DUT.get( 'name' ), 'demo' )
+
+
+class Snapshot_Test( unittest.TestCase ):
+
+    def setUp( self ):
+        self.DUT = NestedDict()
+        self.DUT.set( 'target.name', WhereStr.fast( 'demo', Where( 'pmake.yml', 3, 9 ) ) )
+        self.DUT.set( 'target.cflags', WhereStr.fast( '-O2', Where( 'pmake.yml', 4 ) ) )
+        self.DUT.set( 'target.ldflags', '-O2' )
+        self.DUT.set( 'target.asflags', ''.join( ['-O', '2'] ) )
+        self.DUT.set( 'target.sources', [ 'a.c', WhereStr.fast( 'b.c', Where( 'other.yml', 7 ) ), { 'x' : 1 }, ( None, 1.5, True ) ] )
+        self.DUT.set( 'disabled', WhereRange( 'pmake.yml', 10, 20 ) )
+        self.DUT.set( 'count', 3 )
+        self.DUT.set( 'empty', NestedDict() )
+
+    def _check( self, nd ):
+        self.assertEqual( nd.as_dict(), self.DUT.as_dict() )
+        name = nd.get( 'target.name' )
+        self.assertIsInstance( name, WhereStr )
+        self.assertEqual( name.where, Where( 'pmake.yml', 3, 9 ) )
+        self.assertEqual( str(nd.get( 'target.cflags' ).where), 'pmake.yml:4:' )
+        sources = nd.get( 'target.sources' )
+        self.assertEqual( sources[1].where.filename, 'other.yml' )
+        self.assertIsInstance( sources[3], tuple )
+        disabled = nd.get( 'disabled' )
+        self.assertIsInstance( disabled, WhereRange )
+        self.assertEqual( disabled.end_lineno, 20 )
+        # The string table, the same text is the same object.
+        self.assertIs( nd.get( 'target.asflags' ), nd.get( 'target.ldflags' ) )
+
+    def test_round_trip( self ):
+        data = dump_snapshot( self.DUT )
+        self._check( load_snapshot( data ) )
+        self._check( load_snapshot( data, lazy=False ) )
+
+    def test_lazy( self ):
+        nd = load_snapshot( dump_snapshot( self.DUT ) )
+        target = nd.get( 'target' )
+        self.assertFalse( target.materialized )
+        self.assertEqual( target.get( 'name' ), 'demo' )
+        self.assertTrue( target.materialized )
+        # A lazy level is a NestedDict like any other.
+        target.set( 'name', 'changed' )
+        copy = nd.clone()
+        copy.set( 'empty.x', 1 )
+        self.assertEqual( nd.get( 'target.name' ), 'changed' )
+        self.assertEqual( nd.get( 'empty' ).as_dict(), {} )
+
+    def test_file( self ):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join( tmpdir, 'config.snap' )
+            save_snapshot( self.DUT, filename )
+            self._check( read_snapshot( filename ) )
+
+    def test_errors( self ):
+        with self.assertRaises( SnapshotError ):
+            load_snapshot( b'not a snapshot' )
+        data = dump_snapshot( self.DUT )
+        with self.assertRaises( SnapshotError ):
+            load_snapshot( data[:-5] )
+        self.DUT.set( 'bad', object() )
+        with self.assertRaises( TypeError ):
+            dump_snapshot( self.DUT )
 
 
 if __name__ == '__main__':
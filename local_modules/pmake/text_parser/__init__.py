@@ -1 +1,4 @@
 from pmake.text_parser.text_parser import SimpleTextParser
+from pmake.text_parser.depends import manifest_is_current
+from pmake.text_parser.if_expr import IfEvaluator, IfExprError
+from pmake.text_parser.flatten import write_flattened, read_flattened
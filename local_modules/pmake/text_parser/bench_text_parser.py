@@ -0,0 +1,359 @@
+'''
+Benchmark harness for the SimpleTextParser.
+
+This is not a unit test, it is run by hand:
+
+    python -m pmake.text_parser.bench_text_parser
+    python -m pmake.text_parser.bench_text_parser --scale 0.1
+    python -m pmake.text_parser.bench_text_parser --save baseline.json
+    python -m pmake.text_parser.bench_text_parser --compare baseline.json
+
+Synthetic inputs are generated in a temp directory:
+    flat      - one large file, 1M lines at scale 1.0
+    tree      - include tree, 10 levels deep, 1000 files
+    if_dense  - a file full of #if/#elif/#else/#endif blocks
+    disabled  - a file that is mostly long "#if 0" blocks
+
+For each input, and for raw_next_line() and next_preprocessed_line()
+(and for the tree, with include prefetching enabled) the harness measures:
+    lines/sec      - source lines read per second, best of N runs
+                     (a disabled block is many source lines, but one output line)
+    peak memory    - via tracemalloc, in a separate run
+                     tree.retained keeps every line (as a client would) so its
+                     peak shows the memory cost of each WhereStr and its Where.
+    syscalls       - the number of open(), stat() and listdir() calls
+
+The results can be saved as a JSON baseline, later runs can compare
+against that baseline and report regressions.
+'''
+import argparse
+import builtins
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pmake.text_parser import SimpleTextParser
+
+# Bump if the JSON layout changes.
+BASELINE_FORMAT = 1
+
+
+def _evaluator( parser, text ):
+    return text.strip() == '1'
+
+def _body_line( x : int ) -> str:
+    '''
+    A line that looks roughly like a generated pmake.yml
+    Every 10th line is blank, every 50th is a comment.
+    '''
+    if (x % 10) == 9:
+        return "\n"
+    if (x % 50) == 0:
+        return "# comment line %d\n" % x
+    return "    key_%d: value-%d-with-some-text\n" % (x,x)
+
+def write_flat_file( filename : str, nlines : int ) -> int:
+    '''
+    Write a file of "nlines" lines, no preprocessor statements
+    Returns the number of lines written.
+    '''
+    with open( filename, "wt" ) as f:
+        for x in range( 0, nlines ):
+            f.write( _body_line( x ) )
+    return nlines
+
+def write_if_dense_file( filename : str, nlines : int ) -> int:
+    '''
+    Every 8 lines is an #if/#elif/#else/#endif block
+    Returns the number of lines written.
+    '''
+    with open( filename, "wt" ) as f:
+        x = 0
+        while x < nlines:
+            f.write("#if 0\n")
+            f.write( _body_line( x ) )
+            f.write("#elif 1\n")
+            f.write( _body_line( x+1 ) )
+            f.write("#else\n")
+            f.write( _body_line( x+2 ) )
+            f.write("#endif\n")
+            f.write( _body_line( x+3 ) )
+            x = x + 8
+    return x
+
+def write_disabled_file( filename : str, nlines : int, run : int = 1000 ) -> int:
+    '''
+    Long runs of disabled lines, with a few enabled lines in between.
+    Returns the number of lines written.
+    '''
+    with open( filename, "wt" ) as f:
+        x = 0
+        while x < nlines:
+            f.write("#if 0\n")
+            for n in range( 0, run ):
+                f.write( _body_line( x+n ) )
+            f.write("#endif\n")
+            f.write("enabled: %d\n" % x)
+            x = x + run + 3
+    return x
+
+def write_include_tree( directory : str, depth : int, nfiles : int, lines_per_file : int ) -> tuple:
+    '''
+    Create a tree of include files, "depth" levels deep and "nfiles" in total.
+    The root includes (nfiles/depth) chains, each level of a chain includes the next.
+    Every chain also includes a shared file, as a real project would.
+    Returns the tuple: (root filename, total source lines as included)
+    '''
+    os.makedirs( directory, exist_ok=True )
+    nchains = max( 1, nfiles // depth )
+    with open( os.path.join( directory, "shared.yml" ), "wt" ) as f:
+        for x in range( 0, lines_per_file ):
+            f.write( _body_line( x ) )
+    for chain in range( 0, nchains ):
+        for level in range( 0, depth ):
+            name = os.path.join( directory, "c%d_l%d.yml" % (chain,level) )
+            with open( name, "wt" ) as f:
+                for x in range( 0, lines_per_file ):
+                    f.write( _body_line( x ) )
+                if level == 0:
+                    f.write('#include "shared.yml"\n')
+                if (level + 1) < depth:
+                    f.write('#include "c%d_l%d.yml"\n' % (chain,level+1) )
+    root = os.path.join( directory, "root.yml" )
+    with open( root, "wt" ) as f:
+        for chain in range( 0, nchains ):
+            f.write('#include "c%d_l0.yml"\n' % chain )
+    # Each chain level has its own lines, the include line(s), and the shared file.
+    total = nchains
+    total = total + nchains * ( depth * lines_per_file + (depth - 1) + 1 + lines_per_file )
+    return ( root, total )
+
+
+class SyscallCounter():
+    '''
+    Counts file system calls made while active.
+    This wraps the Python level functions, so it counts what the parser asks for.
+    '''
+    def __init__( self ):
+        self.counts = { 'open' : 0, 'stat' : 0, 'listdir' : 0 }
+        self._saved = []
+
+    def _wrap( self, module, name, kind ):
+        original = getattr( module, name )
+        counts = self.counts
+        def wrapper( *args, **kwargs ):
+            counts[kind] = counts[kind] + 1
+            return original( *args, **kwargs )
+        self._saved.append( (module, name, original) )
+        setattr( module, name, wrapper )
+
+    def __enter__( self ):
+        self._wrap( builtins, 'open', 'open' )
+        self._wrap( os, 'stat', 'stat' )
+        self._wrap( os, 'fstat', 'stat' )
+        self._wrap( os, 'listdir', 'listdir' )
+        self._wrap( os, 'scandir', 'listdir' )
+        return self
+
+    def __exit__( self, *args ):
+        for module, name, original in reversed( self._saved ):
+            setattr( module, name, original )
+        self._saved = []
+
+
+def read_raw( filename : str ) -> int:
+    '''
+    Read the file using raw_next_line(), return the number of lines
+    '''
+    stp = SimpleTextParser()
+    stp.open_file( filename )
+    n = 0
+    while True:
+        text = stp.raw_next_line()
+        if len(text) == 0:
+            break
+        n = n + 1
+    stp.close_file()
+    return n
+
+def read_preprocessed( filename : str ) -> int:
+    '''
+    Read the file using next_preprocessed_line(), return the number of lines
+    '''
+    stp = SimpleTextParser()
+    stp.if_evaluator = _evaluator
+    stp.open_file( filename )
+    n = 0
+    while True:
+        text = stp.next_preprocessed_line()
+        if len(text) == 0:
+            break
+        n = n + 1
+    return n
+
+def read_prefetched( filename : str ) -> int:
+    '''
+    Like read_preprocessed(), with include files read ahead on 4 threads.
+    '''
+    stp = SimpleTextParser()
+    stp.if_evaluator = _evaluator
+    stp.enable_prefetch( workers=4 )
+    stp.open_file( filename )
+    n = 0
+    while True:
+        text = stp.next_preprocessed_line()
+        if len(text) == 0:
+            break
+        n = n + 1
+    stp.disable_prefetch()
+    return n
+
+def read_retained( filename : str ) -> int:
+    '''
+    Like read_preprocessed(), but every line is kept until the end.
+    '''
+    stp = SimpleTextParser()
+    stp.if_evaluator = _evaluator
+    stp.open_file( filename )
+    lines = list( stp.iter_preprocessed( markers=True ) )
+    return len(lines)
+
+def measure( func, filename : str, source_lines : int, repeat : int ) -> dict:
+    '''
+    Measure one reader on one input, of "source_lines" lines.
+    '''
+    best = None
+    nlines = 0
+    for x in range( 0, repeat ):
+        start = time.perf_counter()
+        nlines = func( filename )
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    # Memory and syscalls are measured in a separate run, tracemalloc slows things down.
+    with SyscallCounter() as counter:
+        tracemalloc.start()
+        func( filename )
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    result = {
+        'lines'        : nlines,
+        'source_lines' : source_lines,
+        'seconds'      : best,
+        'lines_per_sec': source_lines / best if best > 0 else 0.0,
+        'peak_bytes'   : peak,
+        'bytes_per_line': peak / nlines if nlines else 0.0
+    }
+    result.update( counter.counts )
+    return result
+
+def make_inputs( directory : str, scale : float ) -> dict:
+    '''
+    Generate the synthetic inputs, return a dict of name -> (root filename, source lines)
+    '''
+    if os.path.exists( directory ):
+        shutil.rmtree( directory )
+    os.makedirs( directory )
+    nlines = max( 100, int( 1000000 * scale ) )
+    inputs = {}
+    filename = os.path.join( directory, "flat.yml" )
+    inputs['flat'] = ( filename, write_flat_file( filename, nlines ) )
+    filename = os.path.join( directory, "if_dense.yml" )
+    inputs['if_dense'] = ( filename, write_if_dense_file( filename, nlines // 4 ) )
+    filename = os.path.join( directory, "disabled.yml" )
+    inputs['disabled'] = ( filename, write_disabled_file( filename, nlines // 4 ) )
+    inputs['tree'] = write_include_tree( os.path.join( directory, "tree" ),
+                                         depth=10,
+                                         nfiles=max( 10, int( 1000 * scale ) ),
+                                         lines_per_file=50 )
+    return inputs
+
+def run_all( scale : float = 1.0, repeat : int = 3, directory : str = None ) -> dict:
+    '''
+    Run every benchmark, return the results as a dict suitable for JSON
+    '''
+    if directory is None:
+        directory = os.path.join( tempfile.gettempdir(), "text-parse-bench" )
+    inputs = make_inputs( directory, scale )
+    results = {}
+    for name, (filename, source_lines) in inputs.items():
+        # raw mode does not follow #include, so it is not useful on the tree.
+        if name != 'tree':
+            results[ name + '.raw' ] = measure( read_raw, filename, source_lines, repeat )
+        results[ name + '.preprocessed' ] = measure( read_preprocessed, filename, source_lines, repeat )
+    filename, source_lines = inputs['tree']
+    results[ 'tree.prefetch' ] = measure( read_prefetched, filename, source_lines, repeat )
+    results[ 'tree.retained' ] = measure( read_retained, filename, source_lines, repeat )
+    shutil.rmtree( directory )
+    return {
+        'format'  : BASELINE_FORMAT,
+        'scale'   : scale,
+        'python'  : sys.version.split()[0],
+        'results' : results
+    }
+
+def report( results : dict ):
+    print("%-22s %9s %8s %12s %10s %7s %6s %6s %7s" %
+          ('benchmark', 'src-lines', 'sec', 'lines/sec', 'peak-KB', 'B/line', 'open', 'stat', 'listdir'))
+    for name, r in results['results'].items():
+        print("%-22s %9d %8.3f %12.0f %10.0f %7.0f %6d %6d %7d" %
+              (name, r['source_lines'], r['seconds'], r['lines_per_sec'], r['peak_bytes'] / 1024.0,
+               r.get('bytes_per_line', 0.0), r['open'], r['stat'], r['listdir']))
+
+def compare( baseline : dict, current : dict, tolerance : float ) -> int:
+    '''
+    Compare against a baseline, return the number of regressions.
+    Speed is a regression if it drops by more then tolerance (a fraction)
+    Memory and syscalls are regressions if they grow by more then tolerance.
+    '''
+    if baseline.get('scale') != current.get('scale'):
+        print("WARNING: baseline scale %s != current scale %s" % (baseline.get('scale'), current.get('scale')))
+    regressions = 0
+    print("%-22s %14s %14s %14s" % ('benchmark', 'lines/sec', 'peak', 'syscalls') )
+    for name, now in current['results'].items():
+        old = baseline['results'].get( name )
+        if old is None:
+            print("%-22s (not in baseline)" % name )
+            continue
+        speed = now['lines_per_sec'] / old['lines_per_sec'] if old['lines_per_sec'] else 1.0
+        memory = now['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else 1.0
+        old_calls = old['open'] + old['stat'] + old['listdir']
+        now_calls = now['open'] + now['stat'] + now['listdir']
+        calls = now_calls / old_calls if old_calls else 1.0
+        flags = []
+        if speed < (1.0 - tolerance):
+            flags.append('SLOWER')
+        if memory > (1.0 + tolerance):
+            flags.append('MEMORY')
+        if calls > (1.0 + tolerance):
+            flags.append('SYSCALLS')
+        regressions = regressions + len(flags)
+        print("%-22s %13.2fx %13.2fx %13.2fx %s" % (name, speed, memory, calls, ' '.join(flags)))
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser( description="SimpleTextParser benchmark harness" )
+    ap.add_argument( "--scale", type=float, default=1.0, help="input size, 1.0 = 1M line flat file, 1000 include files" )
+    ap.add_argument( "--repeat", type=int, default=3, help="best of N runs" )
+    ap.add_argument( "--save", metavar="FILE", help="write the results as a JSON baseline" )
+    ap.add_argument( "--compare", metavar="FILE", help="compare against a JSON baseline" )
+    ap.add_argument( "--tolerance", type=float, default=0.20, help="allowed change before a regression is reported" )
+    args = ap.parse_args()
+
+    results = run_all( args.scale, args.repeat )
+    report( results )
+    if args.save:
+        with open( args.save, "wt" ) as f:
+            json.dump( results, f, indent=1 )
+    if args.compare:
+        with open( args.compare, "rt" ) as f:
+            baseline = json.load( f )
+        if compare( baseline, results, args.tolerance ) != 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
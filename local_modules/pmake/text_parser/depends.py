@@ -0,0 +1,162 @@
+'''
+Tracks every file the SimpleTextParser depends on.
+
+This is much like "gcc -MD", the parser records:
+    - every file it read, with its size and modification time.
+    - every path it probed while searching for an #include that did not exist.
+      If one of those is created later, an #include may resolve differently.
+
+The result can be written as:
+    - A Make compatible ".d" file, ie: "target: dep1 dep2 ..."
+      Note: missing files are not written to the .d file, make would
+      consider the target out of date forever.
+    - A JSON manifest, which manifest_is_current() uses to decide if
+      the parse can be skipped because nothing changed.
+'''
+import json
+import os
+import typing
+
+from typing import List
+
+# Bump this if the manifest layout changes.
+MANIFEST_FORMAT = 1
+
+
+def make_escape( path : str ) -> str:
+    '''
+    Escape a filename for use in a Makefile rule.
+    '''
+    path = path.replace('$','$$')
+    path = path.replace('#','\\#')
+    path = path.replace(' ','\\ ')
+    return path
+
+
+def file_signature( filename : str ) -> typing.Optional[tuple]:
+    '''
+    Return the (path, size, mtime_ns) of a file, or None if it cannot be stat()ed
+    '''
+    try:
+        st = os.stat( filename )
+    except OSError:
+        return None
+    return ( filename, st.st_size, st.st_mtime_ns )
+
+
+class DependencyTracker():
+    '''
+    The set of input files, and probed but missing files.
+    Both keep the order in which they were found.
+    '''
+    def __init__( self ):
+        # path -> (path, size, mtime_ns)
+        self.inputs : dict = {}
+        # path -> None, used as an ordered set.
+        self.missing : dict = {}
+
+    def clear( self ):
+        self.inputs = {}
+        self.missing = {}
+
+    def add_input( self, signature : tuple ):
+        '''
+        Add a file that was read, the signature is (path, size, mtime_ns)
+        '''
+        if signature[0] not in self.inputs:
+            self.inputs[ signature[0] ] = tuple(signature)
+
+    def add_missing( self, path : str ):
+        '''
+        Add a path that was probed, but did not exist.
+        '''
+        self.missing[ path ] = None
+
+    def input_signatures( self ) -> List[tuple]:
+        return list( self.inputs.values() )
+
+    def missing_paths( self ) -> List[str]:
+        return list( self.missing.keys() )
+
+    def is_current( self ) -> bool:
+        '''
+        True if no input changed and no missing file appeared.
+        '''
+        for signature in self.inputs.values():
+            if file_signature( signature[0] ) != signature:
+                return False
+        for path in self.missing.keys():
+            if os.path.exists( path ):
+                return False
+        return True
+
+    def make_rules( self, targets : List[str], phony : bool = True ) -> str:
+        '''
+        Return the Makefile text, "targets: inputs"
+        If phony, an empty rule is added for every input except the first,
+        so make does not fail if an include file is deleted (like gcc -MP)
+        '''
+        if isinstance( targets, str ):
+            targets = [ targets ]
+        deps = [ make_escape( x ) for x in self.inputs.keys() ]
+        lines = []
+        lines.append( "%s:" % ' '.join( [ make_escape(x) for x in targets ] ) )
+        for dep in deps:
+            lines[-1] = lines[-1] + " \\"
+            lines.append( " " + dep )
+        text = '\n'.join( lines ) + '\n'
+        if phony:
+            for dep in deps[1:]:
+                text = text + "\n%s:\n" % dep
+        return text
+
+    def write_make_depfile( self, filename : str, targets : List[str], phony : bool = True ):
+        '''
+        Write the Make compatible dependency file.
+        '''
+        with open( filename, "wt" ) as f:
+            f.write( self.make_rules( targets, phony ) )
+
+    def manifest( self, fingerprint : str = '' ) -> dict:
+        return {
+            'format'      : MANIFEST_FORMAT,
+            'fingerprint' : fingerprint,
+            'inputs'      : [ list(x) for x in self.inputs.values() ],
+            'missing'     : list( self.missing.keys() )
+        }
+
+    def write_manifest( self, filename : str, fingerprint : str = '' ):
+        '''
+        Write the JSON manifest, the fingerprint describes the #if inputs.
+        '''
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        with open( tmpname, "wt" ) as f:
+            json.dump( self.manifest( fingerprint ), f, indent=1 )
+        os.replace( tmpname, filename )
+
+    @staticmethod
+    def from_manifest( manifest : dict ) -> "DependencyTracker":
+        result = DependencyTracker()
+        for signature in manifest['inputs']:
+            result.add_input( tuple( signature ) )
+        for path in manifest['missing']:
+            result.add_missing( path )
+        return result
+
+
+def manifest_is_current( filename : str, fingerprint : str = '' ) -> bool:
+    '''
+    Given a manifest written by SimpleTextParser.write_manifest()
+    return True if the parse can be skipped, ie: no input file changed,
+    no missing file appeared, and the fingerprint is the same.
+    '''
+    try:
+        with open( filename, "rt" ) as f:
+            manifest = json.load( f )
+    except Exception:
+        return False
+    if (not isinstance( manifest, dict )) or (manifest.get('format') != MANIFEST_FORMAT):
+        return False
+    if manifest.get('fingerprint') != fingerprint:
+        return False
+    return DependencyTracker.from_manifest( manifest ).is_current()
@@ -0,0 +1,119 @@
+'''
+Flattened preprocessor output, much like "cpp -E"
+
+The preprocessed lines of a root file, with every include file expanded
+and every #if decided, are written as one file. Where each line came
+from is kept via markers, like this:
+
+    #line 1 "/path/to/root.yml"
+    key: value
+    #line 1 "/path/to/included.yml"
+    other: value
+    #line 3 "/path/to/root.yml"
+    last: value
+
+A marker is only written when the next line does not simply follow the
+previous one, ie: at include boundaries and after disabled #if blocks.
+read_flattened() turns the file back into WhereStr() lines with the
+original locations, without the include tree.
+
+A line whose where is a range (the IF_DISABLED marker) gets a marker
+with the range, ie: #line 4-9 "/path/to/root.yml"
+
+A source line that starts with "#line" is written with the prefix "#line#"
+so it is not read back as a marker, ie: "#line 5" is written "#line##line 5"
+
+Notes:
+    - A last line without a newline gets one.
+'''
+import os
+import re
+import typing
+
+from pmake.where import Where, WhereRange
+from pmake.where_str import WhereStr
+
+__ALL__ = ['write_flattened', 'read_flattened']
+
+re_line_marker = re.compile( r'^#line (?P<lineno>[0-9]+)(?:-(?P<end_lineno>[0-9]+))? "(?P<filename>(?:[^"\\]|\\.)*)"\n?$' )
+# Written before a source line that starts with "#line"
+LINE_ESCAPE = '#line#'
+
+
+def _quote( filename : str ) -> str:
+    return filename.replace('\\','\\\\').replace('"','\\"')
+
+def _unquote( filename : str ) -> str:
+    return re.sub( r'\\(.)', r'\1', filename )
+
+
+def write_flattened( lines : typing.Iterable[WhereStr], out, relative_to : str = None ) -> int:
+    '''
+    Write the lines, with #line markers, to "out", a filename or a text file object.
+    If "relative_to" is given, filenames are written relative to that directory.
+    Returns the number of lines written, not counting markers.
+    '''
+    if isinstance( out, str ):
+        with open( out, "wt" ) as f:
+            return write_flattened( lines, f, relative_to )
+    write = out.write
+    filename = None
+    next_lineno = None
+    count = 0
+    for text in lines:
+        where = text.where
+        end_lineno = getattr( where, 'end_lineno', None )
+        if (where.filename != filename) or (where.lineno != next_lineno) or (end_lineno is not None):
+            filename = where.filename
+            name = filename if (relative_to is None) else os.path.relpath( filename, relative_to )
+            if end_lineno is None:
+                write( '#line %d "%s"\n' % (where.lineno, _quote( name )) )
+            else:
+                write( '#line %d-%d "%s"\n' % (where.lineno, end_lineno, _quote( name )) )
+        # After a disabled #if block (a range) always write a marker.
+        next_lineno = None if (end_lineno is not None) else where.lineno + 1
+        if text.startswith('#line'):
+            write( LINE_ESCAPE )
+        # WhereStr is a str, no conversion is needed.
+        if text.endswith('\n'):
+            write( text )
+        else:
+            write( text + '\n' )
+        count = count + 1
+    return count
+
+
+def read_flattened( source, relative_to : str = None ) -> typing.Iterator[WhereStr]:
+    '''
+    Read a file written by write_flattened(), "source" is a filename or a text file object.
+    Yields each line as a WhereStr() with the original location.
+    If "relative_to" is given, filenames are joined to that directory.
+    '''
+    if isinstance( source, str ):
+        with open( source, "rt" ) as f:
+            yield from read_flattened( f, relative_to )
+        return
+    filename = "Unknown"
+    lineno = 0
+    # Set by a range marker, for the next line only.
+    end_lineno = None
+    for text in source:
+        if text.startswith('#line'):
+            if text.startswith( LINE_ESCAPE ):
+                text = text[ len(LINE_ESCAPE): ]
+            else:
+                m = re_line_marker.match( text )
+                if m is not None:
+                    filename = _unquote( m['filename'] )
+                    if relative_to is not None:
+                        filename = os.path.normpath( os.path.join( relative_to, filename ) )
+                    lineno = int( m['lineno'] )
+                    end_lineno = m['end_lineno']
+                    continue
+        if end_lineno is not None:
+            yield WhereStr.fast( text, WhereRange( filename, lineno, int( end_lineno ) ) )
+            lineno = int( end_lineno ) + 1
+            end_lineno = None
+            continue
+        yield WhereStr.fast( text, Where( filename, lineno ) )
+        lineno = lineno + 1
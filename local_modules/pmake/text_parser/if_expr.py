@@ -0,0 +1,326 @@
+'''
+A built in #if/#elif expression evaluator for the SimpleTextParser.
+
+It works much like the C preprocessor:
+    - Symbols are created with #define NAME [VALUE], and removed with #undef NAME
+    - defined(NAME) or defined NAME is 1 if the symbol exists.
+    - An undefined NAME used in an expression is 0
+    - A symbol defined without a value is 1
+    - A symbol whose value is not a number is evaluated as an expression.
+    - Integers (decimal, 0x hex, 0 octal), true and false.
+    - The C operators:  ! ~ - +   * / %   + -   << >>   < <= > >=   == !=
+                        & ^ |   &&  ||   ?:   and ( )
+
+Each expression is compiled once into a Python code object, keyed by its text.
+Results are remembered until the next #define/#undef changes the symbol table.
+
+Example:
+    stp = SimpleTextParser()
+    evaluator = stp.use_builtin_evaluator( { 'PLATFORM_LINUX' : '1' } )
+'''
+import hashlib
+import re
+import typing
+
+__ALL__ = ['IfEvaluator', 'IfExprError']
+
+
+class IfExprError( ValueError ):
+    '''
+    Raised for a syntax error, or an error (ie: divide by zero) in an expression.
+    '''
+    pass
+
+
+_re_token = re.compile( r'\s*(?:'
+                        r'(?P<num>0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*|'
+                        r'(?P<ident>[A-Za-z_][A-Za-z0-9_]*)|'
+                        r'(?P<op>\|\||&&|==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^?:()])'
+                        r')' )
+
+# Binary operators, and their precedence (higher binds tighter)
+_binary_ops = {
+    '||' : 1,
+    '&&' : 2,
+    '|'  : 3,
+    '^'  : 4,
+    '&'  : 5,
+    '==' : 6, '!=' : 6,
+    '<'  : 7, '<=' : 7, '>' : 7, '>=' : 7,
+    '<<' : 8, '>>' : 8,
+    '+'  : 9, '-'  : 9,
+    '*'  : 10, '/' : 10, '%' : 10
+}
+
+def _int_literal( text : str ) -> int:
+    '''
+    Convert a C integer literal, ie: 0x10, 010, 10UL
+    '''
+    text = text.rstrip('uUlL')
+    if (len(text) > 1) and (text[0] == '0') and (text[1] not in 'xX'):
+        return int( text, 8 )
+    return int( text, 0 )
+
+def _c_div( a : int, b : int ) -> int:
+    if b == 0:
+        raise IfExprError("divide by zero")
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def _c_mod( a : int, b : int ) -> int:
+    if b == 0:
+        raise IfExprError("divide by zero")
+    return a - b * _c_div( a, b )
+
+
+class _Compiler():
+    '''
+    Recursive descent parser, it produces the text of a Python expression.
+    '''
+    def __init__( self, text : str ):
+        self.text = text
+        self.tokens : typing.List[tuple] = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            m = _re_token.match( text, pos )
+            if (m is None) or (m.end() == pos):
+                raise IfExprError("invalid text at: %s" % text[pos:].strip() )
+            pos = m.end()
+            if m['num'] is not None:
+                self.tokens.append( ('num', m['num']) )
+            elif m['ident'] is not None:
+                self.tokens.append( ('ident', m['ident']) )
+            else:
+                self.tokens.append( ('op', m['op']) )
+        self.pos = 0
+
+    def _peek( self ) -> tuple:
+        if self.pos < len(self.tokens):
+            return self.tokens[ self.pos ]
+        return ( 'end', None )
+
+    def _take( self ) -> tuple:
+        token = self._peek()
+        self.pos = self.pos + 1
+        return token
+
+    def _expect( self, op : str ):
+        token = self._take()
+        if token != ('op', op):
+            raise IfExprError("expected: '%s' in: %s" % (op, self.text))
+
+    def compile( self ) -> str:
+        if len(self.tokens) == 0:
+            raise IfExprError("empty expression")
+        result = self._ternary()
+        if self._peek()[0] != 'end':
+            raise IfExprError("unexpected: '%s' in: %s" % (self._peek()[1], self.text))
+        return result
+
+    def _ternary( self ) -> str:
+        condition = self._binary( 1 )
+        if self._peek() != ('op', '?'):
+            return condition
+        self._take()
+        when_true = self._ternary()
+        self._expect(':')
+        when_false = self._ternary()
+        return "((%s) if (%s) else (%s))" % (when_true, condition, when_false)
+
+    def _binary( self, min_precedence : int ) -> str:
+        lhs = self._unary()
+        while True:
+            kind, op = self._peek()
+            if (kind != 'op') or (op not in _binary_ops) or (_binary_ops[op] < min_precedence):
+                return lhs
+            self._take()
+            rhs = self._binary( _binary_ops[op] + 1 )
+            if op == '||':
+                lhs = "(1 if (%s) or (%s) else 0)" % (lhs, rhs)
+            elif op == '&&':
+                lhs = "(1 if (%s) and (%s) else 0)" % (lhs, rhs)
+            elif op in ('==','!=','<','<=','>','>='):
+                lhs = "(1 if (%s) %s (%s) else 0)" % (lhs, op, rhs)
+            elif op == '/':
+                lhs = "_div(%s, %s)" % (lhs, rhs)
+            elif op == '%':
+                lhs = "_mod(%s, %s)" % (lhs, rhs)
+            else:
+                lhs = "(%s %s %s)" % (lhs, op, rhs)
+
+    def _unary( self ) -> str:
+        kind, value = self._peek()
+        if (kind == 'op') and (value in ('!','~','-','+')):
+            self._take()
+            operand = self._unary()
+            if value == '!':
+                return "(0 if (%s) else 1)" % operand
+            return "(%s%s)" % (value, operand)
+        return self._primary()
+
+    def _primary( self ) -> str:
+        kind, value = self._take()
+        if kind == 'num':
+            return str( _int_literal( value ) )
+        if kind == 'ident':
+            if value == 'defined':
+                # defined(NAME) or defined NAME
+                paren = self._peek() == ('op', '(')
+                if paren:
+                    self._take()
+                kind, name = self._take()
+                if kind != 'ident':
+                    raise IfExprError("defined requires a name in: %s" % self.text)
+                if paren:
+                    self._expect(')')
+                return "_d(%s)" % repr(name)
+            if value == 'true':
+                return "1"
+            if value == 'false':
+                return "0"
+            return "_v(%s)" % repr(value)
+        if (kind, value) == ('op', '('):
+            result = self._ternary()
+            self._expect(')')
+            return "(%s)" % result
+        if kind == 'end':
+            raise IfExprError("unexpected end of expression: %s" % self.text)
+        raise IfExprError("unexpected: '%s' in: %s" % (value, self.text))
+
+
+class IfEvaluator():
+    '''
+    The built in evaluator, pass an instance as SimpleTextParser.if_evaluator
+    or call SimpleTextParser.use_builtin_evaluator()
+    '''
+    # Limits symbol values that refer to other symbols, ie: A -> B -> A
+    MAX_DEPTH = 50
+
+    def __init__( self, defines : typing.Optional[dict] = None ):
+        self._symbols : typing.Dict[str, str] = {}
+        # Bumped on every change to the symbol table.
+        self.version = 0
+        # expression text -> code object, valid forever.
+        self._code_cache : dict = {}
+        # expression text -> result, and symbol name -> value, valid for one version.
+        self._results : dict = {}
+        self._values : dict = {}
+        self._depth = 0
+        self._globals = {
+            '__builtins__' : {},
+            '_v'   : self._value,
+            '_d'   : self.is_defined,
+            '_div' : _c_div,
+            '_mod' : _c_mod
+        }
+        # Statistics
+        self.compiles = 0
+        self.evaluations = 0
+        self.memo_hits = 0
+        if defines is not None:
+            for name, value in defines.items():
+                self.define( name, value )
+
+    def __call__( self, parser, text : str ) -> bool:
+        '''
+        The SimpleTextParser calls this for #if and #elif
+        '''
+        return self.evaluate( text ) != 0
+
+    def define( self, name : str, value : str = '' ):
+        self._symbols[ name ] = value.strip()
+        self._changed()
+
+    def undef( self, name : str ):
+        if name in self._symbols:
+            del self._symbols[ name ]
+            self._changed()
+
+    def is_defined( self, name : str ) -> int:
+        return 1 if name in self._symbols else 0
+
+    @property
+    def symbols( self ) -> dict:
+        '''
+        A copy of the symbol table.
+        '''
+        return dict( self._symbols )
+
+    def set_symbols( self, symbols : dict ):
+        '''
+        Replace the symbol table, ie: with one from the symbols property.
+        '''
+        self._symbols = dict( symbols )
+        self._changed()
+
+    def fingerprint( self ) -> str:
+        '''
+        A string that changes when the symbol table changes,
+        suitable for SimpleTextParser.enable_cache()
+        '''
+        text = repr( sorted( self._symbols.items() ) )
+        return hashlib.sha1( text.encode('utf-8') ).hexdigest()
+
+    def _changed( self ):
+        self.version = self.version + 1
+        self._results = {}
+        self._values = {}
+
+    def compile( self, text : str ):
+        '''
+        Return the code object for the expression, compiling it if needed.
+        '''
+        code = self._code_cache.get( text )
+        if code is None:
+            self.compiles = self.compiles + 1
+            source = _Compiler( text ).compile()
+            code = compile( source, '<#if %s>' % text, 'eval' )
+            self._code_cache[ text ] = code
+        return code
+
+    def evaluate( self, text : str ) -> int:
+        '''
+        Evaluate the expression, return an integer.
+        '''
+        result = self._results.get( text )
+        if result is not None:
+            self.memo_hits = self.memo_hits + 1
+            return result
+        code = self.compile( text )
+        self.evaluations = self.evaluations + 1
+        try:
+            result = eval( code, self._globals )
+        except IfExprError:
+            raise
+        except (ArithmeticError, ValueError, TypeError) as E:
+            raise IfExprError( "%s: %s" % (text, str(E)) )
+        self._results[ text ] = result
+        return result
+
+    def _value( self, name : str ) -> int:
+        '''
+        The value of a symbol used in an expression.
+        '''
+        value = self._values.get( name )
+        if value is not None:
+            return value
+        text = self._symbols.get( name )
+        if text is None:
+            return 0
+        if text == '':
+            value = 1
+        else:
+            try:
+                value = _int_literal( text )
+            except ValueError:
+                # Not a number, evaluate it as an expression.
+                if self._depth > IfEvaluator.MAX_DEPTH:
+                    raise IfExprError("symbol is recursive: %s" % name)
+                self._depth = self._depth + 1
+                try:
+                    value = self.evaluate( text )
+                finally:
+                    self._depth = self._depth - 1
+        self._values[ name ] = value
+        return value
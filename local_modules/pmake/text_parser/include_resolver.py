@@ -0,0 +1,133 @@
+'''
+Resolves the filename in an #include statement to a file on disk.
+
+The search order is:
+    1) The directory of the file containing the #include
+    2) The current directory of the application
+    3) Each "-I" directory, in the order given.
+
+Every (current directory, including directory, name) is resolved once,
+and the answer is remembered - including "not found". The current
+directory is part of the key because it is on the search path, and
+relative "-I" directories are relative to it. Optionally the
+directory listings of the search directories can be read once up
+front, then most of the probes become a set lookup, not a stat() call.
+
+NOTE: The answers are not refreshed, if files are created or removed
+while parsing, call clear().
+'''
+import os
+import typing
+
+from typing import List
+
+
+class IncludeResolver():
+    '''
+    Memoized include file lookup.
+    '''
+    def __init__( self, include_path_list : List[str] ):
+        # This is the parser's list, so additions are seen here.
+        self._include_path_list : List[str] = include_path_list
+        # (cwd, including_dir, name) -> (found-or-None, identity-or-None, tuple of tried paths)
+        self._cache : dict = {}
+        # absolute directory -> frozenset of names, or None if it cannot be read.
+        self._dir_index : dict = {}
+        # Statistics
+        self.lookups = 0
+        self.cache_hits = 0
+        self.negative_hits = 0
+        self.stat_calls = 0
+        self.listdir_calls = 0
+        self.index_hits = 0
+
+    def clear( self ):
+        '''
+        Forget everything, the next lookups go back to the file system.
+        '''
+        self._cache = {}
+        self._dir_index = {}
+
+    def index_directories( self ):
+        '''
+        Read the listing of the current directory and all of the
+        include path directories once, so that probing them is cheap.
+        '''
+        cwd = os.getcwd()
+        self._index( cwd )
+        for idir in self._include_path_list:
+            self._index( os.path.join( cwd, idir ) )
+
+    def _index( self, dirname : str ):
+        '''
+        dirname is absolute, see _isfile()
+        '''
+        if dirname in self._dir_index:
+            return
+        self.listdir_calls = self.listdir_calls + 1
+        try:
+            names = frozenset( os.listdir( dirname ) )
+        except OSError:
+            names = None
+        self._dir_index[ dirname ] = names
+
+    def _isfile( self, dirname : str, name : str, path : str ) -> bool:
+        '''
+        Does "name" exist as a file in "dirname" (absolute), ie: at "path"
+        '''
+        if (dirname in self._dir_index) and (os.sep not in name) and ((os.altsep is None) or (os.altsep not in name)):
+            names = self._dir_index[ dirname ]
+            if (names is None) or (name not in names):
+                # The directory listing says no, there is no need to ask the OS.
+                self.index_hits = self.index_hits + 1
+                return False
+        # Present in the listing (it might be a directory) or not indexed.
+        self.stat_calls = self.stat_calls + 1
+        return os.path.isfile( path )
+
+    def resolve( self, including_dir : str, name : str ) -> typing.Tuple[typing.Optional[str], typing.Optional[str], tuple]:
+        '''
+        Find the include file "name" included by a file in the directory "including_dir"
+        Returns the tuple: (found, identity, tried)
+            found is the path, as found on the search path, or None if not found
+            identity is the absolute path, it identifies the file (ie: #pragma once)
+            tried is the list of paths that were considered.
+        '''
+        self.lookups = self.lookups + 1
+        cwd = os.getcwd()
+        key = ( cwd, including_dir, name )
+        result = self._cache.get( key )
+        if result is not None:
+            self.cache_hits = self.cache_hits + 1
+            if result[0] is None:
+                self.negative_hits = self.negative_hits + 1
+            return result
+        pathlist = [ including_dir, cwd ]
+        pathlist.extend( self._include_path_list )
+        found = None
+        identity = None
+        tried = []
+        for idir in pathlist:
+            path = os.path.join( idir, name )
+            tried.append( path )
+            if self._isfile( os.path.join( cwd, idir ), name, path ):
+                # YEA, success! the absolute name identifies the file.
+                found = path
+                identity = os.path.abspath( path )
+                break
+        result = ( found, identity, tuple(tried) )
+        self._cache[ key ] = result
+        return result
+
+    def stats( self ) -> dict:
+        '''
+        Return the lookup counters as a dict.
+        '''
+        return {
+            'lookups'       : self.lookups,
+            'cache_hits'    : self.cache_hits,
+            'negative_hits' : self.negative_hits,
+            'stat_calls'    : self.stat_calls,
+            'listdir_calls' : self.listdir_calls,
+            'index_hits'    : self.index_hits
+        }
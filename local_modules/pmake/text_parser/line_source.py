@@ -0,0 +1,166 @@
+'''
+A LineSource is the bottom layer of the SimpleTextParser.
+
+Rather then calling readline() once per line, the entire file is read
+in one shot, and the start offset of every line is computed up front.
+Lines are then handed out by slicing the decoded text.
+
+The rules match what readline() does:
+    - Lines are split on '\\n' only (the file is opened in text mode,
+      so '\\r\\n' has already been translated)
+    - Each line keeps its '\\n', the last line might not have one.
+    - At the end of the file, '' is returned.
+
+The offset table is kept after the file is read, so error reports can
+show any line (and the lines around it) without reading the file again.
+'''
+import os
+import re
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from typing import List
+from pmake.where import Where
+
+# The #if/#else/#elif/#endif lines, this must agree with the parser's keyword regex.
+re_flow_control = re.compile( '^[#](if|else|endif|elif)', re.MULTILINE )
+
+
+class LineSource():
+    '''
+    The decoded text of one file, plus a table of line start offsets.
+
+    offsets[n] is the start of line n+1 (lines are numbered from 1)
+    and offsets[-1] is the length of the text, thus line n is:
+        text[ offsets[n-1] : offsets[n] ]
+    '''
+    def __init__( self, filename : str, text : str ):
+        self.filename = filename
+        self.text = text
+        parts = text.split('\n')
+        # if the file ends with a newline, the last part is empty.
+        if len(parts[-1]) == 0:
+            parts.pop()
+        self.offsets = array( 'q', [0] )
+        self.offsets.extend( accumulate( (len(p) + 1 for p in parts) ) )
+        # the last line may not have a newline.
+        if self.offsets[-1] > len(text):
+            self.offsets[-1] = len(text)
+        # The number of lines in the file.
+        self.nlines : int = len(self.offsets) - 1
+        # The number of lines handed out so far
+        self.lineno : int = 0
+        # When read from a file, the file size and modification time.
+        self.size : int = None
+        self.mtime_ns : int = None
+
+    @staticmethod
+    def from_file( filename : str ) -> "LineSource":
+        '''
+        Read the entire file and create a line source for it.
+        '''
+        with open( filename, "rt" ) as f:
+            # stat() before reading, if the file changes while we read
+            # it the recorded time is older then the file and that is safe.
+            st = os.fstat( f.fileno() )
+            text = f.read()
+        source = LineSource( filename, text )
+        source.size = st.st_size
+        source.mtime_ns = st.st_mtime_ns
+        return source
+
+    def signature( self ) -> tuple:
+        '''
+        Return (filename, size, mtime_ns) identifying this version of the file.
+        '''
+        return ( self.filename, self.size, self.mtime_ns )
+
+    def next_line( self ) -> str:
+        '''
+        Return the next line, or '' at the end of the file.
+        '''
+        n = self.lineno
+        if n >= self.nlines:
+            return ''
+        self.lineno = n + 1
+        return self.text[ self.offsets[n] : self.offsets[n+1] ]
+
+    def line_span( self, lineno : int ) -> tuple:
+        '''
+        Return the (start, end) offsets of the line in the text, without the newline.
+        Raises IndexError if there is no such line.
+        '''
+        if (lineno < 1) or (lineno > self.nlines):
+            raise IndexError("%s: no line: %d" % (self.filename, lineno))
+        start = self.offsets[lineno-1]
+        end = self.offsets[lineno]
+        if (end > start) and (self.text[end-1] == '\n'):
+            end = end - 1
+        return ( start, end )
+
+    def position( self, offset : int ) -> Where:
+        '''
+        Return the Where (line and column, from 1) of the character at "offset"
+        This makes a LineSource a buffer for pmake.where_str.WhereStrView
+        '''
+        lineno = bisect_right( self.offsets, offset )
+        if lineno > self.nlines:
+            # The very end of the text.
+            lineno = max( 1, self.nlines )
+        return Where( self.filename, lineno, offset - self.offsets[lineno-1] + 1 )
+
+    def line_text( self, lineno : int ) -> str:
+        '''
+        Return the text of line "lineno" (numbered from 1) without the newline.
+        '''
+        start, end = self.line_span( lineno )
+        return self.text[ start : end ]
+
+    def snippet( self, lineno : int, context : int = 2, end_lineno : int = None ) -> List[str]:
+        '''
+        Return the lines lineno (to end_lineno), plus "context" lines before and after
+        formatted for an error report, the lines in question are marked with ">"
+        ie:
+                12 | text
+            >   13 | the line with the error
+                14 | text
+        '''
+        if end_lineno is None:
+            end_lineno = lineno
+        first = max( 1, lineno - context )
+        last = min( self.nlines, end_lineno + context )
+        result = []
+        for n in range( first, last + 1 ):
+            mark = '>' if (lineno <= n <= end_lineno) else ' '
+            result.append( "%s %5d | %s" % (mark, n, self.line_text( n )) )
+        return result
+
+    def skip_conditional( self ) -> int:
+        '''
+        We are in the false side of an #if, skip forward to the matching
+        #elif, #else or #endif without reading the lines in between.
+        Nested #if/#endif pairs are skipped as a whole.
+
+        The next line returned will be that #elif/#else/#endif, or the EOF.
+        Returns the number of lines skipped.
+        '''
+        start = self.lineno
+        if start >= self.nlines:
+            return 0
+        offsets = self.offsets
+        stop = self.nlines
+        depth = 0
+        for m in re_flow_control.finditer( self.text, offsets[start] ):
+            kw = m.group(1)
+            if kw == 'if':
+                depth = depth + 1
+                continue
+            if depth > 0:
+                if kw == 'endif':
+                    depth = depth - 1
+                continue
+            # An #elif, #else or #endif at our level.
+            stop = bisect_right( offsets, m.start() ) - 1
+            break
+        self.lineno = stop
+        return stop - start
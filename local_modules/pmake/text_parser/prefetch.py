@@ -0,0 +1,126 @@
+'''
+Reads #include files ahead of time, on a small pool of threads.
+
+When a file is opened, the SimpleTextParser scans its text for #include
+statements, resolves the names (on the parser's thread) and asks the
+prefetcher to load those files. By the time the parser reaches the
+#include the file has often been read and split into lines already.
+This helps most when the files are on a slow (ie: network) file system.
+
+The loaded, but not yet used, files are limited by a byte budget.
+A file that does not fit is dropped, and the parser reads it itself.
+
+Prefetching is a hint, the parser works the same with or without it.
+Files inside disabled #if blocks may be read for nothing.
+'''
+import threading
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+from pmake.text_parser.line_source import LineSource
+
+__ALL__ = ['IncludePrefetcher']
+
+
+class IncludePrefetcher():
+    '''
+    A pool of threads reading files into LineSource() objects.
+    '''
+    def __init__( self, workers : int = 4, byte_budget : int = 32 * 1024 * 1024 ):
+        if workers < 1:
+            raise ValueError("prefetch workers must be >= 1, not: %d" % workers)
+        self.byte_budget = byte_budget
+        self._executor = ThreadPoolExecutor( max_workers=workers, thread_name_prefix="pmake-prefetch" )
+        # filename -> Future, the result is a LineSource or None
+        self._futures : dict = {}
+        # The bytes loaded, but not yet taken by the parser.
+        self._lock = threading.Lock()
+        self._in_use = 0
+        # Statistics
+        self.requested = 0
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def _load( self, filename : str ) -> typing.Optional[LineSource]:
+        '''
+        Runs in a worker thread.
+        '''
+        try:
+            source = LineSource.from_file( filename )
+        except OSError:
+            # The parser will try again, and report the error.
+            with self._lock:
+                self.errors = self.errors + 1
+            return None
+        with self._lock:
+            if (self._in_use + source.size) > self.byte_budget:
+                self.dropped = self.dropped + 1
+                return None
+            self._in_use = self._in_use + source.size
+        return source
+
+    def request( self, filename : str ):
+        '''
+        Start loading this file, unless it is already loading.
+        '''
+        if filename in self._futures:
+            return
+        with self._lock:
+            if self._in_use >= self.byte_budget:
+                # Full, do not bother.
+                self.dropped = self.dropped + 1
+                return
+        self.requested = self.requested + 1
+        self._futures[ filename ] = self._executor.submit( self._load, filename )
+
+    def take( self, filename : str ) -> typing.Optional[LineSource]:
+        '''
+        Return the loaded file, or None if it was not prefetched.
+        If the file is still being read, this waits for it.
+        '''
+        future = self._futures.pop( filename, None )
+        if future is None:
+            self.misses = self.misses + 1
+            return None
+        source = future.result()
+        if source is None:
+            self.misses = self.misses + 1
+            return None
+        with self._lock:
+            self._in_use = self._in_use - source.size
+        self.hits = self.hits + 1
+        return source
+
+    def discard( self ):
+        '''
+        Forget every file that was not taken, ie: at the end of the root file.
+        '''
+        futures = self._futures
+        self._futures = {}
+        for future in futures.values():
+            if not future.cancel():
+                source = future.result()
+                if source is not None:
+                    with self._lock:
+                        self._in_use = self._in_use - source.size
+
+    def shutdown( self ):
+        '''
+        Stop the worker threads.
+        '''
+        self.discard()
+        self._executor.shutdown( wait=True )
+
+    def stats( self ) -> dict:
+        '''
+        Return the prefetch counters as a dict.
+        '''
+        return {
+            'requested' : self.requested,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'dropped'   : self.dropped,
+            'errors'    : self.errors
+        }
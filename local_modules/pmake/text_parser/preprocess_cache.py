@@ -0,0 +1,131 @@
+'''
+An on-disk cache of the SimpleTextParser output.
+
+Preprocessing the same include tree over and over again is a waste when
+nothing has changed. This cache stores the final line stream produced by
+the parser (the text, and where each line came from) in a cache directory.
+
+An entry is found by a key built from:
+    - The absolute name of the root file
+    - The include path list, and the current directory
+      (these decide which file an #include resolves to)
+    - A fingerprint provided by the client describing the inputs
+      to the if_evaluator, ie: the variables it looks at.
+      With the built in evaluator its starting symbol table is included,
+      and the #define/#undef statements are saved and re-applied on a hit.
+
+Each entry records every file that was read as (path, size, mtime_ns),
+and every include path probed that did not exist (see depends.py)
+When any of these change (or appear) the entry is thrown away.
+'''
+import hashlib
+import os
+import pickle
+import typing
+
+from typing import List
+from pmake.text_parser.depends import DependencyTracker
+
+# Bump this if the entry layout changes, old entries are then ignored.
+CACHE_FORMAT = 4
+
+
+class CacheRecorder():
+    '''
+    Collects the line stream while the parser runs.
+    Where() objects are not stored directly, filenames go into a table
+    and each line refers to its file by index.
+    '''
+    def __init__( self, key : str ):
+        self.key = key
+        self.files : List[str] = []
+        self._file_index : dict = {}
+        self.lines : List[tuple] = []
+        # (op, name, value) for each #define and #undef, re-applied on a hit.
+        self.defines : List[tuple] = []
+
+    def add_line( self, text ):
+        where = text.where
+        # Keyed by the file id, the entry holds the names.
+        idx = self._file_index.get( where.file_id )
+        if idx is None:
+            idx = len(self.files)
+            self.files.append( where.filename )
+            self._file_index[ where.file_id ] = idx
+        # Disabled #if blocks have a range, not just a line.
+        end_lineno = getattr( where, 'end_lineno', None )
+        # A plain str, the where is stored as the file index and line numbers.
+        self.lines.append( ( str(text), idx, where.lineno, end_lineno ) )
+
+    def add_define( self, op : str, name : str, value : str ):
+        self.defines.append( ( op, name, value ) )
+
+    def as_entry( self, dependencies : DependencyTracker ) -> dict:
+        return {
+            'format'  : CACHE_FORMAT,
+            'key'     : self.key,
+            'deps'    : dependencies.input_signatures(),
+            'missing' : dependencies.missing_paths(),
+            'files'   : self.files,
+            'defines' : self.defines,
+            'lines'   : self.lines
+        }
+
+
+class PreprocessCache():
+    '''
+    The cache directory, one file per entry.
+    '''
+    def __init__( self, directory : str ):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def make_key( self, root_filename : str, fingerprint : str, include_path_list : List[str] ) -> str:
+        '''
+        Return the key used to find the entry for this root file.
+        '''
+        text = repr( ( CACHE_FORMAT, root_filename, fingerprint, list(include_path_list), os.getcwd() ) )
+        return hashlib.sha1( text.encode('utf-8') ).hexdigest()
+
+    def _entry_filename( self, key : str ) -> str:
+        return os.path.join( self.directory, key + ".ppcache" )
+
+    def load( self, key : str ) -> typing.Optional[dict]:
+        '''
+        Return the entry if it exists and all of its inputs are unchanged.
+        Otherwise return None.
+        '''
+        try:
+            with open( self._entry_filename( key ), "rb" ) as f:
+                entry = pickle.load( f )
+        except Exception:
+            # Missing, or unreadable, either way it is a miss.
+            self.misses = self.misses + 1
+            return None
+        if (not isinstance( entry, dict )) or (entry.get('format') != CACHE_FORMAT) or (entry.get('key') != key):
+            self.misses = self.misses + 1
+            return None
+        tracker = DependencyTracker()
+        for signature in entry['deps']:
+            tracker.add_input( signature )
+        for path in entry['missing']:
+            tracker.add_missing( path )
+        if not tracker.is_current():
+            # Something changed.
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        return entry
+
+    def store( self, entry : dict ):
+        '''
+        Write the entry, this is done via a temp file so that
+        a partial entry is never seen by another run.
+        '''
+        os.makedirs( self.directory, exist_ok=True )
+        filename = self._entry_filename( entry['key'] )
+        tmpname = "%s.%d.tmp" % (filename, os.getpid())
+        with open( tmpname, "wb" ) as f:
+            pickle.dump( entry, f, protocol=pickle.HIGHEST_PROTOCOL )
+        os.replace( tmpname, filename )
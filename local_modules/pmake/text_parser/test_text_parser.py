@@ -4,7 +4,11 @@ import os
 import shutil
 import tempfile
 
-from pmake.text_parser  import SimpleTextParser
+from pmake.text_parser  import SimpleTextParser, manifest_is_current
+from pmake.text_parser  import IfEvaluator, IfExprError
+from pmake.text_parser  import read_flattened
+from pmake.text_parser.text_parser import ParseError, find_include_guard
+from pmake.where_str import WhereStr
 
 _temp_dir=None
 
@@ -61,6 +65,28 @@ class SimpleTextParser_Test( unittest.TestCase ):
                 break
             self.assertEqual( txt, expected[x] )
 
+    def test_line_source_rules(self):
+        '''
+        The bulk line source must act like readline()
+        '''
+        fn = self.temp_filename("line_source.txt")
+        with open( fn, "wt" ) as f:
+            f.write("one\n\nthree\fstill-three\nno-newline")
+        self.DUT.open_file( fn )
+        expected = [ "one\n", "\n", "three\fstill-three\n", "no-newline", "", "" ]
+        for x in range(0,len(expected)):
+            txt = self.DUT.raw_next_line()
+            self.assertEqual( txt, expected[x] )
+            if x < 4:
+                self.assertEqual( txt.where.lineno, x+1 )
+
+    def test_empty_file(self):
+        fn = self.temp_filename("empty.txt")
+        with open( fn, "wt" ) as f:
+            pass
+        self.DUT.open_file( fn )
+        self.assertEqual( self.DUT.raw_next_line(), '' )
+
     def _write_expected( self, text ):
         '''
         Used when constructing a #if/#else/#endif test
@@ -168,11 +194,42 @@ class SimpleTextParser_Test( unittest.TestCase ):
         self._write_preprocessor("#if 1\n")
         self._write_expected("before-elif\n")
         self._write_preprocessor("#elif 1\n")
-        self._write_expected("inside-elif-1\n")
+        # The #if branch was taken, so this is disabled.
+        self._write_disabled("inside-elif-1\n")
         self._write_preprocessor("#elif 0\n")
         self._write_disabled("inside elif-0\n")
         self._write_preprocessor("#endif\n")
         self._write_expected("normal-text\n")
+        # A true #if, then a true #elif, then #else: only the #if side.
+        self._write_preprocessor("#if 1\n")
+        self._write_expected("if-taken\n")
+        self._write_preprocessor("#elif 1\n")
+        self._write_disabled("elif-not-taken\n")
+        # Not evaluated (the test evaluator would fail on it)
+        self._write_preprocessor("#elif not-a-number\n")
+        self._write_disabled("elif-not-evaluated\n")
+        self._write_preprocessor("#else\n")
+        self._write_disabled("else-not-taken\n")
+        self._write_preprocessor("#endif\n")
+        # The first true #elif only, and not the #else.
+        self._write_preprocessor("#if 0\n")
+        self._write_disabled("if-not-taken\n")
+        self._write_preprocessor("#elif 1\n")
+        self._write_expected("elif-taken\n")
+        self._write_preprocessor("#elif 1\n")
+        self._write_disabled("second-elif-not-taken\n")
+        self._write_preprocessor("#else\n")
+        self._write_disabled("else-not-taken\n")
+        self._write_preprocessor("#endif\n")
+        # No branch taken, then the #else is.
+        self._write_preprocessor("#if 0\n")
+        self._write_disabled("if-not-taken\n")
+        self._write_preprocessor("#elif 0\n")
+        self._write_disabled("elif-not-taken\n")
+        self._write_preprocessor("#else\n")
+        self._write_expected("else-taken\n")
+        self._write_preprocessor("#endif\n")
+        self._write_expected("end-text\n")
         self.test_fp.close()
         self.test_fp = None
         return filenameA, self.expected
@@ -191,6 +248,620 @@ class SimpleTextParser_Test( unittest.TestCase ):
         self.DUT.if_evaluator = self.expression_evaluator
         self.read_expected( filenameA, expected )
 
+    def _read_all( self, filename ):
+        '''
+        Read everything with a fresh (cached) parser, return the lines as (text, filename, lineno)
+        '''
+        self.DUT = SimpleTextParser()
+        self.DUT.enable_cache( self.temp_filename("cache-dir"), fingerprint="test" )
+        self.DUT.if_evaluator = self.expression_evaluator
+        self.DUT.open_file( filename )
+        result = []
+        while True:
+            txt = self.DUT.next_preprocessed_line()
+            if len(txt) == 0:
+                break
+            result.append( ( txt.as_str(), txt.where.filename, txt.where.lineno ) )
+        return result
+
+    def test_cache(self):
+        filenameA = self.temp_filename( 'cacheA' )
+        filenameB = self.temp_filename( 'includeB' )
+        self.create_include_test_files( filenameA, filenameB )
+        shutil.rmtree( self.temp_filename("cache-dir"), ignore_errors=True )
+        first = self._read_all( filenameA )
+        self.assertFalse( self.DUT.cache_hit )
+        # Second time around, it comes from the cache
+        second = self._read_all( filenameA )
+        self.assertTrue( self.DUT.cache_hit )
+        self.assertEqual( first, second )
+        self.assertEqual( second[7], ( "lineB-1\n", filenameB, 2 ) )
+        # Change the include file, that must invalidate the entry.
+        with open( filenameB, "at" ) as f:
+            f.write("lineB-new\n")
+        third = self._read_all( filenameA )
+        self.assertFalse( self.DUT.cache_hit )
+        self.assertEqual( third[11][0], "lineB-new\n" )
+        # A different fingerprint is a different entry.
+        self.DUT = SimpleTextParser()
+        self.DUT.enable_cache( self.temp_filename("cache-dir"), fingerprint="other" )
+        self.DUT.open_file( filenameA )
+        self.assertFalse( self.DUT.cache_hit )
+
+    def test_cache_raw_read(self):
+        '''
+        Raw lines are not preprocessed, a root file read that way is not cached.
+        '''
+        fn = self._write_file( "cache-raw.txt", [ "one", "#if 0", "#endif", "four" ] )
+        cache_dir = self.temp_filename( "cache-raw-dir" )
+        shutil.rmtree( cache_dir, ignore_errors=True )
+        P = SimpleTextParser.PREPROCESSING_LINE
+        for raw in ( True, False ):
+            self.DUT = SimpleTextParser()
+            self.DUT.enable_cache( cache_dir, fingerprint="test" )
+            self.DUT.if_evaluator = self.expression_evaluator
+            self.DUT.open_file( fn )
+            self.assertFalse( self.DUT.cache_hit )
+            self.assertEqual( self.DUT.next_preprocessed_line(), "one\n" )
+            if raw:
+                self.assertEqual( self.DUT.raw_next_line(), "#if 0\n" )
+                self.assertEqual( self.DUT.raw_next_line(), "#endif\n" )
+            else:
+                self.assertEqual( [ self.DUT.next_preprocessed_line() for x in range(0,2) ], [ P, P ] )
+            self.assertEqual( self.DUT.next_preprocessed_line(), "four\n" )
+            self.assertEqual( self.DUT.next_preprocessed_line(), "" )
+
+    def test_include_resolver(self):
+        '''
+        The same include, many times, is only searched for once.
+        '''
+        idir = self.temp_filename("resolver-inc")
+        os.makedirs( idir, exist_ok=True )
+        with open( os.path.join( idir, "common.txt" ), "wt" ) as f:
+            f.write("common\n")
+        fn = self.temp_filename("resolver-main.txt")
+        with open( fn, "wt" ) as f:
+            for x in range(0,10):
+                f.write('#include "common.txt"\n')
+        self.DUT.add_include_path( self.temp_filename("resolver-missing-dir") )
+        self.DUT.add_include_path( idir )
+        self.DUT.index_include_paths()
+        self.DUT.open_file( fn )
+        lines = []
+        while True:
+            txt = self.DUT.next_preprocessed_line()
+            if len(txt) == 0:
+                break
+            lines.append( txt.as_str() )
+        self.assertEqual( lines.count("common\n"), 10 )
+        stats = self.DUT.include_stats()
+        self.assertEqual( stats['lookups'], 10 )
+        self.assertEqual( stats['cache_hits'], 9 )
+        # The directory of the including file is not indexed, so it is stat()ed
+        # and the file that exists is confirmed, the indexed misses are free.
+        self.assertEqual( stats['stat_calls'], 2 )
+        self.assertEqual( stats['index_hits'], 2 )
+
+    def test_include_resolver_cwd(self):
+        '''
+        The current directory is on the search path, the where keeps the name as found.
+        '''
+        topdir = self.temp_filename("resolver-cwd")
+        for sub in ( "a", "b", "c" ):
+            os.makedirs( os.path.join( topdir, sub, "inc" ), exist_ok=True )
+        for sub in ( "a", "b" ):
+            with open( os.path.join( topdir, sub, "inc", "cwd.txt" ), "wt" ) as f:
+                f.write("#pragma once\nfrom-%s\n" % sub )
+        fn = os.path.join( topdir, "c", "cwd-main.txt" )
+        with open( fn, "wt" ) as f:
+            f.write('#include "cwd.txt"\n#include "cwd.txt"\n')
+        self.DUT.add_include_path( "inc" )
+        self.DUT.index_include_paths()
+        saved = os.getcwd()
+        try:
+            result = {}
+            for sub in ( "a", "b" ):
+                os.chdir( os.path.join( topdir, sub ) )
+                self.DUT.open_file( fn )
+                result[ sub ] = list( self.DUT.iter_preprocessed() )
+        finally:
+            os.chdir( saved )
+        self.assertEqual( [ x.as_str() for x in result['a'] ], [ "from-a\n" ] )
+        self.assertEqual( [ x.as_str() for x in result['b'] ], [ "from-b\n" ] )
+        self.assertEqual( result['b'][0].where.filename, os.path.join( "inc", "cwd.txt" ) )
+        # The absolute name identifies the file.
+        counts = self.DUT.include_counts()
+        self.assertEqual( counts[ os.path.join( topdir, "b", "inc", "cwd.txt" ) ], { 'included' : 1, 'skipped' : 1, 'replayed' : 0 } )
+
+    def test_include_missing(self):
+        fn = self.temp_filename("resolver-missing.txt")
+        with open( fn, "wt" ) as f:
+            f.write('#include "does-not-exist.txt"\n')
+            f.write('#include "does-not-exist.txt"\n')
+        self.DUT.unit_test_mode()
+        self.DUT.open_file( fn )
+        for x in range(0,2):
+            with self.assertRaises( ParseError ):
+                self.DUT.next_preprocessed_line()
+        self.assertEqual( self.DUT.include_stats()['negative_hits'], 1 )
+
+    def test_iterators(self):
+        filenameA = self.temp_filename( 'iterA' )
+        filenameB = self.temp_filename( 'includeB' )
+        expected = self.create_include_test_files( filenameA, filenameB )
+        # With markers, this is the same as next_preprocessed_line() ... minus the final ''
+        self.DUT.open_file( filenameA )
+        lines = [ x.as_str() for x in self.DUT.iter_preprocessed( markers=True ) ]
+        self.assertEqual( lines, expected[:-1] )
+        # without markers
+        self.DUT = SimpleTextParser()
+        self.DUT.open_file( filenameA )
+        lines = [ x.as_str() for x in self.DUT.iter_preprocessed() ]
+        self.assertEqual( lines, [ x for x in expected[:-1] if x != SimpleTextParser.INCLUDE_BARRIER ] )
+        # in chunks
+        self.DUT = SimpleTextParser()
+        self.DUT.open_file( filenameA )
+        chunks = list( self.DUT.iter_chunks( 4 ) )
+        self.assertEqual( [ len(x) for x in chunks ], [4,4,4,3] )
+        self.assertEqual( chunks[1][0].where.filename, filenameA )
+        self.assertEqual( chunks[1][1].where.filename, filenameB )
+        # raw does not follow includes.
+        self.DUT = SimpleTextParser()
+        self.DUT.open_file( filenameA )
+        lines = list( self.DUT.iter_raw() )
+        self.assertEqual( len(lines), 11 )
+        self.assertEqual( lines[5], '#include "includeB"\n' )
+
+    def test_disabled_block_skip(self):
+        '''
+        A large disabled block, with nested #if statements
+        is returned as one IF_DISABLED line covering the range.
+        '''
+        fn = self.temp_filename("disabled-block.txt")
+        with open( fn, "wt" ) as f:
+            f.write("#if 0\n")             # 1
+            f.write("disabled-1\n")        # 2
+            f.write("#if NotANumber\n")    # 3 - must not be evaluated
+            f.write("nested\n")            # 4
+            f.write("#else\n")             # 5 - must not enable anything
+            f.write("nested-else\n")       # 6
+            f.write("#endif\n")            # 7
+            f.write("#include \"no-such-file\"\n") # 8
+            f.write("disabled-2\n")        # 9
+            f.write("#else\n")             # 10
+            f.write("enabled\n")           # 11
+            f.write("#endif\n")            # 12
+            f.write("#if 0\n")             # 13
+            f.write("#endif\n")            # 14
+            f.write("last\n")              # 15
+        calls = []
+        def evaluator( parser, expression ):
+            calls.append( expression )
+            return self.expression_evaluator( parser, expression )
+        self.DUT.if_evaluator = evaluator
+        self.DUT.open_file( fn )
+        result = list( self.DUT.iter_preprocessed( markers=True ) )
+        P = SimpleTextParser.PREPROCESSING_LINE
+        self.assertEqual( [ x.as_str() for x in result ],
+                          [ P, SimpleTextParser.IF_DISABLED, P, "enabled\n", P, P, P, "last\n" ] )
+        self.assertEqual( result[1].where.lineno, 2 )
+        self.assertEqual( result[1].where.end_lineno, 9 )
+        self.assertEqual( calls, [ '0', '0' ] )
+
+    def test_double_else(self):
+        fn = self.temp_filename("double-else.txt")
+        with open( fn, "wt" ) as f:
+            f.write("#if 1\n#else\n#else\n#endif\n")
+        self.DUT.unit_test_mode()
+        self.DUT.if_evaluator = self.expression_evaluator
+        self.DUT.open_file( fn )
+        with self.assertRaises( ParseError ):
+            list( self.DUT.iter_preprocessed() )
+
+    def _write_file( self, name, lines ):
+        fn = self.temp_filename( name )
+        with open( fn, "wt" ) as f:
+            for line in lines:
+                f.write( line + "\n" )
+        return fn
+
+    def _lines( self, filename ):
+        self.DUT.open_file( filename )
+        return [ x.as_str() for x in self.DUT.iter_preprocessed() ]
+
+    def test_pragma_once(self):
+        once = self._write_file( "once.txt", [ "#pragma once", "once-text" ] )
+        main = self._write_file( "once-main.txt", [ '#include "once.txt"' ] * 3 + [ "#pragma other", "end" ] )
+        self.assertEqual( self._lines( main ), [ "once-text\n", "#pragma other\n", "end\n" ] )
+        self.assertEqual( self.DUT.include_counts()[ once ], { 'included' : 1, 'skipped' : 2, 'replayed' : 0 } )
+        # It is once per root file, not once per parser.
+        self.assertEqual( self._lines( main ), [ "once-text\n", "#pragma other\n", "end\n" ] )
+        self.assertEqual( self.DUT.include_counts()[ once ]['skipped'], 4 )
+
+    def test_include_guard_and_replay(self):
+        guarded = self._write_file( "guarded.txt", [ "# a guarded file", "#if FLAG", "guarded-text", "#endif", "" ] )
+        plain = self._write_file( "plain.txt", [ "#if FLAG", "flag-on", "#else", "flag-off", "#endif", "plain-end" ] )
+        main = self._write_file( "guard-main.txt", [
+            '#include "guarded.txt"',
+            '#include "plain.txt"',
+            '#include "plain.txt"',
+            'FLIP',
+            '#include "guarded.txt"',
+            '#include "plain.txt"' ] )
+        expected = [ "# a guarded file\n", "guarded-text\n", "\n",
+                     "flag-on\n", "plain-end\n",
+                     "flag-on\n", "plain-end\n",
+                     "FLIP\n",
+                     "# a guarded file\n", "\n",
+                     "flag-off\n", "plain-end\n" ]
+        ev = self.DUT.use_builtin_evaluator( { 'FLAG' : '' } )
+        self.DUT.open_file( main )
+        lines = []
+        for txt in self.DUT.iter_preprocessed():
+            if txt == "FLIP\n":
+                ev.undef( 'FLAG' )
+            lines.append( txt.as_str() )
+        self.assertEqual( lines, expected )
+        counts = self.DUT.include_counts()
+        self.assertEqual( counts[ guarded ], { 'included' : 1, 'skipped' : 1, 'replayed' : 0 } )
+        # The 2nd include is replayed, the 3rd has a different symbol table.
+        self.assertEqual( counts[ plain ], { 'included' : 2, 'skipped' : 0, 'replayed' : 1 } )
+        # Another evaluator is only called for the #if statements read,
+        # files it decided anything in are not skipped or replayed.
+        self.DUT = SimpleTextParser()
+        flag = [ True ]
+        calls = []
+        def evaluator( parser, expression ):
+            calls.append( expression )
+            return flag[0]
+        self.DUT.if_evaluator = evaluator
+        self.DUT.open_file( main )
+        lines = []
+        for txt in self.DUT.iter_preprocessed():
+            if txt == "FLIP\n":
+                flag[0] = False
+            lines.append( txt.as_str() )
+        self.assertEqual( lines, expected )
+        self.assertEqual( calls, [ 'FLAG' ] * 5 )
+        counts = self.DUT.include_counts()
+        self.assertEqual( counts[ guarded ], { 'included' : 2, 'skipped' : 0, 'replayed' : 0 } )
+        self.assertEqual( counts[ plain ], { 'included' : 3, 'skipped' : 0, 'replayed' : 0 } )
+
+    def test_include_guard_markers(self):
+        '''
+        A skipped include returns the same lines (and markers) as reading it.
+        '''
+        def where( x ):
+            return ( x.as_str(), x.where.filename, x.where.lineno, getattr( x.where, 'end_lineno', None ) )
+        # The parser reports an #endif with text, that is not a guard.
+        self.assertIsNone( find_include_guard( "#if G\n#endif # the end\n" ) )
+        self.assertEqual( find_include_guard( "# guard\n#if G\n#endif\n" ), "G" )
+        for body in ( [ "#if defined(G)", "one", "#if 1", "two", "#endif", "#endif" ],
+                      [ "# before", "", "#if G", "#endif", "# after", "" ],
+                      [ "#if G", "x", "#endif" ] ):
+            inc = self._write_file( "guard-markers.txt", body )
+            main = self._write_file( "guard-markers-main.txt", [ '#include "guard-markers.txt"' ] * 2 )
+            self.DUT = SimpleTextParser()
+            self.DUT.use_builtin_evaluator()
+            self.DUT.open_file( main )
+            lines = [ where( x ) for x in self.DUT.iter_preprocessed( markers=True ) ]
+            self.assertEqual( self.DUT.include_counts()[ inc ], { 'included' : 1, 'skipped' : 1, 'replayed' : 0 } )
+            # Each include: the opening barrier, the file, the closing barrier.
+            half = len(lines) // 2
+            self.assertEqual( lines[ : half ], lines[ half : ] )
+            self.assertEqual( lines[0], ( SimpleTextParser.INCLUDE_BARRIER, inc, 0, None ) )
+
+    def _mixed( self, parser, filename, ops ):
+        '''
+        Read with next_preprocessed_line() ('p') and raw_next_line() ('r')
+        '''
+        parser.open_file( filename )
+        result = []
+        for op in ops:
+            try:
+                txt = parser.raw_next_line() if (op == 'r') else parser.next_preprocessed_line()
+            except ParseError as E:
+                # ie: a raw read of an "#if", then the "#endif" preprocessed.
+                result.append( ( 'error', E.where.filename, E.where.lineno ) )
+                break
+            result.append( ( txt.as_str(), txt.where.filename, txt.where.lineno ) )
+        return result
+
+    def _replay_parser( self, main, replay = True, cache_dir = None ):
+        parser = SimpleTextParser()
+        parser.unit_test_mode()
+        parser.use_builtin_evaluator()
+        parser.replay_includes = replay
+        if cache_dir is not None:
+            parser.enable_cache( cache_dir )
+        if replay:
+            # Once, so that the include files are known.
+            parser.open_file( main )
+            list( parser.iter_preprocessed() )
+        return parser
+
+    def test_raw_read_during_replay(self):
+        '''
+        Raw lines read while lines are replayed come from the file, the same as without replay.
+        '''
+        self._write_file( "rr-inc.txt", [ "one", "#if 1", "two", "#endif", "three" ] )
+        self._write_file( "rr-inner.txt", [ "i1", "#if 1", "i3", "#endif" ] )
+        self._write_file( "rr-outer.txt", [ "o1", '#include "rr-inner.txt"', "o3" ] )
+        self._write_file( "rr-once.txt", [ "#pragma once", "once-2" ] )
+        self._write_file( "rr-a.txt", [ "a1", '#include "rr-once.txt"', "a3", '#include "rr-once.txt"' ] )
+        cases = [
+            self._write_file( "rr-main.txt", [ '#include "rr-inc.txt"' ] * 2 ),
+            self._write_file( "rr-nested.txt", [ '#include "rr-outer.txt"' ] * 2 ),
+            # The 2nd open replays rr-a.txt, which marks rr-once.txt
+            self._write_file( "rr-marks.txt", [ '#include "rr-a.txt"', '#include "rr-once.txt"' ] ) ]
+        for main in cases:
+            for k in range( 0, 16 ):
+                ops = 'p' * k + 'rr' + 'p' * 16
+                parser = self._replay_parser( main )
+                result = self._mixed( parser, main, ops )
+                self.assertEqual( result, self._mixed( self._replay_parser( main, False ), main, ops ) )
+            counts = parser.include_counts()
+            self.assertTrue( sum( x['replayed'] for x in counts.values() ) > 0 )
+
+    def test_raw_read_cache_hit(self):
+        main = self._write_file( "rr-cache.txt", [ "#define X 1", "#if X", "yes", "#endif", "#undef X", "last" ] )
+        cache_dir = self.temp_filename( "rr-cache-dir" )
+        shutil.rmtree( cache_dir, ignore_errors=True )
+        # Fill the cache.
+        self._replay_parser( main, cache_dir=cache_dir )
+        for k in range( 0, 8 ):
+            ops = 'p' * k + 'rr' + 'p' * 8
+            parser = self._replay_parser( main, False, cache_dir )
+            expected = self._replay_parser( main, False )
+            self.assertEqual( self._mixed( parser, main, ops ), self._mixed( expected, main, ops ) )
+            self.assertEqual( parser.if_evaluator.symbols, expected.if_evaluator.symbols )
+        parser.open_file( main )
+        self.assertTrue( parser.cache_hit )
+
+    def test_replay_keeps_where(self):
+        inc = self._write_file( "replay-inc.txt", [ "one", "two" ] )
+        main = self._write_file( "replay-main.txt", [ '#include "replay-inc.txt"', '#include "replay-inc.txt"' ] )
+        self.DUT.open_file( main )
+        result = list( self.DUT.iter_preprocessed( markers=True ) )
+        self.assertEqual( [ ( x.as_str(), x.where ) for x in result[0:4] ], [ ( x.as_str(), x.where ) for x in result[4:8] ] )
+        self.assertEqual( result[6].where.filename, inc )
+        self.assertEqual( result[6].where.lineno, 2 )
+        self.assertEqual( self.DUT.include_counts()[ inc ]['replayed'], 1 )
+
+    def test_dependencies(self):
+        idir = self.temp_filename("dep-inc")
+        os.makedirs( idir, exist_ok=True )
+        inc = os.path.join( idir, "dep inc.txt" )
+        with open( inc, "wt" ) as f:
+            f.write("included\n")
+        main = self._write_file( "dep-main.txt", [ '#include "dep inc.txt"', "main" ] )
+        self.DUT.add_include_path( idir )
+        self.assertEqual( len( self._lines( main ) ), 2 )
+        depfile = self.temp_filename( "dep-main.d" )
+        self.DUT.write_depfile( depfile, [ "out.mak" ] )
+        with open( depfile, "rt" ) as f:
+            text = f.read()
+        self.assertEqual( text, "out.mak: \\\n %s \\\n %s\n\n%s:\n" %
+                          ( main, inc.replace(' ','\\ '), inc.replace(' ','\\ ') ) )
+        manifest = self.temp_filename( "dep-main.json" )
+        self.DUT.write_manifest( manifest )
+        self.assertTrue( manifest_is_current( manifest ) )
+        self.assertFalse( manifest_is_current( manifest, fingerprint="different" ) )
+        # A file appearing earlier in the search path changes the answer.
+        probed = os.path.join( os.path.dirname( main ), "dep inc.txt" )
+        with open( probed, "wt" ) as f:
+            f.write("shadow\n")
+        self.assertFalse( manifest_is_current( manifest ) )
+        os.remove( probed )
+        self.assertTrue( manifest_is_current( manifest ) )
+        # So does a change to an input.
+        with open( inc, "at" ) as f:
+            f.write("more\n")
+        self.assertFalse( manifest_is_current( manifest ) )
+
+    def test_if_expressions(self):
+        ev = IfEvaluator( { 'ONE' : '1', 'HEX' : '0x10', 'EMPTY' : '', 'EXPR' : 'ONE + HEX' } )
+        cases = [
+            ( "1", 1 ), ( "0", 0 ), ( "true", 1 ), ( "false", 0 ),
+            ( "defined(ONE)", 1 ), ( "defined NOPE", 0 ), ( "!defined(NOPE)", 1 ),
+            ( "NOPE", 0 ), ( "EMPTY", 1 ), ( "HEX", 16 ), ( "EXPR", 17 ), ( "010", 8 ),
+            ( "1 + 2 * 3", 7 ), ( "(1 + 2) * 3", 9 ), ( "-7 / 2", -3 ), ( "-7 % 2", -1 ),
+            ( "1 << 4 | 1", 17 ), ( "6 & 3 ^ 1", 3 ), ( "~0", -1 ),
+            ( "ONE == 1 && HEX > 10", 1 ), ( "ONE != 1 || HEX <= 10", 0 ),
+            ( "(2 || 0) + 1", 2 ), ( "ONE ? HEX : 5", 16 ), ( "0 ? 1 : 0 ? 2 : 3", 3 ),
+            ( "10UL >= 10", 1 )
+        ]
+        for text, value in cases:
+            self.assertEqual( ev.evaluate( text ), value, text )
+        for text in ( "", "1 +", "(1", "1 2", "defined(1)", "1 / 0", "'a'" ):
+            with self.assertRaises( IfExprError, msg=text ):
+                ev.evaluate( text )
+        # Compiled once, evaluated once per symbol table version.
+        ev = IfEvaluator()
+        ev( None, "defined(A) && B > 2" )
+        ev( None, "defined(A) && B > 2" )
+        self.assertEqual( ( ev.compiles, ev.evaluations, ev.memo_hits ), ( 1, 1, 1 ) )
+        ev.define( "A" )
+        ev.define( "B", "3" )
+        self.assertTrue( ev( None, "defined(A) && B > 2" ) )
+        self.assertEqual( ( ev.compiles, ev.evaluations ), ( 1, 2 ) )
+        ev.undef( "A" )
+        self.assertFalse( ev( None, "defined(A) && B > 2" ) )
+        ev.define( "LOOP", "LOOP + 1" )
+        with self.assertRaises( IfExprError ):
+            ev.evaluate( "LOOP" )
+
+    def test_define_undef(self):
+        inc = self._write_file( "define-inc.txt", [
+            "#if !defined(DEFINE_INC)",
+            "#define DEFINE_INC",
+            "#define LEVEL LEVEL_BASE + 1",
+            "inc-text",
+            "#endif" ] )
+        main = self._write_file( "define-main.txt", [
+            "#define LEVEL_BASE 2",
+            '#include "define-inc.txt"',
+            '#include "define-inc.txt"',
+            "#if LEVEL == 3",
+            "level-3",
+            "#endif",
+            "#undef LEVEL",
+            "#if LEVEL",
+            "not-here",
+            "#elif !defined LEVEL",
+            "undefined",
+            "#endif" ] )
+        ev = self.DUT.use_builtin_evaluator()
+        self.assertEqual( self._lines( main ), [ "inc-text\n", "level-3\n", "undefined\n" ] )
+        # The guard skipped the 2nd include.
+        self.assertEqual( self.DUT.include_counts()[ inc ]['skipped'], 1 )
+        self.assertEqual( ev.symbols, { 'LEVEL_BASE' : '2', 'DEFINE_INC' : '' } )
+        # Without the built in evaluator, the lines are returned as is.
+        self.DUT = SimpleTextParser()
+        self.DUT.unit_test_mode()
+        plain = self._write_file( "define-plain.txt", [ "#define X 1", "text" ] )
+        self.assertEqual( self._lines( plain ), [ "#define X 1\n", "text\n" ] )
+        # Bad syntax
+        bad = self._write_file( "define-bad.txt", [ "#define 1X" ] )
+        self.DUT.use_builtin_evaluator()
+        with self.assertRaises( ParseError ):
+            self._lines( bad )
+
+    def test_define_cache(self):
+        inc = self._write_file( "dcache-inc.txt", [ "#define FROM_INC 5", "inc" ] )
+        main = self._write_file( "dcache-main.txt", [ '#include "dcache-inc.txt"', "#if FROM_INC == 5", "yes", "#endif" ] )
+        cache_dir = self.temp_filename( "dcache-dir" )
+        shutil.rmtree( cache_dir, ignore_errors=True )
+        for hit in ( False, True ):
+            self.DUT = SimpleTextParser()
+            self.DUT.enable_cache( cache_dir )
+            ev = self.DUT.use_builtin_evaluator( { 'START' : '1' } )
+            self.assertEqual( self._lines( main ), [ "inc\n", "yes\n" ] )
+            self.assertEqual( self.DUT.cache_hit, hit )
+            # On a hit the #define is re-applied.
+            self.assertEqual( ev.symbols, { 'START' : '1', 'FROM_INC' : '5' } )
+        # Different starting symbols, a different cache entry.
+        self.DUT = SimpleTextParser()
+        self.DUT.enable_cache( cache_dir )
+        self.DUT.use_builtin_evaluator( { 'START' : '2' } )
+        self.DUT.open_file( main )
+        self.assertFalse( self.DUT.cache_hit )
+
+    def test_prefetch(self):
+        names = [ "prefetch-%d.txt" % x for x in range(0,5) ]
+        for name in names:
+            self._write_file( name, [ "text of %s" % name, '#include "prefetch-shared.txt"' ] )
+        self._write_file( "prefetch-shared.txt", [ "#pragma once", "shared" ] )
+        main = self._write_file( "prefetch-main.txt", [ '#include "%s"' % x for x in names ] + [ "#if 0", '#include "prefetch-none.txt"', "#endif" ] )
+        self.DUT.use_builtin_evaluator()
+        expected = self._lines( main )
+        self.DUT = SimpleTextParser()
+        self.DUT.unit_test_mode()
+        self.DUT.use_builtin_evaluator()
+        self.DUT.enable_prefetch( workers=2 )
+        self.assertEqual( self._lines( main ), expected )
+        stats = self.DUT.prefetch_stats()
+        self.assertEqual( stats['hits'], 6 )
+        self.assertEqual( stats['misses'], 0 )
+        # A missing file is never requested, it cannot be resolved.
+        self.assertEqual( stats['requested'], 6 )
+        self.assertEqual( stats['errors'], 0 )
+        # Nothing fits in the budget, the parser reads the files itself.
+        self.DUT = SimpleTextParser()
+        self.DUT.unit_test_mode()
+        self.DUT.use_builtin_evaluator()
+        self.DUT.enable_prefetch( workers=1, byte_budget=1 )
+        self.assertEqual( self._lines( main ), expected )
+        self.assertEqual( self.DUT.prefetch_stats()['hits'], 0 )
+        self.DUT.disable_prefetch()
+        self.assertEqual( self.DUT.prefetch_stats(), {} )
+
+    def test_flattened(self):
+        self._write_file( "flat-inc.txt", [ "inc-1", "inc-2" ] )
+        main = self._write_file( "flat-main.txt", [ "main-1", '#include "flat-inc.txt"', "#if 0", "off", "#endif", "main-6",
+                                                    '#line 3 "fake.txt"', "#line#7" ] )
+        self.DUT.use_builtin_evaluator()
+        def where( x ):
+            return ( x.as_str(), x.where.filename, x.where.lineno, getattr( x.where, 'end_lineno', None ) )
+        for markers in ( False, True ):
+            self.DUT.open_file( main )
+            expected = [ where( x ) for x in self.DUT.iter_preprocessed( markers ) ]
+            out = self.temp_filename( "flat-out.txt" )
+            self.DUT.open_file( main )
+            self.DUT.write_flattened( out, markers=markers, relative_to=os.path.dirname( main ) )
+            with open( out, "rt" ) as f:
+                text = f.read()
+            result = [ where( x ) for x in read_flattened( out, relative_to=os.path.dirname( main ) ) ]
+            # The round trip is lossless, with or without markers.
+            self.assertEqual( result, expected )
+            if not markers:
+                self.assertEqual( text, '#line 1 "flat-main.txt"\nmain-1\n#line 1 "flat-inc.txt"\ninc-1\ninc-2\n'
+                                        '#line 6 "flat-main.txt"\nmain-6\n#line##line 3 "fake.txt"\n#line##line#7\n' )
+            else:
+                self.assertIn( '#line 4-4 "flat-main.txt"\n%s' % SimpleTextParser.IF_DISABLED, text )
+                self.assertIn( ( SimpleTextParser.IF_DISABLED, main, 4, 4 ), result )
+
+    def test_source_snippet(self):
+        inc = self._write_file( "snippet-inc.txt", [ "one", "two", "#if 1", "#else", "#else", "six", "seven" ] )
+        main = self._write_file( "snippet-main.txt", [ "main-1", '#include "snippet-inc.txt"' ] )
+        self.DUT.unit_test_mode()
+        self.DUT.use_builtin_evaluator()
+        self.DUT.open_file( main )
+        with self.assertRaises( ParseError ) as context:
+            list( self.DUT.iter_preprocessed() )
+        self.assertEqual( context.exception.where.lineno, 5 )
+        self.assertEqual( context.exception.snippet, [ "      3 | #if 1",
+                                                       "      4 | #else",
+                                                       ">     5 | #else",
+                                                       "      6 | six",
+                                                       "      7 | seven" ] )
+        # The error is in the include file, both files are open.
+        self.assertEqual( sorted( self.DUT._sources.keys() ), sorted( [ main, inc ] ) )
+        # Files that were popped are read again, and ranges are marked.
+        main = self._write_file( "snippet-main2.txt", [ '#include "snippet-main.txt"', "#if 0", "a", "b", "#endif" ] )
+        self.DUT = SimpleTextParser()
+        self.DUT.use_builtin_evaluator()
+        self._write_file( "snippet-main.txt", [ "main-1" ] )
+        self.DUT.open_file( main )
+        lines = list( self.DUT.iter_preprocessed( markers=True ) )
+        # Only the files on the include stack are kept.
+        self.assertEqual( self.DUT._sources, {} )
+        disabled = [ x for x in lines if x == SimpleTextParser.IF_DISABLED ][0]
+        self.assertEqual( self.DUT.source_snippet( disabled.where, context=0 ), [ ">     3 | a", ">     4 | b" ] )
+        self.assertEqual( self.DUT.source_snippet( lines[1].where, context=1 ), [ ">     1 | main-1" ] )
+        self.assertEqual( self.DUT.source_text( inc ).line_text( 6 ), "six" )
+
+    def test_line_view(self):
+        main = self._write_file( "view-main.txt", [ "first", "  key: value" ] )
+        self.DUT.open_file( main )
+        lines = [ self.DUT.next_preprocessed_line() for x in range( 0, 2 ) ]
+        # The file is open, the view refers to its buffer.
+        view = self.DUT.line_view( lines[1] )
+        self.assertIs( view.buffer, self.DUT.source_text( main ) )
+        value = view.partition(':')[2].strip()
+        self.assertEqual( value, "value" )
+        self.assertEqual( ( value.where.filename, value.where.lineno, value.where.column ), ( main, 2, 8 ) )
+        # Closed, the buffer is gone but the where is the same.
+        self.assertEqual( self.DUT.next_preprocessed_line(), '' )
+        self.assertNotIn( main, self.DUT._sources )
+        value = self.DUT.line_view( lines[1] ).partition(':')[2].strip()
+        self.assertEqual( ( value.where.filename, value.where.lineno, value.where.column ), ( main, 2, 8 ) )
+        # Not from a source buffer, the view covers the text itself.
+        view = self.DUT.line_view( WhereStr( "a b", fn=main, ln=7 ) )
+        self.assertEqual( view.split()[1].where.column, 3 )
+
+    def test_benchmark_harness(self):
+        '''
+        Run the benchmark harness on tiny inputs, so it does not rot.
+        '''
+        from pmake.text_parser import bench_text_parser
+        results = bench_text_parser.run_all( scale=0.0001, repeat=1, directory=self.temp_filename("bench") )
+        self.assertIn( 'tree.preprocessed', results['results'] )
+        tree = results['results']['tree.preprocessed']
+        self.assertTrue( tree['open'] >= 11 )
+        self.assertTrue( tree['peak_bytes'] > 0 )
+        self.assertEqual( bench_text_parser.compare( results, results, 0.1 ), 0 )
+
     def create_if_error(self):
         self.expected = []
         fn = self.temp_filename("if-error.txt")
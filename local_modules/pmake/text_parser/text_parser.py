@@ -5,16 +5,30 @@ This is a basic text Preprocessor much like the CPP preprocessor.
  - Blank lines are ignored.
  - Basic support for #incude "FILENAME" is provided.
  - Basic support for #if/#else/#elif/#endif is supported.
+ - #define NAME [VALUE] and #undef NAME, when the built in evaluator is used.
+ - "#pragma once" is supported, and the include guard idiom is detected
+   (the entire file inside one #if/#endif), with the built in evaluator
+   such files are not read again when the guard is false. Include files
+   that produced the same lines before are replayed from memory, see
+   include_counts(). Either way the lines are the same as reading the file.
 
 Because this class is abstract you must provide a few functions.
 They are:
   - evaluate_if_statement, this gets the text after the "#if" 
     This must return True or False, 
     if this is not provided the #if/#else etc is ignored
+    Or use the built in evaluator, see use_builtin_evaluator() and if_expr.py
   - Other features to be deteremined at some later date
   
 You can provide
   - an include path list.
+  - a cache directory, see enable_cache(), the preprocessed output
+    is saved there and replayed if none of the input files changed.
+  - include file prefetching, see enable_prefetch(), include files
+    are read by worker threads before the parser reaches them.
+
+The preprocessed output can be written as one flat file, like "cpp -E"
+see write_flattened() and flatten.py
 
 The parser is a pull parser.
     Step 1 - you open the file.
@@ -54,6 +68,13 @@ Examples: Setup:
     # Support #if statements.
     stp.provide_evaluate_function(  my_evaluator )
 
+Example as an iterator, markers (INCLUDE_BARRIER etc) are not returned:
+    stp.open_file( "somefile" )
+    for text in stp.iter_preprocessed():
+        print("%s: %s" % (str(text.where), text))
+
+    Or in batches of 1000 lines: stp.iter_chunks( 1000 )
+
 Example in PULL mode:
     stp.pull_open_file( "somefile" )
     while True:
@@ -69,21 +90,40 @@ Example in PULL mode:
 '''
 import os
 import re
+from collections import deque
 from pmake.logger import LogHelper
-from pmake.where import Where
-from pmake.where_str import WhereStr
+from pmake.where import Where, WhereRange, file_table
+from pmake.where_str import WhereStr, WhereStrView
+from pmake.text_parser.line_source import LineSource
+from pmake.text_parser.preprocess_cache import PreprocessCache, CacheRecorder
+from pmake.text_parser.include_resolver import IncludeResolver
+from pmake.text_parser.depends import DependencyTracker
+from pmake.text_parser.if_expr import IfEvaluator, IfExprError
+from pmake.text_parser.prefetch import IncludePrefetcher
+from pmake.text_parser import flatten
 from typing import List
 import typing
 
+# The fast constructor, used for every line.
+_where_str = WhereStr.fast
+
 _kw_flow_control = ('if','else','endif','elif')
-re_keyword = re.compile('^[#](?P<keyword>(include|if|else|endif|elif))(?P<expression>.*)$')
+re_keyword = re.compile('^[#](?P<keyword>(include|if|else|endif|elif|pragma|define|undef))(?P<expression>.*)$')
+# The same, but used to search an entire file buffer.
+re_keyword_multiline = re.compile( re_keyword.pattern, re.MULTILINE )
+# Used to find the #include statements in a file buffer, see _prefetch_includes()
+re_include_multiline = re.compile( r'^[#]include(?P<expression>.*)$', re.MULTILINE )
+# The expression part of #define NAME [VALUE] and #undef NAME
+re_define = re.compile(r'^\s+(?P<name>[A-Za-z_][A-Za-z0-9_]*)(\s+(?P<value>.*?))?\s*$')
 
 __ALL__ = ['ParseError', 'SimpleTextParser']
 
 class ParseError( Exception ):
-    def __init__(self, where : Where, msg : str ):
+    def __init__(self, where : Where, msg : str, snippet : typing.Optional[List[str]] = None ):
         Exception.__init__( self, msg )
         self.where = where.clone()
+        # The source lines around the error, see SimpleTextParser.source_snippet()
+        self.snippet : List[str] = snippet or []
 
 class IfEntry( ):
     '''
@@ -94,6 +134,15 @@ class IfEntry( ):
         self.where : Where = parser.where.clone()
         self.state : bool = state  #true or false
         self.in_else : bool = False # We begin life in the #If side of the #else
+        # True once any #if/#elif branch was true, later branches are disabled.
+        self.taken : bool = state
+
+    def handle_elif( self, state : bool ):
+        '''
+        The parser has discovered an #elif statement, state is the expression result.
+        '''
+        self.state = state and not self.taken
+        self.taken = self.taken or state
 
     def handle_else( self ):
         '''
@@ -102,41 +151,166 @@ class IfEntry( ):
         if self.in_else:
             self.parser.syntax_error("already in #else state\n")
         # flip to the else side
-        self._in_else = True
-        # and invert the state
-        self.state = not self.state
+        self.in_else = True
+        # enabled only if no #if/#elif branch was taken.
+        self.state = not self.taken
+        self.taken = True
     
+def _only_comments( text : str ) -> bool:
+    '''
+    True if the text is nothing but blank lines and comments.
+    '''
+    for line in text.split('\n'):
+        line = line.strip()
+        if len(line) and (line[0] != '#'):
+            return False
+    return True
+
+def find_include_guard( text : str ) -> typing.Optional[str]:
+    '''
+    Look for the include guard idiom, ie: the entire file is wrapped like this:
+
+        # comments are ok here
+        #if EXPRESSION
+            .... anything, including nested #if/#endif
+        #endif
+        # and comments are ok here
+
+    If found, return the EXPRESSION, otherwise None.
+    When the EXPRESSION is false the file produces only the comments and
+    markers, so the include can be skipped without reading the file.
+    '''
+    guard = _find_guard( text )
+    return None if (guard is None) else guard[0]
+
+def _find_guard( text : str ) -> typing.Optional[tuple]:
+    '''
+    See find_include_guard(), returns ( EXPRESSION, offset of the #if, offset of the #endif )
+    '''
+    matches = re_keyword_multiline.finditer( text )
+    first = next( matches, None )
+    if (first is None) or (first['keyword'] != 'if'):
+        return None
+    if not _only_comments( text[ : first.start() ] ):
+        return None
+    depth = 0
+    last = None
+    for m in matches:
+        kw = m['keyword']
+        if kw == 'if':
+            depth = depth + 1
+        elif kw == 'endif':
+            if depth == 0:
+                last = m
+                break
+            depth = depth - 1
+        elif (kw in ('else','elif')) and (depth == 0):
+            # That is not a guard.
+            return None
+    if (last is None) or len( last['expression'].strip() ):
+        # No #endif, or one the parser would report as an error.
+        return None
+    # Nothing may follow the #endif
+    if next( matches, None ) is not None:
+        return None
+    if not _only_comments( text[ last.end() : ] ):
+        return None
+    return ( first['expression'].strip(), first.start(), last.start() )
+
+class IncludeInfo():
+    '''
+    What we know about an include file, kept for the life of the parser.
+    '''
+    def __init__( self, filename : str ):
+        self.filename = filename
+        # How many times the file was read, skipped or replayed from memory.
+        self.included = 0
+        self.skipped = 0
+        self.replayed = 0
+        # The include guard expression, see find_include_guard()
+        # And the lines (comments and markers) the file produces when it is false.
+        self.guard : typing.Optional[str] = None
+        self.guard_stream : typing.Optional[List[WhereStr]] = None
+        self.guard_checked = False
+        # The preprocessed lines the file produced the first time.
+        # And the events (#if results, #pragma once state) that decided those lines.
+        # Files that #define or #undef something are not saved, replaying them would
+        # not change the symbol table.
+        self.stream : typing.Optional[List[WhereStr]] = None
+        self.events : List[tuple] = []
+        # The built in evaluator, and its symbol table version, when the stream was saved.
+        self.evaluator : typing.Optional[IfEvaluator] = None
+        self.version : typing.Optional[int] = None
+        # (path, size, mtime_ns) when it was read.
+        self.signature : typing.Optional[tuple] = None
+
+    def counts( self ) -> dict:
+        return { 'included' : self.included, 'skipped' : self.skipped, 'replayed' : self.replayed }
+
 class IncludeEntry():
     '''
     We is a stack/list to manage include files, this is an entry in that stack
     '''
-    def __init__( self, parent : "SimpleTextParser", filename : str, where: Where ):
+    def __init__( self, parent : "SimpleTextParser", filename : str, where: Where, source : LineSource = None,
+                  identity : typing.Optional[str] = None ):
         self.parent : "SimpleTextParser" = parent
+        # filename is what the lines' where report, identity (the absolute name) is the file.
+        self.filename : str = filename
+        self.identity : str = identity or os.path.abspath( filename )
+        # Used to capture the lines this file produces, see SimpleTextParser._include_done()
+        self.log_start = len(parent._include_log)
+        self.event_start = len(parent._event_log)
+        self.raw_reads = parent._raw_reads
+        self.if_depth = len(parent._if_stack)
+        evaluator = parent._builtin_evaluator()
+        self.evaluator_version = None if (evaluator is None) else evaluator.version
         # Where did the #include statement begin.
-        self.previous_where : Where  = parent._where.clone()
-        self.parent._where.lineno = 0
-        if not os.path.isfile(filename):
-            self.parent.syntax_error("no such file: %s" % filename )
-        self.fp : typing.TextIO = open( filename, "rt" )
+        self.previous_where : Where  = parent._where
+        parent._where = Where( filename, 0 )
+        # The whole file is read in one shot, lines are sliced from the buffer.
+        # Or, it was already read by the prefetcher.
+        if source is None:
+            try:
+                source = LineSource.from_file( filename )
+            except OSError:
+                self.parent.syntax_error("no such file: %s" % filename )
+        self.source : LineSource = source
+        # Kept while the file is on the include stack, see source_text()
+        parent._sources[ filename ] = source
+        parent._add_input( self.source.signature() )
+        parent._prefetch_includes( self.source )
+
+    def next_text( self ) -> str:
+        '''
+        Read the next line from the file as a plain string.
+        The parser location is advanced, but no WhereStr() is created.
+        '''
+        # Where() is immutable, each line gets a new one.
+        where = self.parent._where
+        self.parent._where = Where.from_id( where[0], where[1] + 1 )
+        return self.source.next_line()
 
     def next_line( self ) -> WhereStr:
         '''
         Read the next line from the file
         '''
-        txt = self.fp.readline()
-        self.parent._where.lineno = self.parent._where.lineno + 1
-        # And we return the where location
-        return WhereStr( txt, where=self.parent._where.clone() )
+        txt = self.next_text()
+        # Where() is immutable, so it is shared, not cloned.
+        return _where_str( txt, self.parent._where )
     
     def pop( self ):
         '''
         Called when we pop the entry off the include stack.
         '''
         # Restore the parser to the previous location.
-        self.parent._where = self.previous_where.clone()
-        # clean up.
-        self.fp.close()
-        self.fp = None
+        self.parent._where = self.previous_where
+        # clean up, the text is dropped unless the file is still open (ie: it includes itself)
+        for ise in self.parent._include_stack:
+            if ise.filename == self.filename:
+                break
+        else:
+            self.parent._sources.pop( self.filename, None )
+        self.source = None
 
 
 class SimpleTextParser(  LogHelper ):
@@ -173,6 +347,9 @@ class SimpleTextParser(  LogHelper ):
 
         And - disabled lines (the false condition of an #if/#else/#elif/#endif)
         these disabled lines are returned as a comment (the line begins with a #)
+        A run of disabled lines is returned as a single SimpleTextParser.IF_DISABLED
+        whose "where" is a WhereRange() (lineno to end_lineno) covering the run.
+        Any #if statements nested inside a disabled block are not evaluated.
         
         The assumption is the client (the parser calling this) understands
         and can handle and ignore commets (Lines starting with "#")
@@ -183,6 +360,8 @@ class SimpleTextParser(  LogHelper ):
     PREPROCESSING_LINE = "#PREPROCESSING_LINE#\n"
     # Returned when an preprocessed line is disabled.
     IF_DISABLED = "#IF-0#\n"
+    # All of the above, the iterators can filter these out.
+    MARKERS = frozenset( (INCLUDE_BARRIER, PREPROCESSING_LINE, IF_DISABLED) )
     def __init__( self ):
         LogHelper.__init__(self)
         self._test_mode = False
@@ -195,21 +374,150 @@ class SimpleTextParser(  LogHelper ):
         # Note: The current directory of the current source file is always searched first.
         # Second, the current directory of the application is also searched.
         self._include_path_list: List[str] = []
+        # Resolves #include names using the list above, and remembers the answers.
+        self._include_resolver = IncludeResolver( self._include_path_list )
         # This is provided by the cilent, it evaluates an #if EXPRESSION
         self.if_evaluator: typing.Callable = None
+        # Per include file information: #include counts, include guards and saved output
+        self._include_info : typing.Dict[str, IncludeInfo] = {}
+        # Files that said "#pragma once" in the current root file.
+        self._pragma_once : set = set()
+        # Include files that have been fully processed are replayed from memory
+        # when included again under the same conditions. Set to False to disable.
+        self.replay_includes : bool = True
+        # While inside include files, the lines returned and the events.
+        self._include_log : List[WhereStr] = []
+        self._event_log : List[tuple] = []
+        # Lines waiting to be returned, ie: a replayed include file.
+        self._pending : deque = deque()
+        # What is in _pending: ( filename, identity, "#pragma once" files it marked, lines ), see _expand_replay()
+        self._replaying : typing.Optional[tuple] = None
+        # Counts calls to raw_next_line(), raw reads cannot be replayed.
+        self._raw_reads = 0
+        # Every file read, or probed, for the current root file.
+        self._dependencies = DependencyTracker()
         # Where are we at in the parser at this point in time.
         self._where = Where( "Unknown", 0 )
         # Set to True at end of Include Files
         self._include_at_eof = False
+        # The optional on-disk cache of the preprocessed output, see enable_cache()
+        self._cache : PreprocessCache = None
+        self.cache_fingerprint : str = ''
+        # When filling the cache, this records the lines we return.
+        self._recorder : CacheRecorder = None
+        # On a cache hit, this is the iterator over the saved lines.
+        self._replay : typing.Iterator = None
+        # And the file ids of the files in that entry.
+        self._replay_files : List[int] = []
+        # And the lines returned, the root file and the symbols before the hit, see _expand_replay()
+        self._replay_count = 0
+        self._replay_root : str = None
+        self._replay_symbols : typing.Optional[dict] = None
+        # The files on the include stack, see source_text()
+        self._sources : typing.Dict[str, LineSource] = {}
+        # Reads include files ahead of time, see enable_prefetch()
+        self._prefetcher : IncludePrefetcher = None
 
     def unit_test_mode(self):
         self._test_mode = True
 
+    def enable_cache( self, directory : str, fingerprint : str = '' ):
+        '''
+        Keep the preprocessed output of each root file in this cache directory.
+
+        The fingerprint must describe everything the if_evaluator looks at
+        (for example the variables used in #if expressions). If the fingerprint
+        or any file that was read changes, the file is parsed again.
+
+        Must be called before open_file()
+        '''
+        self._cache = PreprocessCache( directory )
+        self.cache_fingerprint = fingerprint
+
+    def enable_prefetch( self, workers : int = 4, byte_budget : int = 32 * 1024 * 1024 ):
+        '''
+        Read #include files on "workers" threads, before the parser needs them.
+        At most "byte_budget" bytes of loaded files are kept waiting.
+        '''
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown()
+        self._prefetcher = IncludePrefetcher( workers, byte_budget )
+
+    def disable_prefetch( self ):
+        '''
+        Stop prefetching, and stop the worker threads.
+        '''
+        if self._prefetcher is not None:
+            self._prefetcher.shutdown()
+            self._prefetcher = None
+
+    def prefetch_stats( self ) -> dict:
+        '''
+        Return the prefetch counters (requested, hits, misses, dropped, errors)
+        '''
+        if self._prefetcher is None:
+            return {}
+        return self._prefetcher.stats()
+
+    def _prefetch_includes( self, source : LineSource ):
+        '''
+        A file was opened, start loading the files it includes.
+        '''
+        if self._prefetcher is None:
+            return
+        cwd = os.path.dirname( source.filename )
+        for m in re_include_multiline.finditer( source.text ):
+            name = m['expression'].strip()
+            # Bad names are reported when the #include is reached.
+            if (len(name) < 3) or (name[0] not in '"\'<') or (name[-1] != ('>' if name[0] == '<' else name[0])):
+                continue
+            found, identity, tried = self._include_resolver.resolve( cwd, name[1:-1] )
+            if found is None:
+                continue
+            info = self._include_info.get( identity )
+            if (info is not None) and info.guard_checked:
+                # Read before, most likely it will be skipped or replayed.
+                continue
+            self._prefetcher.request( found )
+
+    @property
+    def cache_hit( self ) -> bool:
+        '''
+        True if the current file is being replayed from the cache.
+        '''
+        return self._replay is not None
+
+    def use_builtin_evaluator( self, defines : typing.Optional[dict] = None ) -> IfEvaluator:
+        '''
+        Use the built in #if evaluator (see if_expr.py), this also
+        enables #define and #undef. The optional dict is the initial
+        symbol table, ie: { 'DEBUG' : '', 'LEVEL' : '3' }
+        Returns the evaluator.
+        '''
+        self.if_evaluator = IfEvaluator( defines )
+        return self.if_evaluator
+
     def add_include_path( self, path : str ):
         '''
         Adds an "include" directory, much like a C Compiler "-I" command line flag.
         '''
         self._include_path_list.append( path )
+        # Earlier answers may now be wrong.
+        self._include_resolver.clear()
+
+    def index_include_paths( self ):
+        '''
+        Read the directory listing of each include path once, so
+        that searching for #include files needs fewer stat() calls.
+        Call this after all include paths have been added.
+        '''
+        self._include_resolver.index_directories()
+
+    def include_stats( self ) -> dict:
+        '''
+        Return the include file lookup counters (lookups, cache hits, stat calls, etc)
+        '''
+        return self._include_resolver.stats()
 
     @property
     def where( self ) -> Where:
@@ -228,22 +536,70 @@ class SimpleTextParser(  LogHelper ):
         
         We Print/Dump the include stack and the error message.
         '''
+        snippet = self.source_snippet( self._where )
         if self._test_mode:
-            raise ParseError( self._where, msg )
+            raise ParseError( self._where, msg, snippet )
 
         # We do not test the error dump when we have a syntax error.
-        if len(self._include_stack) == 1:
+        for line in snippet:
+            self.log_print( line )
+        if len(self._include_stack) <= 1:
             # We are not in an include file
             self.fatal("%s FATAL ERROR: %s" % ( str(self.where), msg ) )
         
         # Unwind the include stack       
 
-        for idx in range( 1, len(self.include_stack) ):
+        for idx in range( 1, len(self._include_stack) ):
             ife = self._include_stack[ idx ]
-            self.log_print("%s (included from) depth: %d" % (str(ife.prevous_where),idx ))
+            self.log_print("%s (included from) depth: %d" % (str(ife.previous_where),idx ))
         # Then die.
         self.fatal("%s, FATAL ERROR: %s" % (str(self._where), msg) )
 
+    def source_text( self, filename : str ) -> typing.Optional[LineSource]:
+        '''
+        Return the LineSource for a file.
+        Only the files on the include stack are kept, other files (ie: closed
+        include files, or on a cache hit) are read again, and not kept.
+        Returns None if the file cannot be read.
+        '''
+        source = self._sources.get( filename )
+        if source is None:
+            try:
+                source = LineSource.from_file( filename )
+            except OSError:
+                return None
+        return source
+
+    def line_view( self, text : WhereStr ) -> WhereStrView:
+        '''
+        Return a WhereStrView of a line returned by the parser, it refers to
+        the source file buffer so slices and tokens know their line and column.
+        If the line is not in a source buffer (ie: a marker, or the file was
+        closed) the view covers the text itself, the where is the same.
+        '''
+        where = text.where
+        source = self._sources.get( where.filename )
+        if (source is not None) and (1 <= where.lineno <= source.nlines):
+            start = source.offsets[ where.lineno - 1 ]
+            end = source.offsets[ where.lineno ]
+            if ((end - start) == len(text)) and source.text.startswith( text, start ):
+                return WhereStrView( source, start, end )
+        return WhereStrView.from_where_str( text )
+
+    def source_snippet( self, where : Where, context : int = 2 ) -> List[str]:
+        '''
+        Return the source line(s) at "where" plus "context" lines before and
+        after, formatted for an error message. See LineSource.snippet()
+        An empty list is returned if the text is not available.
+        '''
+        source = self.source_text( where.filename )
+        if (source is None) or (where.lineno < 1) or (where.lineno > source.nlines):
+            return []
+        end_lineno = getattr( where, 'end_lineno', None )
+        if end_lineno is not None:
+            end_lineno = min( end_lineno, source.nlines )
+        return source.snippet( where.lineno, context, end_lineno )
+
     def raw_next_line( self ) -> WhereStr:
         ''' 
         Reads the next raw line of text from the input stream
@@ -253,15 +609,87 @@ class SimpleTextParser(  LogHelper ):
 
         Generally, with the exception of include file boundaries
         it acts like the standard function: readline()
-        '''
-        # get top of include stack.
-        ise = self._include_stack[-1]
-        # is the current file at the EOF?
 
+        If lines are being replayed (a cache hit, or an include file from
+        memory) the file is opened and the raw lines come from it.
+        '''
+        # Raw lines are not part of the preprocessed stream, this root file is not cached.
+        self._recorder = None
+        while (self._replay is not None) or self._pending:
+            # Replayed lines are preprocessed, read the file itself.
+            self._expand_replay()
+        # After the above: the files still open (being read raw) are not saved for replay,
+        # the ones it read completely can be, see _include_done()
+        self._raw_reads = self._raw_reads + 1
         # case 0: RULE:  EOF returns ''
         # case 1: RULE:  non-eof (blank lines) return '\n'
         # case 2: RULE:  non-blank lines return: 'text\n'
-        return ise.next_line()
+        if len(self._include_stack) == 0:
+            return _where_str( '', self._where )
+        return self._include_stack[-1].next_line()
+
+    def iter_raw( self ) -> typing.Iterator[WhereStr]:
+        '''
+        Generator version of raw_next_line(), it stops at the end of
+        the current file (where raw_next_line() would return '')
+        '''
+        next_line = self.raw_next_line
+        while True:
+            text = next_line()
+            if len(text) == 0:
+                return
+            yield text
+
+    def iter_preprocessed( self, markers : bool = False ) -> typing.Iterator[WhereStr]:
+        '''
+        Generator version of next_preprocessed_line(), it stops at the end of the root file.
+        Set markers=True to also get the INCLUDE_BARRIER, PREPROCESSING_LINE
+        and IF_DISABLED lines, by default they are dropped.
+        '''
+        next_line = self.next_preprocessed_line
+        if markers:
+            while True:
+                text = next_line()
+                if len(text) == 0:
+                    return
+                yield text
+        skip = SimpleTextParser.MARKERS
+        while True:
+            text = next_line()
+            if len(text) == 0:
+                return
+            if text in skip:
+                continue
+            yield text
+
+    def iter_chunks( self, size : int, markers : bool = False, raw : bool = False ) -> typing.Iterator[List[WhereStr]]:
+        '''
+        Like iter_preprocessed() (or iter_raw() if raw=True) but lines
+        are returned in lists of "size" lines, the last list may be shorter.
+        '''
+        if size < 1:
+            raise ValueError("chunk size must be >= 1, not: %d" % size)
+        if raw:
+            next_line = self.raw_next_line
+            skip = ()
+        else:
+            next_line = self.next_preprocessed_line
+            skip = () if markers else SimpleTextParser.MARKERS
+        chunk = []
+        append = chunk.append
+        while True:
+            text = next_line()
+            if len(text) == 0:
+                break
+            if skip and (text in skip):
+                continue
+            append( text )
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+                append = chunk.append
+        if len(chunk):
+            yield chunk
 
     def open_file( self, filename : str ):
         '''
@@ -270,18 +698,56 @@ class SimpleTextParser(  LogHelper ):
         assert( len(self._include_stack) == 0 )
         filename = os.path.abspath( filename )
         self._where = Where(filename,0)
+        self._replay = None
+        self._recorder = None
+        # "#pragma once" and the dependency list are per root file.
+        self._pragma_once = set()
+        self._dependencies = DependencyTracker()
+        self._sources = {}
+        if self._prefetcher is not None:
+            self._prefetcher.discard()
+        if self._cache is not None:
+            fingerprint = self.cache_fingerprint
+            if hasattr( self.if_evaluator, 'fingerprint' ):
+                # The built in evaluator, the starting symbols decide the output too.
+                fingerprint = fingerprint + ':' + self.if_evaluator.fingerprint()
+            key = self._cache.make_key( filename, fingerprint, self._include_path_list )
+            entry = self._cache.load( key )
+            if (entry is not None) and entry['defines'] and not hasattr( self.if_evaluator, 'set_symbols' ):
+                # A raw read could not undo the #define statements, see _expand_replay()
+                entry = None
+            if entry is not None:
+                # Cache hit, the source files are not touched.
+                for signature in entry['deps']:
+                    self._dependencies.add_input( signature )
+                for path in entry['missing']:
+                    self._dependencies.add_missing( path )
+                self._replay_root = filename
+                self._replay_count = 0
+                self._replay_symbols = self.if_evaluator.symbols if entry['defines'] else None
+                # The symbol table ends up as if the files were parsed.
+                for op, name, value in entry['defines']:
+                    self._apply_define( op, name, value )
+                # The entry has filenames, we want ids.
+                self._replay_files = [ file_table().intern( x ) for x in entry['files'] ]
+                self._replay = iter( entry['lines'] )
+                return
+            self._recorder = CacheRecorder( key )
         ise = IncludeEntry( self, filename, self._where )
         self._include_stack.append(ise)
 
-    def push_include_file( self, filename: str ):
+    def push_include_file( self, filename: str, identity : typing.Optional[str] = None ):
         '''
         Normally this is used by the "#include" directive.
         Open and push into an include file
+        identity is the absolute filename, by default os.path.abspath( filename )
         '''
         assert( len(self._include_stack) >= 1 )
-        ise = IncludeEntry( self, filename, self._where )
+        source = None
+        if self._prefetcher is not None:
+            source = self._prefetcher.take( filename )
+        ise = IncludeEntry( self, filename, self._where, source, identity )
         self._include_stack.append(ise)
-        self._where = Where( filename, 0 )
 
     def pop_include_file( self ):
         '''
@@ -290,13 +756,50 @@ class SimpleTextParser(  LogHelper ):
         assert( len(self._include_stack) > 1 )
         ise = self._include_stack.pop()
         ise.pop()
+        if len(self._include_stack) == 1:
+            # Back in the root file, nothing is being captured.
+            self._include_log = []
+            self._event_log = []
 
     def close_file( self ):
         ''
+        if self._replay is not None:
+            self._replay = None
+            return
         # We should be at the end of the parsing.
         assert( len(self._include_stack) == 1 )
         ise = self._include_stack.pop()
+        if ise.source.lineno >= ise.source.nlines:
+            # The whole file was read, so the recording is complete.
+            self._cache_store()
+        self._recorder = None
         ise.pop()
+        if self._prefetcher is not None:
+            self._prefetcher.discard()
+
+    def _cache_store( self ):
+        '''
+        The root file has been completely read, save what we recorded.
+        '''
+        if self._recorder is None:
+            return
+        self._cache.store( self._recorder.as_entry( self._dependencies ) )
+        self._recorder = None
+
+    def _replay_next( self ) -> WhereStr:
+        '''
+        Return the next line saved in the cache entry.
+        '''
+        try:
+            text, idx, lineno, end_lineno = next( self._replay )
+        except StopIteration:
+            return _where_str( '', self._where )
+        self._replay_count = self._replay_count + 1
+        if end_lineno is not None:
+            self._where = WhereRange.from_id( self._replay_files[idx], lineno, end_lineno )
+        else:
+            self._where = Where.from_id( self._replay_files[idx], lineno )
+        return _where_str( text, self._where )
 
     def _if_stack_error( self, msg ):
         '''
@@ -315,27 +818,10 @@ class SimpleTextParser(  LogHelper ):
             # If not present we are dead.
             self.syntax_error("No if evaluator present")
 
-        # Fist trim the expression
-        expression = m['expression'].strip()
-        # Assume the state is false.
-        state = False
-        try:
-            # Evaluate it 'wrapped' incase it throws an exception.
-            state = self.if_evaluator( self, expression )
-        except Exception as E:
-            # Something went wrong, we bail out
-            self._if_stack_error( "Expression syntax error: %s (%s)" % (expression,str(E)))
-
         # is this an IF or and ELIF?
         kw = m['keyword']
-        if kw == 'if':
-            if_entry = IfEntry( self, state )
-            # Sanity check? has this gone nutz?
-            if len(self._if_stack) > 50:
-                self.syntax_error("#if stack is >50 deep?\n")
-            self._if_stack.append(if_entry)
-            return SimpleTextParser.PREPROCESSING_LINE
-        if kw in 'elif':
+        if_entry = None
+        if kw == 'elif':
             # We should be within an if already.
             # Get the top of the if stack
             try:
@@ -345,13 +831,73 @@ class SimpleTextParser(  LogHelper ):
             # make sure we are not alread in the #else side.
             if if_entry.in_else:
                 self._if_stack_error("Already inside an #else condition")
-            if_entry.in_else = False
+            if if_entry.taken:
+                # A branch was taken, like C this #elif is not evaluated.
+                if_entry.handle_elif( False )
+                return SimpleTextParser.PREPROCESSING_LINE
+        elif kw != 'if':
+            # This should never occur.
+            raise RuntimeError("bug in SimpleTextParser()")
+
+        # Fist trim the expression
+        expression = m['expression'].strip()
+        # Assume the state is false.
+        state = False
+        try:
+            # Evaluate it 'wrapped' incase it throws an exception.
+            state = self.if_evaluator( self, expression )
+        except Exception as E:
+            # Something went wrong, we bail out
+            self._if_stack_error( "Expression syntax error: %s (%s)" % (expression,str(E)))
+        self._log_event( ('if', expression, bool(state)) )
+
+        if if_entry is not None:
             # And set the new state, the elif EXPRESSION result
-            if_entry.state = state
+            if_entry.handle_elif( bool(state) )
             return SimpleTextParser.PREPROCESSING_LINE
-        # This should never occur.
-        raise RuntimeError("bug in SimpleTextParser()")
-    
+        if_entry = IfEntry( self, bool(state) )
+        # Sanity check? has this gone nutz?
+        if len(self._if_stack) > 50:
+            self.syntax_error("#if stack is >50 deep?\n")
+        self._if_stack.append(if_entry)
+        return SimpleTextParser.PREPROCESSING_LINE
+
+    def _apply_define( self, op : str, name : str, value : str ):
+        '''
+        Apply a #define or #undef to the evaluator.
+        '''
+        if op == 'define':
+            self.if_evaluator.define( name, value )
+        else:
+            self.if_evaluator.undef( name )
+
+    def _handle_define( self, m : typing.Match ):
+        '''
+        Handle #define NAME [VALUE] and #undef NAME
+        Without the built in evaluator (or one with a define() method)
+        these are returned as is, ie: as a comment.
+        '''
+        if not hasattr( self.if_evaluator, 'define' ):
+            return m.string
+        kw = m['keyword']
+        expression = m['expression']
+        if (len(expression) == 0) or (not expression[0].isspace()):
+            # ie: "#defined", that is not ours.
+            return m.string
+        d = re_define.match( expression )
+        if d is None:
+            self.syntax_error("#%s: invalid syntax: %s" % (kw, expression.strip()) )
+        name = d['name']
+        value = d['value'] or ''
+        if (kw == 'undef') and len(value):
+            self.syntax_error("#undef should have only a name: %s" % expression.strip() )
+        self._apply_define( kw, name, value )
+        # Include files that change the symbols are not replayed from memory.
+        self._log_event( ('define', name) )
+        if self._recorder is not None:
+            self._recorder.add_define( kw, name, value )
+        return SimpleTextParser.PREPROCESSING_LINE
+
     def _dequote_include_filename( self, filename : str ):
         '''
         We have a filename specified as part of an "#include" statement
@@ -380,32 +926,291 @@ class SimpleTextParser(  LogHelper ):
         filename = m['expression']
         filename = filename.strip()
         filename = self._dequote_include_filename( filename )
-        # Get CWD of current file
-        pathlist = []
+        # Search relative to the directory of the current file, the resolver remembers answers.
         cwd = os.path.dirname( self._where.filename )
-        pathlist.append(cwd)
-        pathlist.append( os.getcwd() )
-        pathlist.extend( self._include_path_list )
-        # now search the path list.
-        found = None
-        tried = []
-        for idir in pathlist:
-            found = os.path.join( idir, filename )
-            tried.append( found )
-            if os.path.isfile( found ):
-                # YEA, success!
-                break
-            found = None
-            continue
+        found, identity, tried = self._include_resolver.resolve( cwd, filename )
+        # Every path tried before the one found is a probed, missing file.
+        missing = tried if (found is None) else tried[:-1]
+        for path in missing:
+            self._add_missing( path )
         if found is None:
             for tmp in tried:
                 self.log_print("%s: tried: %s" % (str(self._where), tmp ))
             if self._test_mode:
                 raise ParseError( self._where, "no-such-file: %s" % filename )
             self.fatal("No such include: %s" % filename)
-        self.push_include_file( found )
+        return self._include_file( found, identity )
+
+    def _add_input( self, signature : tuple ):
+        '''
+        Record a file that was read.
+        '''
+        self._dependencies.add_input( signature )
+        self._log_event( ('input', signature) )
+
+    def _add_missing( self, path : str ):
+        '''
+        Record a file that was searched for, but does not exist.
+        '''
+        self._dependencies.add_missing( path )
+        self._log_event( ('missing', path) )
+
+    def _log_event( self, event : tuple ):
+        '''
+        Remember something that decides what an include file produces.
+        '''
+        if len(self._include_stack) > 1:
+            self._event_log.append( event )
+
+    def _builtin_evaluator( self ) -> typing.Optional[IfEvaluator]:
+        '''
+        Return the if_evaluator if it is the built in one (not a subclass),
+        its answers depend only on its symbol table. Otherwise None.
+        '''
+        evaluator = self.if_evaluator
+        return evaluator if (type(evaluator) is IfEvaluator) else None
+
+    def _replay_marks( self, info : IncludeInfo ) -> typing.Optional[set]:
+        '''
+        Would this include file produce the same lines as last time?
+        It would if every #if it evaluated gives the same answer, and
+        the "#pragma once" files it included are in the same state.
+        If not, return None. If so, the "#pragma once" files it marks
+        are marked, and returned (the ones not already marked).
+
+        The #if answers are the same if the built in evaluator has the same
+        symbol table (version) as last time. Other evaluators are not called
+        to find out, files they decided anything in are not replayed.
+        '''
+        marked = set()
+        for event in info.events:
+            kind = event[0]
+            if kind == 'if':
+                if (info.version is None) or (self.if_evaluator is not info.evaluator) or (info.version != info.evaluator.version):
+                    return None
+            elif kind == 'once?':
+                seen = (event[1] in self._pragma_once) or (event[1] in marked)
+                if seen != event[2]:
+                    return None
+            elif kind == 'once!':
+                marked.add( event[1] )
+        marked.difference_update( self._pragma_once )
+        self._pragma_once.update( marked )
+        # The replayed file depends on the same files it did last time.
+        for event in info.events:
+            if event[0] == 'input':
+                self._dependencies.add_input( event[1] )
+            elif event[0] == 'missing':
+                self._dependencies.add_missing( event[1] )
+        return marked
+
+    def _include_file( self, filename : str, identity : str ):
+        '''
+        Include this file, unless it can be skipped or replayed from memory.
+        filename is used for the where of the lines, identity (the absolute
+        name) identifies the file.
+        '''
+        info = self._include_info.get( identity )
+        if info is None:
+            info = IncludeInfo( filename )
+            self._include_info[ identity ] = info
+        # Skipped or not, we depend on this file.
+        if info.signature is not None:
+            self._add_input( info.signature )
+        # #pragma once?
+        seen = identity in self._pragma_once
+        self._log_event( ('once?', identity, seen ) )
+        if seen:
+            info.skipped = info.skipped + 1
+            return SimpleTextParser.INCLUDE_BARRIER
+        # Include guard, if false the file produces only its comments and the markers.
+        # Only the built in evaluator is asked, and an error is reported when the file is read.
+        # The saved lines have the where of the name it was first found by.
+        evaluator = self._builtin_evaluator()
+        if (info.guard is not None) and (evaluator is not None) and (info.filename == filename):
+            try:
+                state = evaluator.evaluate( info.guard ) != 0
+            except IfExprError:
+                state = None
+            if state is not None:
+                self._log_event( ('if', info.guard, state) )
+            if state == False:
+                info.skipped = info.skipped + 1
+                self._replay_include( info.guard_stream, filename, identity, set() )
+                return self._opening_barrier( filename )
+        marked = None
+        if (info.stream is not None) and (info.filename == filename):
+            marked = self._replay_marks( info )
+        if marked is not None:
+            info.replayed = info.replayed + 1
+            # Our parent (if any) depends on the same things.
+            if len(self._include_stack) > 1:
+                self._event_log.extend( info.events )
+            self._replay_include( info.stream, filename, identity, marked )
+            return self._opening_barrier( filename )
+        info.included = info.included + 1
+        self.push_include_file( filename, identity )
         return SimpleTextParser.INCLUDE_BARRIER
 
+    def _replay_include( self, stream : List[WhereStr], filename : str, identity : str, marked : set ):
+        '''
+        Return the stream, the lines of an include file, from memory.
+        '''
+        self._pending.extend( stream )
+        self._replaying = ( filename, identity, marked, len(stream) )
+
+    def _expand_replay( self ):
+        '''
+        The client wants raw lines, but the lines are replayed (a cache hit,
+        or an include file from memory). Open the file, and read it (and its
+        includes) preprocessed up to where the replay is, then the raw lines
+        come from the file itself.
+        '''
+        if self._replay is not None:
+            # The root file, undo the #define statements of the cache entry.
+            count = self._replay_count
+            self._replay = None
+            if self._replay_symbols is not None:
+                self.if_evaluator.set_symbols( self._replay_symbols )
+            self._where = Where( self._replay_root, 0 )
+            self._include_stack.append( IncludeEntry( self, self._replay_root, self._where ) )
+        else:
+            filename, identity, marked, length = self._replaying
+            count = length - len(self._pending)
+            self._pending.clear()
+            # As if it was never included.
+            self._pragma_once.difference_update( marked )
+            self.push_include_file( filename, identity )
+        self._replaying = None
+        # The same lines, from the file. An include in it can be replayed again, see raw_next_line()
+        for x in range( 0, count ):
+            if self._pending:
+                text = self._pending.popleft()
+            else:
+                text = self._next_preprocessed_line()
+            if len(self._include_stack) > 1:
+                self._include_log.append( text )
+
+    def _opening_barrier( self, filename : str ) -> WhereStr:
+        '''
+        The INCLUDE_BARRIER of a skipped or replayed include, the same as push_include_file() gives.
+        '''
+        return _where_str( SimpleTextParser.INCLUDE_BARRIER, Where( filename, 0 ) )
+
+    def _include_done( self, barrier : WhereStr ):
+        '''
+        The include file on top of the stack has been completely read.
+        Save what is needed to skip or replay it next time.
+        '''
+        ise = self._include_stack[-1]
+        info = self._include_info.get( ise.identity )
+        if info is None:
+            # Pushed directly via push_include_file()
+            return
+        if not info.guard_checked:
+            info.guard_checked = True
+            guard = _find_guard( ise.source.text )
+            if guard is not None:
+                info.guard = guard[0]
+                info.guard_stream = self._guard_stream( ise, guard[1], guard[2] )
+            info.signature = ise.source.signature()
+        if not self.replay_includes:
+            return
+        if info.stream is not None:
+            return
+        if ise.raw_reads != self._raw_reads:
+            # The client read raw lines, those cannot be replayed.
+            return
+        if len(self._if_stack) != ise.if_depth:
+            # The #if/#endif statements do not balance.
+            return
+        evaluator = self._builtin_evaluator()
+        version = None if (evaluator is None) else evaluator.version
+        if version != ise.evaluator_version:
+            # The symbols changed while reading it (ie: by the client)
+            return
+        events = self._event_log[ ise.event_start : ]
+        for event in events:
+            if event[0] == 'define':
+                # Replaying would not redo the #define/#undef
+                return
+        # The first line logged is the INCLUDE_BARRIER that opened the file.
+        info.stream = self._include_log[ ise.log_start + 1 : ]
+        info.stream.append( barrier )
+        info.events = events
+        info.evaluator = evaluator
+        info.version = version
+
+    def _guard_stream( self, ise : IncludeEntry, if_offset : int, endif_offset : int ) -> List[WhereStr]:
+        '''
+        Return the lines the include file produces when its guard is false:
+        the comments around the guard, and the markers, ie: the same as reading it.
+        '''
+        source = ise.source
+        filename = ise.filename
+        text = source.text
+        offsets = source.offsets
+        if_lineno = source.position( if_offset ).lineno
+        endif_lineno = source.position( endif_offset ).lineno
+        result = []
+        for n in range( 1, if_lineno ):
+            result.append( _where_str( text[ offsets[n-1] : offsets[n] ], Where( filename, n ) ) )
+        result.append( _where_str( SimpleTextParser.PREPROCESSING_LINE, Where( filename, if_lineno ) ) )
+        if endif_lineno > if_lineno + 1:
+            result.append( _where_str( SimpleTextParser.IF_DISABLED, WhereRange( filename, if_lineno + 1, endif_lineno - 1 ) ) )
+        result.append( _where_str( SimpleTextParser.PREPROCESSING_LINE, Where( filename, endif_lineno ) ) )
+        for n in range( endif_lineno + 1, source.nlines + 1 ):
+            result.append( _where_str( text[ offsets[n-1] : offsets[n] ], Where( filename, n ) ) )
+        # At the end of the file.
+        result.append( _where_str( SimpleTextParser.INCLUDE_BARRIER, Where( filename, source.nlines + 1 ) ) )
+        return result
+
+    def write_depfile( self, filename : str, targets : List[str], phony : bool = True ):
+        '''
+        Write a Make compatible dependency file (like gcc -MD) listing every
+        file read while parsing the current root file.
+        '''
+        self._dependencies.write_make_depfile( filename, targets, phony )
+
+    def write_manifest( self, filename : str ):
+        '''
+        Write a JSON manifest of every file read, and every include path
+        probed but missing, plus the cache_fingerprint (the #if inputs).
+        See: pmake.text_parser.manifest_is_current()
+        '''
+        self._dependencies.write_manifest( filename, self.cache_fingerprint )
+
+    def write_flattened( self, out, markers : bool = False, relative_to : str = None ) -> int:
+        '''
+        Read the rest of the open root file, and write the preprocessed lines
+        with #line markers to "out" (a filename or text file object), like "cpp -E"
+        Set markers=True to keep INCLUDE_BARRIER, PREPROCESSING_LINE and IF_DISABLED.
+        Returns the number of lines written, see flatten.read_flattened()
+        '''
+        return flatten.write_flattened( self.iter_preprocessed( markers ), out, relative_to )
+
+    def include_counts( self ) -> dict:
+        '''
+        Return a dict, key is the absolute include file name, the value is a dict with
+        the number of times the file was: 'included', 'skipped' or 'replayed'
+        '''
+        result = {}
+        for name, info in self._include_info.items():
+            result[ name ] = info.counts()
+        return result
+
+    def _handle_pragma( self, m : typing.Match ):
+        '''
+        Handle "#pragma once", other pragmas are returned as is.
+        '''
+        if m['expression'].strip() != 'once':
+            # Not ours.
+            return m.string
+        identity = self._include_stack[-1].identity
+        self._pragma_once.add( identity )
+        self._log_event( ('once!', identity) )
+        return SimpleTextParser.PREPROCESSING_LINE
+
     def _handle_else( self, m : typing.Match ):
         '''
         Handle the #else statement
@@ -445,17 +1250,45 @@ class SimpleTextParser(  LogHelper ):
             rtext = self._handle_else(m)
         elif kw == 'endif':
             rtext = self._handle_endif(m)
+        elif kw == 'pragma':
+            rtext = self._handle_pragma(m)
+        elif kw in ('define','undef'):
+            rtext = self._handle_define(m)
         if rtext is None:
             # This should never occur.
             raise RuntimeError("internal error if/else/endif")
-        return WhereStr( rtext, where=self._where )
+        if isinstance( rtext, WhereStr ):
+            # It has its own where, see _opening_barrier()
+            return rtext
+        return _where_str( rtext, self._where )
 
     def next_preprocessed_line( self ):
         '''
         Return the next line from the input file
         Determine if it a #if/#else/#endif line
         if active - also handle #include statements.
-        '''    
+        '''
+        if self._replay is not None:
+            return self._replay_next()
+        if self._pending:
+            # Part of a replayed include file.
+            text = self._pending.popleft()
+        else:
+            text = self._next_preprocessed_line()
+        if len(self._include_stack) > 1:
+            # Inside an include file, remember so it can be replayed.
+            self._include_log.append( text )
+        if self._recorder is not None:
+            self._recorder.add_line( text )
+            if len(self._include_stack) == 0:
+                # End of the root file.
+                self._cache_store()
+        return text
+
+    def _next_preprocessed_line( self ):
+        '''
+        The work horse for next_preprocessed_line()
+        '''
         # No a preprocessing line
         # get state of IF stack.
         state = True
@@ -466,37 +1299,44 @@ class SimpleTextParser(  LogHelper ):
         while True:
             if len(self._include_stack) == 0:
                 # THERE IS NO MORE TO READ
-                return WhereStr( '', where=self._where )
-            text = self.raw_next_line()
+                return _where_str( '', self._where )
+            if not state:
+                # Skip the disabled lines, up to the matching #elif/#else/#endif
+                # Nested #if statements are not evaluated, they are disabled too.
+                where = self._where
+                nskipped = self._include_stack[-1].source.skip_conditional()
+                if nskipped > 0:
+                    # One marker covers all of the disabled lines.
+                    self._where = where.advance( nskipped )
+                    return _where_str( SimpleTextParser.IF_DISABLED,
+                                       WhereRange.from_id( where.file_id, where.lineno + 1, self._where.lineno ) )
+            # Work on the plain text, a WhereStr() is only created when needed.
+            text = self._include_stack[-1].next_text()
             if len(text) == 0:
                 # END OF FILE
                 if len( self._include_stack ) > 1:
-                    text = WhereStr( SimpleTextParser.INCLUDE_BARRIER, where=self._where )
+                    text = _where_str( SimpleTextParser.INCLUDE_BARRIER, self._where )
+                    self._include_done( text )
                     self.pop_include_file()
                     return text
                 # END of file for the primary top(outer) most file
                 ise = self._include_stack.pop()
                 ise.pop()
-                return WhereStr( '', where=self._where )
-            # Make it a string, regex does not like WhereStr()
+                return _where_str( '', self._where )
             # does it contain a keyword?
-            m = re_keyword.match(str(text))
+            m = re_keyword.match(text)
             if m is not None:
                 kw = m['keyword']
                 # Here we only want the flow control words, not #inlcude
                 if kw in _kw_flow_control:
                     return self._handle_keyword(m)
                 # include statements are handled only if the state is true
-            # Process based on current #if/#else/#endif state
-            if state:
-                # Enabled so just return the string.
-                if m is not None:
-                    # there is a keyword, and it is an #include here.
-                    text = self._handle_keyword(m)
-                # otherwise it is not a keyword inlcude just return the string
-                return text
-            # Disabled, so return the magic string as a WhereStr
-            return WhereStr( SimpleTextParser.IF_DISABLED, where=self._where )
+            # Disabled lines were skipped above, so we are enabled here.
+            if m is not None:
+                # there is a keyword, and it is an #include here.
+                return self._handle_keyword(m)
+            # otherwise it is not a keyword inlcude just return the string
+            return _where_str( text, self._where )
 
 
 
@@ -0,0 +1,62 @@
+'''
+Measures Variables.resolve() (compiled templates) against the original
+one replacement per pass _resolver.
+
+This is not a unit test, it is run by hand:
+
+    python -m pmake.variables.bench_variables
+    python -m pmake.variables.bench_variables --refs 15 --passes 2000
+
+The text is a command line like template with --refs references, some
+of them inside a function call. Note: the _resolver stops after 20
+replacements, keep --refs (plus the nested ones) under that.
+'''
+import argparse
+import time
+
+from pmake.variables import Variables
+
+
+def make_variables() -> Variables:
+    v = Variables()
+    v.just_exit = False
+    v.add( 'CC', 'gcc' )
+    v.add( 'OPT', '-O2' )
+    v.add( 'SRC_DIR', '/home/user/project/src' )
+    v.add( 'OBJ_DIR', '${SRC_DIR}/../obj' )
+    v.add( 'NAME', 'main' )
+    return v
+
+def make_text( nrefs : int ) -> str:
+    parts = []
+    for x in range( 0, nrefs ):
+        if x % 3 == 0:
+            parts.append( "${CC}" )
+        elif x % 3 == 1:
+            parts.append( "-o ${OBJ_DIR}/${NAME}.o" )
+        else:
+            parts.append( "${str.upper(${OPT})}" )
+    return ' '.join( parts )
+
+def timeit( fn, text : str, passes : int ) -> float:
+    start = time.perf_counter()
+    for x in range( 0, passes ):
+        fn( text )
+    return time.perf_counter() - start
+
+def main():
+    ap = argparse.ArgumentParser( description="Variables.resolve() benchmark" )
+    ap.add_argument( "--refs", type=int, default=6, help="references in the text" )
+    ap.add_argument( "--passes", type=int, default=5000, help="resolves per timing" )
+    args = ap.parse_args()
+    v = make_variables()
+    text = make_text( args.refs )
+    assert v.resolve( text ) == v._resolve_legacy( text )
+    print("text: %s" % text)
+    print("%-12s %10s %12s" % ('resolve', 'sec', 'usec/call'))
+    for name, fn in ( ( 'legacy', v._resolve_legacy ), ( 'compiled', v.resolve ) ):
+        sec = timeit( fn, text, args.passes )
+        print("%-12s %10.3f %12.2f" % (name, sec, 1e6 * sec / args.passes))
+
+if __name__ == '__main__':
+    main()
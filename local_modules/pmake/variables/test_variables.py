@@ -3,6 +3,7 @@ import os
 
 from pmake.variables import Variables
 from pmake.variables import VarError
+from pmake.variables.variable_core import _compile_template
 
 class VariableTest( unittest.TestCase ):
 
@@ -82,6 +83,40 @@ class VariableTest( unittest.TestCase ):
         tmp ="dog %s cat" % os.getcwd()
         self._standard_case("dog ${os.path.abspath(.)} cat", tmp )
 
+    def test_compiled_cache(self):
+        # Compiled once, by text.
+        parts = _compile_template( "a ${dog1} b" )
+        self.assertIs( parts, _compile_template( "a ${dog1} b" ) )
+        self.assertEqual( parts, ( "a ", ( 'v', 'dog1' ), " b" ) )
+        # Syntax errors are left to the legacy resolver.
+        self.assertIsNone( _compile_template( "${dog1 x}" ) )
+        self._expect_error( "${dog1 x}", VarError.SYNTAX )
+
+    def test_long_chain(self):
+        # More than the 20 replacements the legacy resolver allows.
+        for x in range( 0, 30 ):
+            self.DUT.add( "V%d" % x, "${V%d}." % (x+1) )
+        self.DUT.add( "V30", "end" )
+        self._standard_case( "${V0}", "end" + ("." * 30) )
+        self._standard_case( " ".join( ["${dog1}"] * 30 ), " ".join( ["shatzi"] * 30 ) )
+
+    def test_same_as_legacy(self):
+        self.DUT.just_exit = False
+        self.DUT.add( "P", "a,b" )
+        self.DUT.add( "D", "$" )
+        self.DUT.add( "Q", "x}" )
+        self.DUT.add( "FN", "str.upper" )
+        for text in ( "${os.path.join(${P})}",  # the value is split on the comma
+                      "${D}{dog1}",             # makes a new ${
+                      "${FN}",
+                      "${${FN}(dog)}",          # the function name from a variable
+                      "${str.upper(${dog1})} and ${dog2}" ):
+            self.assertEqual( self.DUT.resolve( text ), self.DUT._resolve_legacy( text ) )
+        self.assertEqual( self.DUT.resolve( "${D}{dog1}" ), "shatzi" )
+        # The } in the value ends the function call.
+        self._expect_error( "${str.upper(${Q})}", VarError.SYNTAX )
+        self._expect_error( "${nofunc(${dog1})}", VarError.UNDEF_FUNC )
+
     def test_os_environ(self):
         v = Variables()
         v.add_dict( os.environ )
@@ -275,6 +275,184 @@ class _resolver():
         raise Var_SyntaxError( self.history, text )
         
 
+# The compiled form of a template, see _compile_template()
+# A template is a tuple of parts, each part is one of:
+#    str                       - literal text
+#    ( 'v', name )             - ${name}
+#    ( 'f', fname, params )    - ${fname(a,b)}, params is a tuple of str
+#    ( 'd', parts )            - ${ ... } with ${} inside, ie: ${str.upper(${A})}
+#                                the parts are resolved and the text is then
+#                                handled like the _resolver does.
+_template_cache = dict()
+# Limit the size of the cache, when full it is cleared.
+_TEMPLATE_CACHE_MAX = 100000
+_NOT_CACHED = object()
+
+def _ref_node( content : list ):
+    '''
+    Given the parts between ${ and }, return the part for it.
+    None means: this is a syntax error (let the _resolver report it)
+    '''
+    if len(content) > 1 or ( content and not isinstance( content[0], str ) ):
+        return ( 'd', tuple( content ) )
+    name = ''.join( content ).strip()
+    if _re_basic_name.match( name ):
+        return ( 'v', name )
+    func_match = _re_function_call.match( name )
+    if func_match is None:
+        return None
+    params = func_match['params']
+    # Same as _resolver._get_params(), split on commas.
+    params = tuple( params.split(',') ) if len(params) else ()
+    return ( 'f', func_match['fname'], params )
+
+def _parse_template( text : str, pos : int, nested : bool ):
+    '''
+    Parse text from pos, if nested stop at the closing }
+    Returns ( parts, position after ), parts is None on a syntax error.
+    '''
+    parts = []
+    while True:
+        start = text.find( "${", pos )
+        if nested:
+            # A plain } closes this one, even inside a function call.
+            # That is what the _resolver does with: "first } after the ${"
+            close = text.find( '}', pos )
+            if close < 0:
+                # Missing closing curly brace.
+                return ( None, pos )
+            if (start < 0) or (close < start):
+                if close > pos:
+                    parts.append( text[ pos:close ] )
+                return ( parts, close + 1 )
+        elif start < 0:
+            if pos < len(text):
+                parts.append( text[ pos: ] )
+            return ( parts, len(text) )
+        if start > pos:
+            parts.append( text[ pos:start ] )
+        # +2 skips the opening ${
+        content, pos = _parse_template( text, start + 2, True )
+        if content is None:
+            return ( None, pos )
+        node = _ref_node( content )
+        if node is None:
+            return ( None, pos )
+        parts.append( node )
+
+def _compile_template( text : str ):
+    '''
+    Return the (cached) compiled form of text, a tuple of parts, or
+    None if it has a syntax error.
+    '''
+    parts = _template_cache.get( text, _NOT_CACHED )
+    if parts is _NOT_CACHED:
+        parts, pos = _parse_template( text, 0, False )
+        if parts is not None:
+            parts = tuple( parts )
+        if len(_template_cache) >= _TEMPLATE_CACHE_MAX:
+            _template_cache.clear()
+        _template_cache[ text ] = parts
+    return parts
+
+
+class _Fallback( Exception ):
+    '''
+    Raised by the _evaluator when the result would not be the same as the
+    _resolver, the text is then resolved by the _resolver.
+    '''
+    pass
+
+class _evaluator():
+    '''
+    Resolves a compiled template in one pass.
+    The _resolver does one replacement per pass and then scans the text
+    again, this evaluates each part once, and each variable value is
+    compiled (and cached) like any other template.
+
+    Parts are resolved right to left, the same order as the _resolver,
+    so errors and function calls happen in the same order.
+
+    Cases where the _resolver would see something different in the
+    replaced text (ie: a value with a "}" inside a function call, or
+    text that makes a new "${") raise _Fallback.
+    '''
+    def __init__( self, parent, starting_text, vars : dict ):
+        self._parent = parent
+        self._vars = vars
+        # The chain of values being resolved, ie: ${A} -> ${B} -> ${C}
+        self.history = [ starting_text ]
+        self._active = set()
+
+    def run( self, parts : tuple ) -> str:
+        result = []
+        for part in reversed( parts ):
+            if part.__class__ is str:
+                result.append( part )
+                continue
+            kind = part[0]
+            if kind == 'v':
+                result.append( self._var( part[1] ) )
+            elif kind == 'f':
+                result.append( self._call( part[1], part[2] ) )
+            else:
+                result.append( self._dynamic( part[1] ) )
+        result.reverse()
+        return ''.join( result )
+
+    def _var( self, name : str ) -> str:
+        if name not in self._vars:
+            e = Var_UndefinedVar( name, self.history )
+            self._parent.fatal(e)
+        value = self._vars.get( name, None )
+        if not isinstance( value, str ):
+            # Let the _resolver fail (or not) the way it does.
+            raise _Fallback()
+        if "${" not in value:
+            return value
+        # stop the recursive case where:  ${A}->${B}->${A} endlessly.
+        if name in self._active:
+            self.history.append( value )
+            raise Var_RecursionError( self.history )
+        parts = _compile_template( value )
+        if parts is None:
+            # The _resolver might join it with the text around it.
+            raise _Fallback()
+        self._active.add( name )
+        self.history.append( value )
+        result = self.run( parts )
+        self.history.pop()
+        self._active.discard( name )
+        return result
+
+    def _call( self, fname : str, params : tuple ) -> str:
+        '''
+        Same as _resolver._do_function_call()
+        '''
+        if fname not in func_table:
+            raise Var_UndefinedFunc( fname, self.history )
+        entry = func_table.get( fname )
+        result = entry[0]( *params )
+        if not isinstance( result, str ):
+            result = str( result )
+        return result
+
+    def _dynamic( self, parts : tuple ) -> str:
+        '''
+        A ${...} with ${} inside, resolve them and then look at the text.
+        '''
+        content = self.run( parts )
+        if ( "${" in content ) or ( '}' in content ):
+            # The _resolver would see a different ${ or }
+            raise _Fallback()
+        node = _ref_node( [ content ] )
+        if node is None:
+            raise _Fallback()
+        if node[0] == 'v':
+            return self._var( node[1] )
+        return self._call( node[1], node[2] )
+
+
 class Variables():
     '''
     This gives a crude "shell-like" text variables with some functions.
@@ -312,6 +490,35 @@ class Variables():
         '''
         Given text in the form: "hello ${planet}" perform var replacement.
         Also handles: "hello ${str.upper(${planet})}"
+
+        The text is compiled once (and cached), see _compile_template()
+        Unlike the _resolver, there is no limit of 20 replacements, only
+        a real loop (${A}->${B}->${A}) is a Var_RecursionError.
+        '''
+        if not isinstance( text, str ):
+            return self._resolve_legacy( text )
+        if "${" not in text:
+            return text
+        parts = _compile_template( text )
+        if parts is not None:
+            tmp = _evaluator( self, text, self._vars )
+            try:
+                result = tmp.run( parts )
+            except _Fallback:
+                result = None
+            except RecursionError:
+                # A very long (but not endless) ${A}->${B}->... chain
+                raise Var_RecursionError( tmp.history )
+            # A "${" here means the _resolver would keep going.
+            if (result is not None) and ("${" not in result):
+                return result
+        # Syntax errors and the odd cases, one replacement at a time.
+        return self._resolve_legacy( text )
+
+    def _resolve_legacy( self, text ):
+        '''
+        The original resolve(), this is slow on long text but handles
+        every case, see _evaluator.
         '''
         tmp = _resolver( self, text, self._vars )
         progress = True
@@ -1,13 +1,155 @@
-__ALL__ = ['Where']
+'''
+Where something came from, ie: a filename and line number.
+
+One Where is made for every line the parser reads, so they are kept small:
+    - Filenames are interned in a process wide FileTable, a Where holds the
+      small integer file id, not the name.
+    - A Where is an immutable tuple: (file_id, lineno, column)
+      Because it cannot change it can be shared, copy() and clone() return self.
+      To move along, make a new one, ie: where.advance(1)
+
+API changes from the old (mutable object) Where:
+    - The attributes are read only, "where.lineno = 5" raises AttributeError.
+      Make a new one instead: Where.from_id( where.file_id, 5 ) or advance()
+    - Two Wheres are equal if they are the same type and the same position,
+      before only the same object was equal. A Where is never equal to a
+      plain tuple, and hashing follows the same rule.
+    - A Where is a tuple, so it can be indexed and unpacked, but that
+      layout (file_id, lineno, column) is an implementation detail.
+'''
+from operator import itemgetter
+
+__ALL__ = ['Where', 'WhereRange', 'FileTable', 'file_table']
+
+
+class FileTable():
+    '''
+    Interns filenames, each unique name gets a small integer id.
+    Ids are only valid in this process, do not save them.
+    '''
+    def __init__( self ):
+        self._names = []
+        self._ids = {}
+
+    def intern( self, filename : str ) -> int:
+        '''
+        Return the id of this filename, adding it if needed.
+        '''
+        file_id = self._ids.get( filename )
+        if file_id is None:
+            file_id = len(self._names)
+            self._names.append( filename )
+            self._ids[ filename ] = file_id
+        return file_id
+
+    def name( self, file_id : int ) -> str:
+        return self._names[ file_id ]
+
+    def __len__( self ):
+        return len(self._names)
+
+
+# The one and only table.
+_file_table = FileTable()
+_names = _file_table._names
+_intern = _file_table.intern
+
+def file_table() -> FileTable:
+    return _file_table
+
+
+class Where( tuple ):
+    '''
+    A location: (file_id, lineno, column), column is None if not known.
+    '''
+    __slots__ = ()
+
+    def __new__( cls, filename : str, lineno : int, column : int = None ):
+        return tuple.__new__( cls, ( _intern( filename ), lineno, column ) )
+
+    @classmethod
+    def from_id( cls, file_id : int, lineno : int, column : int = None ) -> "Where":
+        '''
+        Make a Where from a file id, ie: Where.from_id( where.file_id, 42 )
+        '''
+        return tuple.__new__( cls, ( file_id, lineno, column ) )
+
+    file_id = property( itemgetter(0) )
+    lineno = property( itemgetter(1) )
+    column = property( itemgetter(2) )
+
+    @property
+    def filename( self ) -> str:
+        return _names[ self[0] ]
 
-class Where():
-    def __init__(self, filename,lineno):
-        self.filename = filename
-        self.lineno = lineno
     def __str__(self):
-        return "%s:%d:" % (self.filename, self.lineno)
-    
+        if self[2] is None:
+            return "%s:%d:" % (self.filename, self[1])
+        return "%s:%d:%d:" % (self.filename, self[1], self[2])
+
+    def __repr__(self):
+        return "%s(%r, %d)" % (type(self).__name__, self.filename, self[1])
+
+    def __getnewargs__( self ):
+        # For pickle and copy, the file id is not valid in another process.
+        return ( self.filename, self[1], self[2] )
+
+    # A Where is not a tuple as far as == and hash() are concerned.
+    # Not NotImplemented: the reflected tuple.__eq__() would say True.
+    def __eq__( self, other ):
+        if type(other) is not type(self):
+            return False
+        return tuple.__eq__( self, other )
+
+    def __ne__( self, other ):
+        if type(other) is not type(self):
+            return True
+        return tuple.__ne__( self, other )
+
+    def __hash__( self ):
+        return hash( ( type(self), tuple.__hash__( self ) ) )
+
+    def advance( self, n : int = 1 ) -> "Where":
+        '''
+        Return the location n lines further on, in the same file.
+        The result is the same type as self, without a column.
+        '''
+        return tuple.__new__( type(self), ( self[0], self[1] + n, None ) )
+
     def copy( self ):
-        return Where( self.filename, self.lineno )
+        # Immutable, so there is no need to copy.
+        return self
     def clone( self ):
-        return self.copy()
+        return self
+
+
+class WhereRange( Where ):
+    '''
+    A range of lines in a file, lineno to end_lineno inclusive.
+    Used when one item covers many lines, ie: a disabled #if block.
+    '''
+    __slots__ = ()
+
+    def __new__( cls, filename : str, lineno : int, end_lineno : int ):
+        return tuple.__new__( cls, ( _intern( filename ), lineno, None, end_lineno ) )
+
+    @classmethod
+    def from_id( cls, file_id : int, lineno : int, end_lineno : int ) -> "WhereRange":
+        return tuple.__new__( cls, ( file_id, lineno, None, end_lineno ) )
+
+    end_lineno = property( itemgetter(3) )
+
+    def advance( self, n : int = 1 ) -> "WhereRange":
+        '''
+        Return the same range, n lines further on.
+        '''
+        return tuple.__new__( type(self), ( self[0], self[1] + n, None, self[3] + n ) )
+
+    def __str__(self):
+        return "%s:%d-%d:" % (self.filename, self[1], self[3])
+
+    def __repr__(self):
+        return "WhereRange(%r, %d, %d)" % (self.filename, self[1], self[3])
+
+    def __getnewargs__( self ):
+        return ( self.filename, self[1], self[3] )
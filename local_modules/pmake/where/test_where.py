@@ -0,0 +1,72 @@
+import sys
+import unittest
+import copy
+import pickle
+
+from pmake.where import Where, WhereRange, file_table
+from pmake.logger import Where as LogWhere
+
+
+class Where_Test( unittest.TestCase ):
+    def test_basic(self):
+        w = Where( "where-test-file", 10 )
+        self.assertEqual( w.filename, "where-test-file" )
+        self.assertEqual( w.lineno, 10 )
+        self.assertIsNone( w.column )
+        self.assertEqual( str(w), "where-test-file:10:" )
+        self.assertEqual( str( Where( "where-test-file", 10, 4 ) ), "where-test-file:10:4:" )
+        # Immutable, so it is shared not copied.
+        self.assertIs( w.clone(), w )
+        with self.assertRaises( AttributeError ):
+            w.lineno = 11
+        n = w.advance( 2 )
+        self.assertEqual( ( n.filename, n.lineno ), ( "where-test-file", 12 ) )
+        self.assertEqual( w.lineno, 10 )
+
+    def test_file_table(self):
+        a = Where( "where-test-interned", 1 )
+        b = Where( "where-test-interned", 2 )
+        self.assertEqual( a.file_id, b.file_id )
+        self.assertEqual( file_table().name( a.file_id ), "where-test-interned" )
+        self.assertEqual( Where.from_id( a.file_id, 5 ), Where( "where-test-interned", 5 ) )
+        self.assertNotEqual( a.file_id, Where( "where-test-other", 1 ).file_id )
+
+    def test_compare(self):
+        w = Where( "where-test-compare", 3 )
+        self.assertEqual( w, Where( "where-test-compare", 3 ) )
+        self.assertEqual( hash(w), hash( Where( "where-test-compare", 3 ) ) )
+        self.assertNotEqual( w, Where( "where-test-compare", 4 ) )
+        # Not a plain tuple, and not a different kind of Where.
+        self.assertNotEqual( w, ( w.file_id, 3, None ) )
+        self.assertFalse( w == tuple( w ) )
+        self.assertNotEqual( w, LogWhere( "where-test-compare", 3 ) )
+        self.assertEqual( len( { w, tuple( w ) } ), 2 )
+        # advance() keeps the type.
+        lw = LogWhere( "log-file", 9 ).advance( 1 )
+        self.assertIs( type(lw), LogWhere )
+        self.assertEqual( lw.lineno, 10 )
+        r = WhereRange( "where-test-compare", 3, 5 ).advance( 2 )
+        self.assertIs( type(r), WhereRange )
+        self.assertEqual( ( r.lineno, r.end_lineno ), ( 5, 7 ) )
+
+    def test_range(self):
+        r = WhereRange( "where-test-range", 3, 7 )
+        self.assertEqual( ( r.lineno, r.end_lineno ), ( 3, 7 ) )
+        self.assertEqual( str(r), "where-test-range:3-7:" )
+        self.assertIs( r.copy(), r )
+
+    def test_pickle(self):
+        for w in ( Where( "where-test-pickle", 3 ), WhereRange( "where-test-pickle", 3, 4 ), LogWhere( "log-file", 9 ) ):
+            for tmp in ( pickle.loads( pickle.dumps( w ) ), copy.deepcopy( w ) ):
+                self.assertEqual( type(tmp), type(w) )
+                self.assertEqual( str(tmp), str(w) )
+
+    def test_logger_where(self):
+        w = LogWhere( "log-file", 9 )
+        self.assertTrue( w.filename.endswith( "log-file" ) )
+        self.assertTrue( str(w).endswith( "log-file:9" ) )
+
+
+if __name__ == '__main__':
+   unittest.main()
+   sys.exit(0)
@@ -1 +1,3 @@
 from .wherestr import WhereStr
+from .view import WhereStrView, LineBuffer
+from .buffer import WhereStrBuffer
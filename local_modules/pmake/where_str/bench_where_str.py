@@ -0,0 +1,122 @@
+'''
+Measures the cost of a WhereStr, compared with the old UserString based class.
+
+This is not a unit test, it is run by hand:
+
+    python -m pmake.where_str.bench_where_str
+
+For each kind of string it reports:
+    bytes/instance - via tracemalloc, for a typical 30 character line
+                     including the text itself, but not the shared Where.
+    make/sec       - instances created per second
+    match/sec      - re.match() calls per second, the UserString
+                     version must be converted with str() first.
+
+It also times a loop of single character edits on a 10K character text,
+the old __setitem__ (a list round trip per edit) vs a WhereStrBuffer.
+'''
+import re
+import sys
+import time
+import tracemalloc
+
+from collections import UserString
+from pmake.where import Where
+from pmake.where_str import WhereStr, WhereStrBuffer
+
+COUNT = 100000
+
+_re_key = re.compile( r'^\s*(?P<key>[a-z_0-9]+):' )
+
+
+class UserStringWhereStr( UserString ):
+    '''
+    The previous implementation, kept here only for comparison.
+    '''
+    def __init__( self, text, where ):
+        UserString.__init__( self, text )
+        self.where = where.clone()
+
+    def __setitem__(self, index, value):
+        data_as_list = list(self.data)
+        data_as_list[index] = value
+        self.data = "".join(data_as_list)
+
+
+def _make_plain( text, where ):
+    return text
+
+def _make_userstring( text, where ):
+    return UserStringWhereStr( text, where )
+
+def _make_kwargs( text, where ):
+    return WhereStr( text, where=where )
+
+def _make_fast( text, where ):
+    return WhereStr.fast( text, where )
+
+KINDS = (
+    ( 'str',               _make_plain,      False ),
+    ( 'UserString (old)',  _make_userstring, True ),
+    ( 'WhereStr()',        _make_kwargs,     False ),
+    ( 'WhereStr.fast()',   _make_fast,       False )
+)
+
+
+def measure( make, convert : bool ) -> dict:
+    where = Where( "bench.yml", 1 )
+    texts = [ "    key_%d: value-%d-text\n" % (x,x) for x in range( 0, COUNT ) ]
+    # Memory, the texts are copied so their size is included.
+    tracemalloc.start()
+    items = [ make( t[:-1] + '\n', where ) for t in texts ]
+    per_item = tracemalloc.get_traced_memory()[0] / COUNT
+    tracemalloc.stop()
+    # Creation speed
+    start = time.perf_counter()
+    for t in texts:
+        make( t, where )
+    make_rate = COUNT / ( time.perf_counter() - start )
+    # Matching speed
+    match = _re_key.match
+    start = time.perf_counter()
+    if convert:
+        for item in items:
+            match( str(item) )
+    else:
+        for item in items:
+            match( item )
+    match_rate = COUNT / ( time.perf_counter() - start )
+    return { 'bytes' : per_item, 'make' : make_rate, 'match' : match_rate }
+
+
+def measure_edits( text_size : int = 10000, edits : int = 2000 ) -> dict:
+    '''
+    Replace every 5th character, left to right, time both ways.
+    '''
+    where = Where( "bench.yml", 1 )
+    text = "x" * text_size
+    old = UserStringWhereStr( text, where )
+    start = time.perf_counter()
+    for x in range( 0, edits ):
+        old[ x * 5 ] = 'y'
+    old_time = time.perf_counter() - start
+    buf = WhereStrBuffer( text, where )
+    start = time.perf_counter()
+    for x in range( 0, edits ):
+        buf[ x * 5 ] = 'y'
+    new = buf.freeze()
+    new_time = time.perf_counter() - start
+    assert new == old.data
+    return { 'old' : old_time, 'new' : new_time }
+
+def main():
+    print("python %s" % sys.version.split()[0])
+    print("%-20s %14s %12s %12s" % ('kind', 'bytes/instance', 'make/sec', 'match/sec'))
+    for name, make, convert in KINDS:
+        r = measure( make, convert )
+        print("%-20s %14.0f %12.0f %12.0f" % (name, r['bytes'], r['make'], r['match']))
+    r = measure_edits()
+    print("2000 edits: UserString __setitem__ %.4f sec, WhereStrBuffer %.4f sec" % (r['old'], r['new']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+'''
+A mutable, position aware text buffer.
+
+WhereStr is immutable (it is a str), code that rewrites text in place
+should make a WhereStrBuffer, edit it, and then freeze() it back into a
+WhereStr. The buffer keeps the "where" of the text it was made from.
+
+Note: nothing in pmake edits text in place today, the old
+WhereStr.__setitem__/__delitem__ had no callers in this tree. This is
+for client code that did, see the WhereStr shims.
+
+This is a gap buffer: the characters before the gap are in one list, the
+characters after the gap are in another list (reversed). An edit moves
+the gap to the edit position, so a run of edits near each other (ie: a
+left to right rewrite) costs O(1) per character, not O(n) per edit.
+
+Example:
+    buf = WhereStrBuffer( text )
+    buf[0] = 'X'
+    buf.replace( 5, 8, 'new-text' )
+    del buf[-1]
+    text = buf.freeze()
+'''
+import typing
+
+from pmake.where_str.wherestr import WhereStr
+
+__ALL__ = ['WhereStrBuffer']
+
+
+class WhereStrBuffer():
+    '''
+    A gap buffer with a where attribute.
+    '''
+    __slots__ = ( '_before', '_after', 'where' )
+
+    def __init__( self, text : str = '', where = None ):
+        if where is None:
+            where = getattr( text, 'where', None )
+        self.where = where
+        # Characters before the gap, in order.
+        self._before : typing.List[str] = list( text )
+        # Characters after the gap, in reverse order so the gap end is the list end.
+        self._after : typing.List[str] = []
+
+    def __len__( self ):
+        return len(self._before) + len(self._after)
+
+    def _move_gap( self, pos : int ):
+        '''
+        Move the gap so that it is at offset "pos"
+        '''
+        before = self._before
+        n = len(before)
+        if pos < n:
+            tail = before[pos:]
+            tail.reverse()
+            self._after.extend( tail )
+            del before[pos:]
+        elif pos > n:
+            count = pos - n
+            chunk = self._after[-count:]
+            del self._after[-count:]
+            chunk.reverse()
+            before.extend( chunk )
+
+    def _index( self, index : int ) -> int:
+        size = len(self)
+        if index < 0:
+            index = index + size
+        if (index < 0) or (index >= size):
+            raise IndexError("WhereStrBuffer index out of range")
+        return index
+
+    def _range( self, index : slice ) -> tuple:
+        start, stop, step = index.indices( len(self) )
+        if step != 1:
+            raise ValueError("WhereStrBuffer does not support extended slices")
+        return ( start, max( start, stop ) )
+
+    def insert( self, pos : int, text : str ):
+        '''
+        Insert text at offset "pos", a negative pos counts from the end (like slicing)
+        '''
+        pos, end = self._range( slice( pos, pos ) )
+        self._move_gap( pos )
+        self._before.extend( text )
+
+    def append( self, text : str ):
+        self.insert( len(self), text )
+
+    def delete( self, start : int, end : int ):
+        '''
+        Remove the characters start to end (not including end)
+        The offsets are handled like slicing: negative counts from the end,
+        out of range is clamped.
+        '''
+        start, end = self._range( slice( start, end ) )
+        self._move_gap( start )
+        # The gap is at start, the deleted characters are at the end of _after.
+        if end > start:
+            del self._after[ len(self._after) - (end - start) : ]
+
+    def replace( self, start : int, end : int, text : str ):
+        '''
+        Replace the characters start to end with text, if end <= start
+        this inserts the text at start.
+        '''
+        # delete() always leaves the gap at start.
+        self.delete( start, end )
+        self._before.extend( text )
+
+    def edit_many( self, edits : typing.Iterable[tuple] ):
+        '''
+        Apply a batch of (start, end, text) replacements, the offsets refer
+        to the text before any of these edits. The ranges must not overlap.
+        Inserts (end <= start) at the same offset keep their order.
+        '''
+        # Offsets are made positive now, before the length changes.
+        ranges = []
+        for n, ( start, end, text ) in enumerate( edits ):
+            start, end = self._range( slice( start, end ) )
+            ranges.append( ( start, end, n, text ) )
+        # Last first, so the offsets of the rest are not moved.
+        ranges.sort( key=lambda e: e[:3], reverse=True )
+        previous = None
+        for start, end, n, text in ranges:
+            if (previous is not None) and (end > previous):
+                raise ValueError("overlapping edits at: %d" % start)
+            self.replace( start, end, text )
+            previous = start
+
+    def __getitem__( self, index ):
+        if isinstance( index, slice ):
+            return self.getvalue()[ index ]
+        index = self._index( index )
+        n = len(self._before)
+        if index < n:
+            return self._before[index]
+        return self._after[ len(self._after) - 1 - (index - n) ]
+
+    def __setitem__( self, index, value : str ):
+        if isinstance( index, slice ):
+            start, end = self._range( index )
+            self.replace( start, end, value )
+            return
+        index = self._index( index )
+        self.replace( index, index + 1, value )
+
+    def __delitem__( self, index ):
+        if isinstance( index, slice ):
+            start, end = self._range( index )
+        else:
+            start = self._index( index )
+            end = start + 1
+        self.delete( start, end )
+
+    def getvalue( self ) -> str:
+        '''
+        Return the text as a plain str.
+        '''
+        after = self._after[:]
+        after.reverse()
+        return ''.join( self._before ) + ''.join( after )
+
+    __str__ = getvalue
+
+    def __repr__( self ):
+        return "WhereStrBuffer(%r)" % self.getvalue()
+
+    def __eq__( self, other ):
+        if isinstance( other, WhereStrBuffer ):
+            other = other.getvalue()
+        return self.getvalue() == other
+
+    __hash__ = None
+
+    def freeze( self ) -> WhereStr:
+        '''
+        Return the text as a WhereStr, with the where of the original text.
+        '''
+        if self.where is None:
+            return WhereStr( self.getvalue() )
+        return WhereStr.fast( self.getvalue(), self.where )
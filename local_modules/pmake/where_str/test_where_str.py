@@ -3,7 +3,7 @@ import unittest
 import os
 
 from pmake import Where
-from pmake.where_str import WhereStr
+from pmake.where_str import WhereStr, WhereStrView, WhereStrBuffer
 
 
 class WhereStr_Test( unittest.TestCase ):
@@ -76,6 +76,115 @@ class WhereStr_Test( unittest.TestCase ):
 
 
 
+    def test_str_api( self ):
+        import re
+        w = WhereStr( "key: value\n", fn="api", ln=3 )
+        self.assertTrue( isinstance( w, str ) )
+        m = re.match( r'(?P<key>\w+):', w )
+        self.assertEqual( m['key'], "key" )
+        self.assertEqual( w.strip(), "key: value" )
+        self.assertEqual( type( w.as_str() ), str )
+        fast = WhereStr.fast( "text", w.where )
+        self.assertIs( fast.where, w.where )
+
+    def test_view( self ):
+        w = WhereStr( "  name: some value  \nnext: line\n", fn="view", ln=10 )
+        view = WhereStrView.from_where_str( w )
+        self.assertEqual( len(view), len(w) )
+        line = view.split('\n')[0]
+        key, colon, value = line.partition(':')
+        self.assertEqual( key.strip(), "name" )
+        self.assertEqual( ( key.strip().where.lineno, key.strip().where.column ), ( 10, 3 ) )
+        value = value.strip()
+        self.assertEqual( value, "some value" )
+        self.assertEqual( value.where.column, 9 )
+        self.assertEqual( value.split(), [ "some", "value" ] )
+        self.assertEqual( value.split()[1].where.column, 14 )
+        self.assertEqual( value[5:], "value" )
+        self.assertEqual( value[5:].where.column, 14 )
+        self.assertEqual( value[1], "o" )
+        self.assertEqual( value.find("val"), 5 )
+        second = view.split('\n')[1]
+        self.assertEqual( ( second.where.lineno, second.where.column ), ( 11, 1 ) )
+        # Same answers as str
+        for text in ( "", "  a  b c ", "a,,b,", ",", "no-sep" ):
+            v = WhereStrView.from_where_str( WhereStr( text ) )
+            self.assertEqual( [ x.as_str() for x in v.split() ], text.split() )
+            self.assertEqual( [ x.as_str() for x in v.split(None,1) ], text.split(None,1) )
+            self.assertEqual( [ x.as_str() for x in v.split(',') ], text.split(',') )
+            self.assertEqual( [ x.as_str() for x in v.split(',',1) ], text.split(',',1) )
+            self.assertEqual( [ x.as_str() for x in v.partition(',') ], list( text.partition(',') ) )
+            self.assertEqual( v.strip(' a').as_str(), text.strip(' a') )
+        self.assertEqual( value.as_where_str().where, value.where )
+
+
+    def test_buffer( self ):
+        w = WhereStr( "abcdefg", fn="buffer", ln=5 )
+        # The old in place edits point at the buffer.
+        with self.assertRaisesRegex( TypeError, "WhereStrBuffer" ):
+            w[0] = 'X'
+        with self.assertRaisesRegex( TypeError, "WhereStrBuffer" ):
+            del w[0]
+        buf = WhereStrBuffer( w )
+        expected = list( "abcdefg" )
+        buf[0] = 'X'
+        expected[0] = 'X'
+        del buf[-1]
+        del expected[-1]
+        buf[2:4] = "1234"
+        expected[2:4] = list( "1234" )
+        buf.insert( 1, "--" )
+        expected[1:1] = list( "--" )
+        del buf[3:5]
+        del expected[3:5]
+        buf.append( "!" )
+        expected.append( "!" )
+        self.assertEqual( buf.getvalue(), "".join( expected ) )
+        self.assertEqual( buf[2], expected[2] )
+        self.assertEqual( buf[-1], "!" )
+        self.assertEqual( buf[1:3], "".join( expected[1:3] ) )
+        self.assertEqual( len(buf), len(expected) )
+        with self.assertRaises( IndexError ):
+            buf[100]
+        # Bulk edits, offsets are before any of the edits.
+        buf = WhereStrBuffer( "one two three" )
+        buf.edit_many( [ (0, 3, "1"), (8, 13, "3"), (4, 7, "2") ] )
+        self.assertEqual( buf, "1 2 3" )
+        with self.assertRaises( ValueError ):
+            buf.edit_many( [ (0, 3, "x"), (2, 4, "y") ] )
+        # Pure inserts, the gap is moved to start first.
+        buf = WhereStrBuffer( "abcdefg" )
+        buf[2:2] = "XY"
+        self.assertEqual( buf, "abXYcdefg" )
+        buf.replace( 0, 0, ">" )
+        self.assertEqual( buf, ">abXYcdefg" )
+        buf = WhereStrBuffer( "one two" )
+        buf.edit_many( [ (3, 3, "!"), (0, 0, ">") ] )
+        self.assertEqual( buf, ">one! two" )
+        buf = WhereStrBuffer( "one two" )
+        buf.edit_many( [ (3, 3, "a"), (3, 3, "b"), (0, 3, "1") ] )
+        self.assertEqual( buf, "1ab two" )
+        # Negative and out of range offsets, like slicing.
+        for start, end in ( (-1, 2), (-2, 3), (-10, 1), (1, 10), (5, 9), (2, -1) ):
+            buf = WhereStrBuffer( "abc" )
+            buf.delete( start, end )
+            expected = list( "abc" )
+            del expected[ start:end ]
+            self.assertEqual( buf, "".join( expected ) )
+        buf = WhereStrBuffer( "abc" )
+        buf.insert( -1, "X" )
+        self.assertEqual( buf, "abXc" )
+        buf = WhereStrBuffer( "one two" )
+        buf.edit_many( [ (-3, None, "2"), (0, 3, "1") ] )
+        self.assertEqual( buf, "1 2" )
+        # Freeze keeps the original where.
+        buf = WhereStrBuffer( w )
+        buf[0] = 'A'
+        frozen = buf.freeze()
+        self.assertEqual( frozen, "Abcdefg" )
+        self.assertEqual( ( frozen.where.filename, frozen.where.lineno ), ( "buffer", 5 ) )
+
+
 
 if __name__ == '__main__':
    unittest.main()
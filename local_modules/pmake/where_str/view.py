@@ -0,0 +1,231 @@
+'''
+A WhereStrView is a piece of a larger text buffer, ie: a whole file.
+
+It holds (buffer, start, end) and no characters of its own. Slicing,
+split(), strip() and partition() return more views, so when a line is
+cut into tokens (keys, values, list items) each token still knows
+exactly where it came from, down to the column.
+
+The buffer contract:
+    buffer.text             - the whole decoded text (a str)
+    buffer.position(offset) - return the pmake.where.Where (with a column)
+                              of the character at offset in text.
+    pmake.text_parser.LineSource is such a buffer, and LineBuffer (below)
+    wraps a single string that already has a where.
+
+The "where" attribute is computed only when asked for, then remembered.
+Characters are copied only when a real str is needed, see as_str()
+
+Example:
+    view = parser.line_view( line )
+    key, colon, value = view.partition(':')
+    value = value.strip()
+    print("%s value is: %s" % (str(value.where), value.as_str()) )
+'''
+import re
+import typing
+
+from pmake.where import Where
+from pmake.where_str.wherestr import WhereStr
+
+__ALL__ = ['WhereStrView', 'LineBuffer']
+
+_re_non_space = re.compile( r'\S+' )
+
+
+class LineBuffer():
+    '''
+    A buffer (see above) for one string, ie: a WhereStr
+    Column 1 is the first character of the string.
+    '''
+    __slots__ = ( 'text', 'where' )
+
+    def __init__( self, text : str, where : Where ):
+        self.text = str(text)
+        self.where = where
+
+    def position( self, offset : int ) -> Where:
+        # Newlines inside the text move to the next line.
+        lineno = self.where.lineno + self.text.count( '\n', 0, offset )
+        line_start = self.text.rfind( '\n', 0, offset ) + 1
+        return Where.from_id( self.where.file_id, lineno, offset - line_start + 1 )
+
+
+class WhereStrView():
+    '''
+    The text: buffer.text[ start : end ] with a lazy where.
+    '''
+    __slots__ = ( 'buffer', 'start', 'end', '_where' )
+
+    def __init__( self, buffer, start : int = 0, end : typing.Optional[int] = None ):
+        if end is None:
+            end = len(buffer.text)
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self._where = None
+
+    @staticmethod
+    def from_where_str( text : WhereStr ) -> "WhereStrView":
+        '''
+        A view of the whole string, the columns are relative to its where.
+        '''
+        return WhereStrView( LineBuffer( text, text.where ) )
+
+    def _view( self, start : int, end : int ) -> "WhereStrView":
+        '''
+        Make a view, start and end are offsets into the buffer.
+        '''
+        result = WhereStrView.__new__( WhereStrView )
+        result.buffer = self.buffer
+        result.start = start
+        result.end = end
+        result._where = None
+        return result
+
+    @property
+    def where( self ) -> Where:
+        if self._where is None:
+            self._where = self.buffer.position( self.start )
+        return self._where
+
+    def as_str( self ) -> str:
+        ''' Return exactly a string, this copies the characters.'''
+        return self.buffer.text[ self.start : self.end ]
+
+    __str__ = as_str
+
+    def as_where_str( self ) -> WhereStr:
+        '''
+        Return a WhereStr with the same text and where.
+        '''
+        return WhereStr.fast( self.as_str(), self.where )
+
+    def __repr__( self ):
+        return "WhereStrView(%r)" % self.as_str()
+
+    def __len__( self ):
+        return self.end - self.start
+
+    def __bool__( self ):
+        return self.end > self.start
+
+    def __eq__( self, other ):
+        if isinstance( other, WhereStrView ):
+            other = other.as_str()
+        elif not isinstance( other, str ):
+            return NotImplemented
+        # Compare in place, without a copy.
+        return (len(other) == (self.end - self.start)) and self.buffer.text.startswith( other, self.start )
+
+    def __hash__( self ):
+        return hash( self.as_str() )
+
+    def __getitem__( self, index ):
+        if isinstance( index, slice ):
+            start, stop, step = index.indices( self.end - self.start )
+            if step != 1:
+                # Not contiguous, that cannot be a view.
+                return self.as_str()[ index ]
+            if stop < start:
+                stop = start
+            return self._view( self.start + start, self.start + stop )
+        return self.as_str()[ index ]
+
+    def find( self, sub : str, start : int = 0, end : typing.Optional[int] = None ) -> int:
+        '''
+        Like str.find(), the result is relative to this view.
+        '''
+        if end is None:
+            end = self.end - self.start
+        result = self.buffer.text.find( sub, self.start + start, self.start + end )
+        if result < 0:
+            return result
+        return result - self.start
+
+    def startswith( self, prefix ) -> bool:
+        return self.buffer.text.startswith( prefix, self.start, self.end )
+
+    def endswith( self, suffix ) -> bool:
+        return self.buffer.text.endswith( suffix, self.start, self.end )
+
+    def lstrip( self, chars : typing.Optional[str] = None ) -> "WhereStrView":
+        text = self.buffer.text
+        start = self.start
+        end = self.end
+        if chars is None:
+            while (start < end) and text[start].isspace():
+                start = start + 1
+        else:
+            while (start < end) and (text[start] in chars):
+                start = start + 1
+        return self._view( start, end )
+
+    def rstrip( self, chars : typing.Optional[str] = None ) -> "WhereStrView":
+        text = self.buffer.text
+        start = self.start
+        end = self.end
+        if chars is None:
+            while (end > start) and text[end-1].isspace():
+                end = end - 1
+        else:
+            while (end > start) and (text[end-1] in chars):
+                end = end - 1
+        return self._view( start, end )
+
+    def strip( self, chars : typing.Optional[str] = None ) -> "WhereStrView":
+        return self.lstrip( chars ).rstrip( chars )
+
+    def split( self, sep : typing.Optional[str] = None, maxsplit : int = -1 ) -> typing.List["WhereStrView"]:
+        '''
+        Like str.split(), but returns views.
+        '''
+        text = self.buffer.text
+        result = []
+        if sep is None:
+            # Runs of white space, empty strings are never returned.
+            for m in _re_non_space.finditer( text, self.start, self.end ):
+                if (maxsplit >= 0) and (len(result) == maxsplit):
+                    # The rest, as is, like str.split()
+                    result.append( self._view( m.start(), self.end ) )
+                    break
+                result.append( self._view( m.start(), m.end() ) )
+            return result
+        if len(sep) == 0:
+            raise ValueError("empty separator")
+        start = self.start
+        while (maxsplit < 0) or (len(result) < maxsplit):
+            found = text.find( sep, start, self.end )
+            if found < 0:
+                break
+            result.append( self._view( start, found ) )
+            start = found + len(sep)
+        result.append( self._view( start, self.end ) )
+        return result
+
+    def partition( self, sep : str ) -> tuple:
+        '''
+        Like str.partition(), but returns views.
+        '''
+        found = self.buffer.text.find( sep, self.start, self.end )
+        if found < 0:
+            return ( self, self._view( self.end, self.end ), self._view( self.end, self.end ) )
+        after = found + len(sep)
+        return ( self._view( self.start, found ), self._view( found, after ), self._view( after, self.end ) )
+
+    def match( self, pattern : typing.Pattern ) -> typing.Optional[typing.Match]:
+        '''
+        Run pattern.match() on the buffer, limited to this view.
+        The match offsets are buffer offsets, see group_view()
+        NOTE: "^" only matches at the start of a line, use \\A or no anchor.
+        '''
+        return pattern.match( self.buffer.text, self.start, self.end )
+
+    def group_view( self, m : typing.Match, group = 0 ) -> typing.Optional["WhereStrView"]:
+        '''
+        Return a view of a group from match(), or None if the group did not match.
+        '''
+        start, end = m.span( group )
+        if start < 0:
+            return None
+        return self._view( start, end )
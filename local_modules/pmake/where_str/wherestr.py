@@ -20,47 +20,62 @@ Perhaps a message like this:
 
 Thus the string that holds: 'foo.yml' also holds a "where" element.
 
-''' 
+The "where" contract:
+    Anything that has a "where" attribute can be used where a WhereStr is
+    expected, the attribute must have: filename, lineno and clone()
+    ie: a pmake.where.Where or WhereRange.
+
+WhereStr is a real str (a subclass) so the "re" module and all str
+methods work on it directly, no conversion is needed. Results of str
+methods (slices, split, strip etc) are plain str, without a where.
+To keep the where on slices use a WhereStrView, to edit text in place
+use a WhereStrBuffer and freeze() it when done.
+
+The where is a __slots__ attribute, a WhereStr has no instance __dict__.
+When lines are made in bulk use the fast constructor WhereStr.fast( text, where )
+'''
 from pmake import Where
-from collections import UserString
-from pmake.logger import fatal
 
-class WhereStr( UserString ):
-    def __init__(self, *args, **kwargs ):
+_str_new = str.__new__
+
+class WhereStr( str ):
+    __slots__ = ( 'where', )
+
+    def __new__( cls, *args, **kwargs ):
         if len(args) != 1:
             raise Exception("expected 1 parameter")
-        if 'fn' in kwargs:
-            fn = kwargs.get('fn')
-            del( kwargs['fn'] )
-        else:
-            fn = "Unknown"
-        if 'ln' in kwargs:
-            ln = kwargs.get('ln')
-            del( kwargs['ln'] )
-        else:
-            ln = 1
-        if "where" in kwargs:
-            w = kwargs.get('where')
+        fn = kwargs.pop( 'fn', "Unknown" )
+        ln = kwargs.pop( 'ln', 1 )
+        w = kwargs.pop( 'where', None )
+        if w is not None:
             w = w.clone()
-            del( kwargs['where'] )
         else:
             w = Where( fn, ln )
         # strings do not take KWARGS 
         if len(kwargs) != 0:
             raise Exception("unexpected kw params: %s" % str(kwargs.keys() ))
-        UserString.__init__( self, args[0] )
+        self = _str_new( cls, args[0] )
         self.where = w
+        return self
+
+    @staticmethod
+    def fast( text : str, where ) -> "WhereStr":
+        '''
+        Make a WhereStr without any checks, the where is not cloned.
+        Use this with an immutable pmake.where.Where, ie: in the parser.
+        '''
+        self = _str_new( WhereStr, text )
+        self.where = where
+        return self
+
+    # Deprecated: the UserString based WhereStr could be edited in place.
+    # A str cannot, edit a WhereStrBuffer and freeze() it instead.
+    def __setitem__( self, index, value ):
+        raise TypeError("WhereStr is immutable, use a WhereStrBuffer to edit text")
+
+    def __delitem__( self, index ):
+        raise TypeError("WhereStr is immutable, use a WhereStrBuffer to edit text")
+
     def as_str( self ):
         ''' Return exactly a string nothing else but a string.'''
         return str(self)
-    
-    def __setitem__(self, index, value):
-        data_as_list = list(self.data)
-        data_as_list[index] = value
-        self.data = "".join(data_as_list)
-
-    def __delitem__(self, index):
-        data_as_list = list(self.data)
-        del data_as_list[index]
-        self.data = "".join(data_as_list)        
-        
\ No newline at end of file
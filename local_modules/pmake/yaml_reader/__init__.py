@@ -0,0 +1,12 @@
+'''
+What is the "yaml_reader"?
+
+pmake.yml files are YAML, but only a small part of YAML is used.
+The YamlReader reads that part directly from the SimpleTextParser
+(so #if and #include work in pmake.yml files) and builds a NestedDict
+where every key and value is a WhereStr, so errors can say where the
+value came from.
+
+See yaml_reader.py for the supported subset.
+'''
+from .yaml_reader import YamlReader
@@ -0,0 +1,96 @@
+'''
+Measures the YamlReader against a general YAML loader (PyYAML).
+
+This is not a unit test, it is run by hand:
+
+    python -m pmake.yaml_reader.bench_yaml_reader
+    python -m pmake.yaml_reader.bench_yaml_reader --targets 5000
+
+A pmake.yml like file is written to a temp directory, with "targets"
+entries each with a name, a list of sources, a map of defines and a
+block string of flags. It is then read:
+    parser only  - SimpleTextParser.iter_preprocessed(), no YAML
+    YamlReader   - the parser and the reader, WhereStr values
+    PyYAML       - yaml.load() of the same text, with the pure python
+                   SafeLoader and (if built) the libyaml CSafeLoader.
+                   Note: the values have no where, and the #if/#include
+                   lines are only comments to it.
+'''
+import argparse
+import os
+import tempfile
+import time
+
+from pmake.text_parser import SimpleTextParser
+from pmake.yaml_reader import YamlReader
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+def make_yaml( ntargets : int ) -> str:
+    lines = [ "# generated by bench_yaml_reader.py", "project:", "  name: bench", "  version: '1.0'", "targets:" ]
+    for x in range( 0, ntargets ):
+        lines.append( "- name: target_%d   # a comment" % x )
+        lines.append( "  kind: library" )
+        lines.append( "  sources:" )
+        for y in range( 0, 5 ):
+            lines.append( "    - src/target_%d/file_%d.c" % (x, y) )
+        lines.append( "  defines:" )
+        lines.append( "    LEVEL: \"%d\"" % (x % 4) )
+        lines.append( "    NAME: target_%d" % x )
+        lines.append( "  includes: [ inc, src/target_%d ]" % x )
+        lines.append( "  flags: |" )
+        lines.append( "    -O2" )
+        lines.append( "    -Wall" )
+    return '\n'.join( lines ) + '\n'
+
+def _parser_only( filename ):
+    p = SimpleTextParser()
+    p.use_builtin_evaluator()
+    p.open_file( filename )
+    for text in p.iter_preprocessed():
+        pass
+
+def _yaml_reader( filename ):
+    return YamlReader.read_file( filename )
+
+def best_of( fn, arg, repeat : int ) -> float:
+    best = None
+    for x in range( 0, repeat ):
+        start = time.perf_counter()
+        fn( arg )
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+def main():
+    ap = argparse.ArgumentParser( description="YamlReader benchmark" )
+    ap.add_argument( "--targets", type=int, default=2000, help="number of targets in the file" )
+    ap.add_argument( "--repeat", type=int, default=3, help="best of this many runs" )
+    args = ap.parse_args()
+    text = make_yaml( args.targets )
+    filename = os.path.join( tempfile.gettempdir(), "bench_yaml_reader.yml" )
+    with open( filename, "wt" ) as f:
+        f.write( text )
+    nlines = text.count( '\n' )
+    cases = [ ( 'parser only', _parser_only, filename ),
+              ( 'YamlReader', _yaml_reader, filename ) ]
+    if yaml is None:
+        print("PyYAML is not installed, it is not measured.")
+    else:
+        cases.append( ( 'PyYAML SafeLoader', lambda t: yaml.load( t, Loader=yaml.SafeLoader ), text ) )
+        if getattr( yaml, 'CSafeLoader', None ) is not None:
+            cases.append( ( 'PyYAML CSafeLoader', lambda t: yaml.load( t, Loader=yaml.CSafeLoader ), text ) )
+    print("%d lines, %d bytes" % (nlines, len(text)))
+    print("%-24s %10s %12s" % ('reader', 'sec', 'lines/sec'))
+    for name, fn, arg in cases:
+        sec = best_of( fn, arg, args.repeat )
+        print("%-24s %10.3f %12.0f" % (name, sec, nlines / sec))
+    os.remove( filename )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import sys
+import unittest
+import os
+import shutil
+import tempfile
+
+from pmake.nested_dict import NestedDict
+from pmake.text_parser import SimpleTextParser
+from pmake.text_parser.text_parser import ParseError
+from pmake.where_str import WhereStr
+from pmake.yaml_reader import YamlReader
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+_temp_dir=None
+
+SAMPLE = '''# A sample pmake.yml
+project:
+  name: demo   # the name
+  version: "1.0"
+  tags: [ a, 'b c', "d\\te" ]
+  empty:
+  none: {}
+targets:
+- name: lib
+  sources:
+    - a.c
+    - b.c
+  flags: |
+    -O2
+    -g
+
+- name: app
+  desc: >-
+    one
+    two
+
+    three
+  url: http://example.com/x#y
+list:
+  - - x
+    - y
+  -
+    k: v
+"main.c": 'it''s'
+keep: |+
+  text
+
+last: x
+'''
+
+def _plain( value ):
+    '''
+    NestedDicts (also in lists) to dicts, WhereStr to str, for compares.
+    '''
+    if isinstance( value, NestedDict ):
+        return dict( (str(k), _plain(v)) for k,v in value.items() )
+    if isinstance( value, list ):
+        return [ _plain(v) for v in value ]
+    if isinstance( value, str ):
+        return str.__str__( value )
+    return value
+
+
+class YamlReader_Test( unittest.TestCase ):
+
+    def getTempDir( self ):
+        # Fixed names, on failure the files can be inspected.
+        # See the same function in test_text_parser.py
+        global _temp_dir
+        if _temp_dir is None:
+            tmp = tempfile.gettempdir()
+            _temp_dir = os.path.join( tmp, 'yaml-reader-unit-test' )
+            if os.path.exists( _temp_dir ):
+                shutil.rmtree( _temp_dir )
+            os.makedirs( _temp_dir )
+        return _temp_dir
+
+    def write_file( self, name, text ):
+        fn = os.path.join( self.getTempDir(), name )
+        with open( fn, "wt" ) as f:
+            f.write( text )
+        return fn
+
+    def setUp( self ):
+        self.parser = SimpleTextParser()
+        self.parser.unit_test_mode()
+        self.parser.use_builtin_evaluator()
+
+    def tearDown(self):
+        self.parser = None
+
+    def read( self, name, text ):
+        fn = self.write_file( name, text )
+        return YamlReader.read_file( fn, self.parser )
+
+    def expect_error( self, text, msg ):
+        # A new parser, the last one stopped in the middle of a file.
+        self.setUp()
+        with self.assertRaises( ParseError ) as ctx:
+            self.read( 'error.yml', text )
+        self.assertIn( msg, str(ctx.exception) )
+
+    def test_sample( self ):
+        result = _plain( self.read( 'sample.yml', SAMPLE ) )
+        self.assertEqual( result, {
+            'project' : { 'name' : 'demo', 'version' : '1.0', 'tags' : ['a', 'b c', 'd\te'],
+                          'empty' : None, 'none' : {} },
+            'targets' : [ { 'name' : 'lib', 'sources' : ['a.c', 'b.c'], 'flags' : '-O2\n-g\n' },
+                          { 'name' : 'app', 'desc' : 'one two\nthree', 'url' : 'http://example.com/x#y' } ],
+            'list' : [ ['x', 'y'], { 'k' : 'v' } ],
+            'main.c' : "it's",
+            'keep' : 'text\n\n',
+            'last' : 'x' } )
+
+    @unittest.skipIf( yaml is None, "PyYAML is not installed" )
+    def test_same_as_pyyaml( self ):
+        result = _plain( self.read( 'sample.yml', SAMPLE ) )
+        self.assertEqual( result, yaml.safe_load( SAMPLE ) )
+
+    def test_where( self ):
+        nd = self.read( 'where.yml', SAMPLE )
+        name = nd.get( 'project.name' )
+        self.assertIsInstance( name, WhereStr )
+        self.assertEqual( name.where.filename, os.path.join( self.getTempDir(), 'where.yml' ) )
+        self.assertEqual( ( name.where.lineno, name.where.column ), ( 3, 9 ) )
+        tags = nd.get( 'project.tags' )
+        self.assertEqual( tags[1].where.column, 14 )
+        flags = nd.get( 'targets' )[0].get( 'flags' )
+        self.assertEqual( ( flags.where.lineno, flags.where.column ), ( 14, 5 ) )
+        # The keys know where they are too.
+        key = [ k for k,v in nd.items() ][1]
+        self.assertEqual( key, 'targets' )
+        self.assertEqual( key.where.lineno, 8 )
+        # Keys with a "." are not split.
+        self.assertEqual( nd.get_key( 'main.c' ), "it's" )
+
+    def test_preprocessor( self ):
+        self.write_file( 'common.yml', 'common:\n  cc: gcc\n' )
+        text = '''#include "common.yml"
+#if DEBUG
+opt: -O0
+#else
+opt: -O2
+#endif
+flags: |
+  -Wall
+#if DEBUG
+debug: yes
+#endif
+'''
+        nd = self.read( 'pp.yml', text )
+        self.assertEqual( _plain( nd ), { 'common' : { 'cc' : 'gcc' }, 'opt' : '-O2', 'flags' : '-Wall\n' } )
+        self.parser = SimpleTextParser()
+        self.parser.unit_test_mode()
+        self.parser.use_builtin_evaluator( { 'DEBUG' : '1' } )
+        nd = self.read( 'pp.yml', text )
+        self.assertEqual( nd.get( 'opt' ), '-O0' )
+        self.assertEqual( nd.get( 'debug' ), 'yes' )
+        self.assertEqual( nd.get( 'common.cc' ).where.filename, os.path.join( self.getTempDir(), 'common.yml' ) )
+
+    def test_triple_quoted( self ):
+        nd = self.read( 'triple.yml', 'a: """\none\n#if not-processed\n  two\n"""\nb: """x"""\n' )
+        self.assertEqual( nd.get( 'a' ), 'one\n#if not-processed\n  two\n' )
+        self.assertEqual( nd.get( 'a' ).where.lineno, 1 )
+        self.assertEqual( nd.get( 'b' ), 'x' )
+        # It cannot cross the end of an include file.
+        self.write_file( 'open.yml', 'a: """\nno end\n' )
+        self.expect_error( '#include "open.yml"\n"""\n', 'unterminated """' )
+
+    def test_errors( self ):
+        self.expect_error( 'a:\n\tb: 1\n', 'tabs' )
+        self.expect_error( 'a: 1\n  b: 2\n', 'bad indentation' )
+        self.expect_error( 'a: 1\na: 2\n', 'duplicate key' )
+        self.expect_error( 'a: &anchor 1\n', 'not supported' )
+        self.expect_error( 'a: "no end\n', 'unterminated quoted' )
+        self.expect_error( 'a: [ [1], 2 ]\n', 'nested flow' )
+        self.expect_error( 'a: { b: 1 }\n', 'flow maps' )
+        self.expect_error( '- a\n', 'list item where' )
+        self.expect_error( 'a:\n- b\n- c: 1\n  d\n', 'expected key: value' )
+        self.expect_error( 'a: "x" y\n', 'unexpected text' )
+
+
+if __name__ == '__main__':
+   unittest.main()
+   sys.exit(0)
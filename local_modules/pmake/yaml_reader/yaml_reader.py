@@ -0,0 +1,462 @@
+'''
+A YAML reader for the subset of YAML used by pmake.yml files.
+
+It reads the preprocessed lines from a SimpleTextParser, in one pass,
+and builds a NestedDict directly. Every key and scalar value is a
+WhereStr, with the file, line and column it came from, so an error
+about any value can point at it. A general YAML library would need the
+text joined back up, and would lose the where of every value.
+
+The subset:
+    key: value                      - maps, any depth, by indentation
+    - value                         - lists, also "- key: value" (a map in a list)
+    plain, 'single' and "double"    - scalars, all are WhereStr, there is no
+                                      type conversion, ie: 12 and yes are text
+    [ a, b, "c" ]                   - flow lists, of scalars only
+    {}                              - an empty map
+    key: |   or   key: >            - block strings, literal and folded,
+                                      with the chomping flags - and +
+    key: """                        - a multi-line string, until the closing """
+                                      the lines are read raw (no #if / #include)
+                                      and it cannot cross an include file.
+    # comment                       - full line and after a value.
+    key:                            - with nothing below it is None
+
+Not supported (a syntax error): tabs for indentation, anchors, aliases,
+tags, nested flow collections, and quoted strings over many lines.
+
+Lines that start with "#" are comments, so #if/#include etc, and the
+markers the parser returns for them, are skipped. They are at column 0,
+so they end any block string they are found in.
+
+Example:
+    parser = SimpleTextParser()
+    parser.use_builtin_evaluator()
+    parser.open_file( "pmake.yml" )
+    config = YamlReader( parser ).read()
+    name = config.get( 'project.name' )
+    print("%s name is: %s" % ( str(name.where), name ) )
+'''
+import re
+import typing
+
+from pmake.where import Where
+from pmake.where_str import WhereStr
+from pmake.nested_dict import NestedDict
+from pmake.text_parser import SimpleTextParser
+
+__ALL__ = ['YamlReader']
+
+_where_from_id = Where.from_id
+# Used to detect a missing key without an exception.
+_MISSING = object()
+
+# The block string header: style, chomping and indent in any order, then an optional comment.
+re_block_header = re.compile( r'^([|>])(?:([+-])([1-9])?|([1-9])([+-])?)?\s*(#.*)?$' )
+re_double_quoted = re.compile( r'"((?:[^"\\]|\\.)*)"' )
+re_single_quoted = re.compile( r"'((?:[^']|'')*)'" )
+re_escape = re.compile( r'\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|.)' )
+# One item in a flow list
+re_flow_item = re.compile( r'\s*("(?:[^"\\]|\\.)*"|\'(?:[^\']|\'\')*\'|[^,]*?)\s*(,|$)' )
+
+_escapes = {
+    'n' : '\n', 't' : '\t', 'r' : '\r', '0' : '\0', 'a' : '\a', 'b' : '\b',
+    'e' : '\x1b', 'f' : '\f', 'v' : '\v', '"' : '"', '/' : '/', '\\' : '\\', ' ' : ' '
+}
+
+def _unescape( m ) -> str:
+    text = m.group(1)
+    if len(text) > 1:
+        # \xNN or \uNNNN
+        return chr( int( text[1:], 16 ) )
+    result = _escapes.get( text )
+    if result is None:
+        # Not valid YAML, but harmless, keep it as is.
+        return '\\' + text
+    return result
+
+def _is_item( stripped : str ) -> bool:
+    '''
+    Is this (left stripped) line a list item?
+    '''
+    return (stripped == '-') or stripped.startswith( '- ' )
+
+
+class _Frame():
+    '''
+    One open map or list, and the column its entries start at.
+    '''
+    __slots__ = ( 'indent', 'container', 'is_list' )
+
+    def __init__( self, indent : int, container ):
+        self.indent = indent
+        self.container = container
+        self.is_list = isinstance( container, list )
+
+
+class YamlReader():
+    '''
+    Reads the pmake.yml YAML subset (see above) from a SimpleTextParser.
+    '''
+    def __init__( self, parser : SimpleTextParser ):
+        self.parser = parser
+        # The open maps and lists, the root map is [0]
+        self._stack : typing.List[_Frame] = []
+        # A "key:" (or "-") with no value, the value is the block below it, if any.
+        # ( container, key or None for a list, indent of the key )
+        self._pending : typing.Optional[tuple] = None
+        # A line read ahead by a block string and not used, see _next_line()
+        self._pushed_back = None
+        # Counters, see stats()
+        self.lines = 0
+        self.values = 0
+
+    @staticmethod
+    def read_file( filename : str, parser : typing.Optional[SimpleTextParser] = None ) -> NestedDict:
+        '''
+        Read a YAML file, with a new parser (using the built in #if evaluator) if none is given.
+        '''
+        if parser is None:
+            parser = SimpleTextParser()
+            parser.use_builtin_evaluator()
+        parser.open_file( filename )
+        return YamlReader( parser ).read()
+
+    def stats( self ) -> dict:
+        return { 'lines' : self.lines, 'values' : self.values }
+
+    def _error( self, msg : str ):
+        self.parser.syntax_error( msg )
+
+    def _next_line( self ) -> WhereStr:
+        if self._pushed_back is not None:
+            text = self._pushed_back
+            self._pushed_back = None
+            return text
+        self.lines = self.lines + 1
+        return self.parser.next_preprocessed_line()
+
+    def read( self ) -> NestedDict:
+        '''
+        Read to the end of the root file, return the top level map.
+        '''
+        root = NestedDict()
+        self._stack = [ _Frame( 0, root ) ]
+        self._pending = None
+        next_line = self._next_line
+        while True:
+            line = next_line()
+            if len(line) == 0:
+                break
+            text = line.rstrip( '\r\n' )
+            stripped = text.lstrip( ' ' )
+            if (len(stripped) == 0) or (stripped[0] == '#'):
+                # Blank, comment, preprocessor line or marker.
+                continue
+            indent = len(text) - len(stripped)
+            if stripped[0] == '\t':
+                self._error("tabs cannot be used for indentation")
+            if (indent == 0) and (stripped in ('---', '...')):
+                # Start (or end) of the document.
+                continue
+            self._line( line.where, text, stripped, indent )
+        if self._pending is not None:
+            self._resolve_pending( None )
+        return root
+
+    def _put( self, container, key, value ):
+        if key is None:
+            container.append( value )
+        else:
+            container.set_key( key, value )
+
+    def _resolve_pending( self, child ):
+        container, key, indent = self._pending
+        self._pending = None
+        self._put( container, key, child )
+
+    def _line( self, where : Where, text : str, stripped : str, indent : int ):
+        '''
+        Handle one line that has content.
+        '''
+        stack = self._stack
+        if self._pending is not None:
+            container, key, pindent = self._pending
+            # A list may be at the same indent as its key, ie: "key:\n- a"
+            if (indent > pindent) or ((indent == pindent) and (key is not None) and _is_item( stripped )):
+                # The block below the key.
+                child = [] if _is_item( stripped ) else NestedDict()
+                self._resolve_pending( child )
+                stack.append( _Frame( indent, child ) )
+            else:
+                # Nothing below, the value is None.
+                self._resolve_pending( None )
+        # Close the maps and lists that ended.
+        while len(stack) > 1:
+            top = stack[-1]
+            if indent < top.indent:
+                stack.pop()
+            elif (indent == top.indent) and top.is_list and not _is_item( stripped ):
+                # The end of a list that was at the same indent as its key.
+                stack.pop()
+            else:
+                break
+        frame = stack[-1]
+        if indent != frame.indent:
+            self._error("bad indentation, expected column %d" % (frame.indent + 1))
+        if frame.is_list:
+            self._item( frame.container, where, text, stripped, indent )
+        else:
+            self._entry( frame.container, where, text, stripped, indent )
+
+    def _item( self, container : list, where : Where, text : str, content : str, indent : int ):
+        '''
+        A list item, content starts with the "-" at column indent.
+        '''
+        if not _is_item( content ):
+            self._error("expected a list item: - value")
+        value = content[1:].lstrip( ' ' )
+        col = indent + len(content) - len(value)
+        if (len(value) == 0) or (value[0] == '#'):
+            # The value is the block below, if any.
+            self._pending = ( container, None, indent )
+            return
+        if _is_item( value ):
+            # A list in a list: "- - a"
+            child = []
+            container.append( child )
+            self._stack.append( _Frame( col, child ) )
+            self._item( child, where, text, value, col )
+            return
+        if self._split_key( value ) is not None:
+            # A map in a list: "- key: value", the other keys line up with key.
+            child = NestedDict()
+            container.append( child )
+            self._stack.append( _Frame( col, child ) )
+            self._entry( child, where, text, value, col )
+            return
+        container.append( self._scalar( where, value, col, indent ) )
+
+    def _split_key( self, content : str ) -> typing.Optional[tuple]:
+        '''
+        If content is "key: value" return ( key, value ), value may be ''
+        otherwise return None.
+        '''
+        c = content[0]
+        if c in '"\'':
+            m = (re_double_quoted if c == '"' else re_single_quoted).match( content )
+            if m is None:
+                return None
+            end = m.end()
+            if not content.startswith( ':', end ):
+                return None
+            rest = content[ end+1: ]
+            if rest and (rest[0] != ' '):
+                return None
+            key = self._quoted( m, c )
+        else:
+            end = content.find( ': ' )
+            if end < 0:
+                if not content.endswith( ':' ):
+                    return None
+                end = len(content) - 1
+            comment = content.find( ' #' )
+            if 0 <= comment < end:
+                # The ": " is in a comment.
+                return None
+            key = content[ :end ].rstrip( ' ' )
+            rest = content[ end+1: ]
+        return ( key, rest.lstrip( ' ' ) )
+
+    def _entry( self, container : NestedDict, where : Where, text : str, content : str, indent : int ):
+        '''
+        A map entry "key: value", content starts at column indent.
+        '''
+        if _is_item( content ):
+            self._error("a list item where a key: value was expected")
+        kv = self._split_key( content )
+        if kv is None:
+            self._error("expected key: value")
+        key, value = kv
+        if container.get_key( key, _MISSING ) is not _MISSING:
+            self._error("duplicate key: %s" % key )
+        key = WhereStr.fast( key, _where_from_id( where[0], where[1], indent + 1 ) )
+        if (len(value) == 0) or (value[0] == '#'):
+            # The value is the block below, if any.
+            self._pending = ( container, key, indent )
+            return
+        col = indent + len(content) - len(value)
+        container.set_key( key, self._scalar( where, value, col, indent ) )
+
+    def _quoted( self, m, quote : str ) -> str:
+        if quote == '"':
+            return re_escape.sub( _unescape, m.group(1) )
+        return m.group(1).replace( "''", "'" )
+
+    def _check_rest( self, rest : str ):
+        '''
+        After a quoted string or flow list only a comment may follow.
+        '''
+        rest = rest.strip( ' ' )
+        if rest and (rest[0] != '#'):
+            self._error("unexpected text after the value: %s" % rest )
+
+    def _scalar( self, where : Where, value : str, col : int, indent : int ):
+        '''
+        Return the value that starts at column col (0 based) of the line.
+        indent is the column of the key (or "-") that owns it.
+        '''
+        self.values = self.values + 1
+        w = _where_from_id( where[0], where[1], col + 1 )
+        c = value[0]
+        if c in '"\'':
+            if value.startswith( '"""' ):
+                return self._triple_quoted( value, w )
+            m = (re_double_quoted if c == '"' else re_single_quoted).match( value )
+            if m is None:
+                self._error("unterminated quoted string, strings cannot span lines (use | or \"\"\")")
+            self._check_rest( value[ m.end(): ] )
+            return WhereStr.fast( self._quoted( m, c ), w )
+        if c in '|>':
+            return self._block( value, indent, w )
+        if c == '[':
+            return self._flow_list( where, value, col )
+        if c == '{':
+            if value.rstrip( ' ' ) != '{}':
+                self._error("flow maps are not supported, only {}")
+            return NestedDict()
+        if c in '&*!%@`':
+            self._error("anchors, aliases and tags are not supported: %s" % value )
+        comment = value.find( ' #' )
+        if comment >= 0:
+            value = value[ :comment ]
+        return WhereStr.fast( value.rstrip( ' ' ), w )
+
+    def _flow_list( self, where : Where, value : str, col : int ) -> list:
+        '''
+        [ a, b, "c" ] on one line.
+        '''
+        end = value.rfind( ']' )
+        if end < 0:
+            self._error("missing ] at the end of the list, a flow list must be on one line")
+        self._check_rest( value[ end+1: ] )
+        inner = value[ 1:end ]
+        result = []
+        if len(inner.strip( ' ' )) == 0:
+            return result
+        pos = 0
+        while pos <= len(inner):
+            m = re_flow_item.match( inner, pos )
+            item = m.group(1)
+            if item:
+                c = item[0]
+                if c in '[{':
+                    self._error("nested flow collections are not supported")
+                w = _where_from_id( where[0], where[1], col + 2 + m.start(1) )
+                if c in '"\'':
+                    q = (re_double_quoted if c == '"' else re_single_quoted).match( item )
+                    if (q is None) or (q.end() != len(item)):
+                        self._error("bad quoted string in a flow list: %s" % item )
+                    item = self._quoted( q, c )
+                result.append( WhereStr.fast( item, w ) )
+            elif m.group(2) == ',':
+                self._error("empty item in a flow list")
+            if m.group(2) != ',':
+                break
+            pos = m.end()
+        return result
+
+    def _block( self, header : str, indent : int, w : Where ) -> WhereStr:
+        '''
+        A block string: "|" literal or ">" folded, the lines below that are
+        indented more than indent (the column of the key)
+        '''
+        m = re_block_header.match( header )
+        if m is None:
+            self._error("bad block string header: %s" % header )
+        style = m.group(1)
+        chomp = m.group(2) or m.group(5) or ''
+        digit = m.group(3) or m.group(4)
+        block_indent = (indent + int(digit)) if digit else None
+        lines = []
+        first_where = None
+        while True:
+            line = self._next_line()
+            if len(line) == 0:
+                break
+            text = line.rstrip( '\r\n' )
+            stripped = text.lstrip( ' ' )
+            if len(stripped) == 0:
+                lines.append( '' )
+                continue
+            n = len(text) - len(stripped)
+            if block_indent is None:
+                if n <= indent:
+                    self._pushed_back = line
+                    break
+                block_indent = n
+            if n < block_indent:
+                # The end of the block, this line is for the caller.
+                self._pushed_back = line
+                break
+            if first_where is None:
+                first_where = _where_from_id( line.where[0], line.where[1], block_indent + 1 )
+            lines.append( text[ block_indent: ] )
+        # Trailing blank lines are kept only with "+"
+        n = len(lines)
+        while n and (len(lines[n-1]) == 0):
+            n = n - 1
+        trailing = len(lines) - n
+        lines = lines[ :n ]
+        if style == '|':
+            text = '\n'.join( lines )
+        else:
+            # Folded: lines are joined with a space, a blank line is a newline,
+            # and more indented lines keep their newlines.
+            parts = []
+            prev = None
+            for l in lines:
+                if prev is None:
+                    parts.append( l )
+                elif len(l) == 0:
+                    parts.append( '\n' )
+                elif len(prev) == 0:
+                    parts.append( l )
+                elif (l[0] == ' ') or (prev[0] == ' '):
+                    parts.append( '\n' + l )
+                else:
+                    parts.append( ' ' + l )
+                prev = l
+            text = ''.join( parts )
+        if chomp == '+':
+            text = text + '\n' * ((1 if lines else 0) + trailing)
+        elif (chomp != '-') and lines:
+            text = text + '\n'
+        return WhereStr.fast( text, first_where or w )
+
+    def _triple_quoted( self, value : str, w : Where ) -> WhereStr:
+        '''
+        A multi-line string, from the opening triple quote to the closing one.
+        The newline right after the opening quotes is not part of the text.
+        The lines are read raw, without preprocessing, from the current file.
+        '''
+        body = value[3:]
+        end = body.find( '"""' )
+        if end >= 0:
+            self._check_rest( body[ end+3: ] )
+            return WhereStr.fast( body[ :end ], w )
+        parts = []
+        if body.strip( ' ' ):
+            parts.append( body + '\n' )
+        while True:
+            line = self.parser.raw_next_line()
+            if len(line) == 0:
+                self._error('unterminated """ string, it started at: %s (it cannot cross an include file)' % str(w) )
+            self.lines = self.lines + 1
+            end = line.find( '"""' )
+            if end >= 0:
+                parts.append( line[ :end ] )
+                self._check_rest( line[ end+3: ].rstrip( '\r\n' ) )
+                break
+            parts.append( str(line) )
+        return WhereStr.fast( ''.join( parts ), w )